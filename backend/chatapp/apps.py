@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ChatappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatapp'
+
+    def ready(self):
+        # Branche l'invalidation du registre des modèles sur les signaux de LLMConfiguration
+        from . import registry  # noqa: F401
+        # Encodages tiktoken chargés hors du chemin des requêtes (téléchargement éventuel)
+        from .tokens import token_counter, tokenizer_settings
+        if tokenizer_settings().get("preload_on_startup", True):
+            token_counter.start_preload()
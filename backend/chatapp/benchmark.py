@@ -0,0 +1,463 @@
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .errors import ERROR_CHUNK_PREFIX
+from .metrics import _percentile
+from .resilience import circuit_breakers
+from .tokens import token_counter
+
+GENERATE_PATH = "/api/chat/message/generate/"
+
+# Cas de référence du banc de charge : utilisateurs simultanés, tours par utilisateur et profil
+# du fournisseur simulé (LLM_FAKE_PROVIDER), éventuellement ajusté par `profile`
+BENCHMARK_SCENARIOS = {
+    "steady": {"model": "fake", "users": 20, "turns": 3,
+               "description": "charge nominale, conversations de plusieurs tours"},
+    "burst": {"model": "fake-fast", "users": 100, "turns": 1,
+              "description": "pic de premiers messages simultanés"},
+    "long-answers": {"model": "fake", "users": 10, "turns": 2, "profile": {"tokens": 800, "token_delay": 0.005},
+                     "description": "réponses longues à haut débit (regroupement, écriture différée)"},
+    "slow-ttft": {"model": "fake-slow", "users": 20, "turns": 1,
+                  "description": "provider lent à répondre (flux ouverts en attente)"},
+    "flaky-429": {"model": "fake-flaky", "users": 20, "turns": 2,
+                  "description": "429 intermittents (retries, budget, disjoncteur)"},
+    "midstream": {"model": "fake-midstream", "users": 10, "turns": 1,
+                  "description": "coupure du flux provider en cours de réponse"},
+}
+
+# Questions ouvertes posées à tour de rôle : aucune ne relève d'une réponse directe du parcours
+# (pièces manquantes, devis), chaque tour passe donc par le LLM
+BENCHMARK_QUESTIONS = [
+    "Comment se passe le paiement par Mobile Money ?",
+    "Quels sont vos délais de traitement en général ?",
+    "Pouvez-vous m'expliquer votre démarche en ligne ?",
+    "Avez-vous des agences en dehors de Cotonou ?",
+]
+
+# Métriques comparées d'une exécution à l'autre, et sens de l'amélioration
+REGRESSION_METRICS = {
+    "ttft_p50_ms": "lower",
+    "ttft_p95_ms": "lower",
+    "ttft_p99_ms": "lower",
+    "tokens_per_second": "higher",
+    "db_queries_per_turn": "lower",
+    "peak_rss_mb": "lower",
+    "peak_threads": "lower",
+}
+
+
+def _rss_bytes() -> int:
+    """RSS courante du process (Linux), sinon le pic connu du noyau"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _os_threads() -> int:
+    """Threads du process vus par le système (threads natifs compris), sinon threads Python"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return threading.active_count()
+
+
+class ResourceSampler:
+    """Relevé périodique de la RSS et du nombre de threads pendant un scénario (pics et point de départ)"""
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_rss = self.peak_rss = _rss_bytes()
+        self.start_threads = self.peak_threads = _os_threads()
+        self.peak_python_threads = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="benchmark-sampler", daemon=True)
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, _rss_bytes())
+        self.peak_threads = max(self.peak_threads, _os_threads())
+        self.peak_python_threads = max(self.peak_python_threads, threading.active_count())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+class QueryCounter:
+    """
+    Requêtes SQL de toutes les connexions du process : threads de requête, boucle ASGI
+    et écrivains différés (messages, consommation), via un execute_wrapper par connexion.
+    """
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._wrapped = []
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+            self._wrapped.append(connection)
+
+    def __enter__(self):
+        connection_created.connect(self._attach, weak=False, dispatch_uid=f"benchmark-{id(self)}")
+        for connection in connections.all(initialized_only=True):
+            self._attach(connection)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(dispatch_uid=f"benchmark-{id(self)}")
+        for connection in self._wrapped:
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class TurnResult:
+    """Un tour vu du client : statut, TTFT, durée et texte reçu"""
+    def __init__(self, user: int, turn: int, started_at: float):
+        self.user = user
+        self.turn = turn
+        self.started_at = started_at
+        self.status: Optional[int] = None
+        self.first_byte_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.parts: List[bytes] = []
+
+    def on_body(self, chunk: bytes):
+        if not chunk:
+            return
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+        self.parts.append(chunk)
+
+    def result(self, model_id: str) -> Dict[str, Any]:
+        text = b"".join(self.parts).decode("utf-8", errors="replace")
+        error = None
+        if ERROR_CHUNK_PREFIX in text:
+            text, _, raw = text.partition(ERROR_CHUNK_PREFIX)
+            try:
+                error = json.loads(ERROR_CHUNK_PREFIX + raw).get("type", "generation")
+            except ValueError:
+                error = "generation"
+        elif self.status != 200:
+            error = f"http_{self.status}"
+        finished_at = self.finished_at or time.perf_counter()
+        return {
+            "user": self.user,
+            "turn": self.turn,
+            "status": self.status,
+            "error": error,
+            "ttft": self.first_byte_at - self.started_at if self.first_byte_at and not error else None,
+            "duration": finished_at - self.started_at,
+            "streaming_time": finished_at - self.first_byte_at if self.first_byte_at else 0.0,
+            "tokens": token_counter.count(text, model_id) if text and self.status == 200 else 0,
+        }
+
+
+def turn_body(user: int, turn: int, chat_id: str, model_id: str) -> bytes:
+    """Message d'un tour : contenu distinct par tour pour ne pas rejoindre un flux en cours (idempotence)"""
+    question = BENCHMARK_QUESTIONS[(user + turn) % len(BENCHMARK_QUESTIONS)]
+    return json.dumps({
+        "content": f"Tour {turn + 1} de l'utilisateur {user} : {question}",
+        "chatId": chat_id,
+        "modelId": model_id,
+        "autoRoute": False,
+    }).encode("utf-8")
+
+
+class WsgiDriver:
+    """Pile WSGI : WSGIHandler appelé par N threads, comme les workers d'un serveur threadé"""
+    stack = "wsgi"
+
+    def __init__(self):
+        self.application = WSGIHandler()
+
+    def turn(self, user: int, turn: int, body: bytes, token: str, model_id: str) -> Dict[str, Any]:
+        result = TurnResult(user, turn, time.perf_counter())
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": GENERATE_PATH,
+            "QUERY_STRING": "",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "localhost",
+            "HTTP_AUTHORIZATION": f"Bearer {token}",
+            "REMOTE_ADDR": "127.0.0.1",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+
+        def start_response(status, headers, exc_info=None):
+            result.status = int(status.split(" ", 1)[0])
+
+        response = self.application(environ, start_response)
+        try:
+            for chunk in response:
+                result.on_body(chunk)
+        finally:
+            # Comme un serveur WSGI : close() déclenche request_finished (connexions, flux)
+            response.close()
+        result.finished_at = time.perf_counter()
+        return result.result(model_id)
+
+    def run(self, users: List[Dict[str, Any]], turns: int, model_id: str, think: float) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+
+        def simulate(index: int, user: Dict[str, Any]):
+            chat_id = str(uuid4())
+            for turn in range(turns):
+                outcome = self.turn(index, turn, turn_body(index, turn, chat_id, model_id), user["token"], model_id)
+                with lock:
+                    results.append(outcome)
+                if think:
+                    time.sleep(think)
+
+        threads = [threading.Thread(target=simulate, args=(index, user), name=f"benchmark-user-{index}")
+                   for index, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+class AsgiDriver:
+    """Pile ASGI : ASGIHandler appelé par N tâches sur une boucle d'événements, comme uvicorn"""
+    stack = "asgi"
+
+    def __init__(self):
+        self.application = ASGIHandler()
+
+    async def turn(self, user: int, turn: int, body: bytes, token: str, model_id: str) -> Dict[str, Any]:
+        result = TurnResult(user, turn, time.perf_counter())
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": GENERATE_PATH,
+            "raw_path": GENERATE_PATH.encode("ascii"),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"authorization", f"Bearer {token}".encode("ascii")),
+            ],
+            "client": ("127.0.0.1", 40000 + user),
+            "server": ("localhost", 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Le client reste connecté jusqu'à la fin de la réponse
+            await response_done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                result.status = message["status"]
+            elif message["type"] == "http.response.body":
+                result.on_body(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_done.set()
+
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            response_done.set()
+        result.finished_at = time.perf_counter()
+        return result.result(model_id)
+
+    def run(self, users: List[Dict[str, Any]], turns: int, model_id: str, think: float) -> List[Dict[str, Any]]:
+        async def simulate(index: int, user: Dict[str, Any]):
+            outcomes = []
+            chat_id = str(uuid4())
+            for turn in range(turns):
+                outcomes.append(await self.turn(index, turn, turn_body(index, turn, chat_id, model_id),
+                                                user["token"], model_id))
+                if think:
+                    await asyncio.sleep(think)
+            return outcomes
+
+        async def main():
+            per_user = await asyncio.gather(*(simulate(index, user) for index, user in enumerate(users)))
+            return [outcome for outcomes in per_user for outcome in outcomes]
+
+        return asyncio.run(main())
+
+
+DRIVERS = {"wsgi": WsgiDriver, "asgi": AsgiDriver}
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 1) if value is not None else None
+
+
+def summarize(turns: List[Dict[str, Any]], wall: float, queries: int, sampler: ResourceSampler) -> Dict[str, Any]:
+    """Statistiques d'un scénario sur une pile"""
+    ok = [turn for turn in turns if not turn["error"]]
+    ttfts = [turn["ttft"] for turn in ok if turn["ttft"] is not None]
+    stream_rates = [(turn["tokens"] - 1) / turn["streaming_time"] for turn in ok
+                    if turn["tokens"] > 1 and turn["streaming_time"] > 0]
+    tokens = sum(turn["tokens"] for turn in turns)
+    return {
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "error_types": dict(Counter(turn["error"] for turn in turns if turn["error"])),
+        "wall_s": round(wall, 3),
+        "turns_per_second": round(len(turns) / wall, 2) if wall else None,
+        "ttft_p50_ms": _ms(_percentile(ttfts, 0.5)),
+        "ttft_p95_ms": _ms(_percentile(ttfts, 0.95)),
+        "ttft_p99_ms": _ms(_percentile(ttfts, 0.99)),
+        "ttft_max_ms": _ms(max(ttfts) if ttfts else None),
+        "latency_p50_ms": _ms(_percentile([turn["duration"] for turn in turns], 0.5)),
+        "latency_p95_ms": _ms(_percentile([turn["duration"] for turn in turns], 0.95)),
+        "tokens": tokens,
+        "tokens_per_second": round(tokens / wall, 1) if wall else None,
+        "stream_tokens_per_second_p50": round(_percentile(stream_rates, 0.5), 1) if stream_rates else None,
+        "db_queries": queries,
+        "db_queries_per_turn": round(queries / len(turns), 2) if turns else None,
+        "start_rss_mb": round(sampler.start_rss / 2 ** 20, 1),
+        "peak_rss_mb": round(sampler.peak_rss / 2 ** 20, 1),
+        "start_threads": sampler.start_threads,
+        "peak_threads": sampler.peak_threads,
+        "peak_python_threads": sampler.peak_python_threads,
+    }
+
+
+def flush_writers():
+    """Écritures différées du tour (contenu des messages, consommation) comptées avec lui"""
+    from .persistence import message_writer
+    from .usage import usage_recorder
+    message_writer.flush()
+    usage_recorder.flush()
+
+
+def run_scenario(stack: str, users: List[Dict[str, Any]], turns: int, model_id: str,
+                 think: float = 0.0) -> Dict[str, Any]:
+    """
+    Exécute un scénario sur une pile (`wsgi` ou `asgi`) : chaque utilisateur simulé enchaîne
+    `turns` tours dans sa propre conversation, tous les utilisateurs en même temps.
+    Chaque exécution part de disjoncteurs fermés pour le fournisseur simulé : un cas
+    d'erreurs ne pénalise pas la pile ou le cas suivant.
+    """
+    driver = DRIVERS[stack]()
+    circuit_breakers.reset("fake:")
+    flush_writers()
+    with ResourceSampler() as sampler, QueryCounter() as queries:
+        started = time.perf_counter()
+        turn_results = driver.run(users, turns, model_id, think)
+        wall = time.perf_counter() - started
+        flush_writers()
+    return summarize(turn_results, wall, queries.count, sampler)
+
+
+def server_errors(report: Dict[str, Any]) -> Dict[str, int]:
+    """Tours terminés en HTTP 500 par cas : un banc qui en compte mesure une panne, pas une charge"""
+    counts = {bench["name"]: bench["stats"]["error_types"].get("http_500", 0) for bench in report["benchmarks"]}
+    return {name: count for name, count in counts.items() if count}
+
+
+def commit_info() -> Dict[str, Any]:
+    """Commit courant du dépôt (absent hors d'un dépôt git)"""
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    try:
+        return {
+            "id": git("rev-parse", "HEAD") or None,
+            "branch": git("rev-parse", "--abbrev-ref", "HEAD") or None,
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        }
+    except (OSError, subprocess.SubprocessError):
+        return {"id": None, "branch": None, "dirty": None}
+
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        "python_version": platform.python_version(),
+        "django_version": django.get_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "database": connections["default"].vendor,
+    }
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Écarts entre deux exécutions, par cas (`scenario[pile]`) et métrique de REGRESSION_METRICS.
+    Seuls les cas exécutés avec les mêmes paramètres sont comparés. `change` est relatif
+    à la référence, positif quand la mesure s'est dégradée.
+    """
+    reference = {bench["name"]: bench for bench in baseline.get("benchmarks", [])}
+    rows = []
+    for bench in current.get("benchmarks", []):
+        before = reference.get(bench["name"])
+        if before is None or before.get("params") != bench["params"]:
+            continue
+        for metric, better in REGRESSION_METRICS.items():
+            old, new = before["stats"].get(metric), bench["stats"].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append({
+                "name": bench["name"],
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": round(change if better == "lower" else -change, 4),
+            })
+    return rows
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from .errors import ERROR_CHUNK_PREFIX
+
+
+def response_cache_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_RESPONSE_CACHE", {})
+
+
+_SPACES_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?!.…;:,]+$")
+
+
+def normalize_text(text: str) -> str:
+    """Forme canonique d'une question : casse, espaces et ponctuation finale ignorés"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _SPACES_RE.sub(" ", text).strip()
+    return _TRAILING_PUNCT_RE.sub("", text)
+
+
+def compact_history(messages: Iterable[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """Historique réduit à (auteur, texte normalisé), sans les messages vides (réponse en attente)"""
+    return [
+        (msg.get("author", ""), normalize_text(msg.get("content", "")))
+        for msg in messages
+        if (msg.get("content") or "").strip()
+    ]
+
+
+class CacheEntry:
+    def __init__(self, text: str, expires_at: float):
+        self.text = text
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class ResponseCache:
+    """
+    Cache exact des réponses, partagé par tout le process (LRU borné à `max_entries`,
+    expiration après `ttl` secondes). La clé couvre tout ce qui détermine le prompt et
+    l'échantillonnage : question normalisée, historique compacté, empreinte du template,
+    modèle, température et max_tokens. Seules les réponses complètes sans erreur sont
+    enregistrées ; un succès est rejoué en flux à un rythme réaliste.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return response_cache_settings().get("enabled", True)
+
+    def key_for(self, payload: Dict[str, Any], template: str, model_id: str) -> Optional[str]:
+        """Clé du tour, ou None s'il n'est pas cacheable (cache désactivé, historique trop long)"""
+        if not self.enabled():
+            return None
+        history = compact_history(payload.get("messages", []))
+        if len(history) > response_cache_settings().get("max_history_messages", 4):
+            return None
+        raw = json.dumps([
+            normalize_text(payload.get("content", "")),
+            history,
+            hashlib.sha256(template.encode("utf-8")).hexdigest(),
+            model_id,
+            payload.get("temperature", 0.7),
+            payload.get("maxTokens", 2000),
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            self.tokens_saved += len(entry.text) // 4
+            return entry.text
+
+    def store(self, key: Optional[str], chunks: List[str]):
+        """Enregistre une réponse complète (ignorée si le flux contient une erreur)"""
+        if key is None or not chunks or any(chunk.startswith(ERROR_CHUNK_PREFIX) for chunk in chunks):
+            return
+        conf = response_cache_settings()
+        text = "".join(chunks)
+        if len(text) > conf.get("max_answer_chars", 20000):
+            return
+        with self._lock:
+            self._entries[key] = CacheEntry(text, time.monotonic() + conf.get("ttl", 3600))
+            self._entries.move_to_end(key)
+            self.stores += 1
+            max_entries = conf.get("max_entries", 500)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _replay_plan(text: str) -> Iterator[Tuple[str, float]]:
+        """Découpe la réponse en fragments et calcule la pause avant chacun (le premier part aussitôt)"""
+        conf = response_cache_settings()
+        size = max(conf.get("replay_chunk_chars", 24), 1)
+        tokens_per_second = conf.get("replay_tokens_per_second", 200)
+        previous = 0
+        for start in range(0, len(text), size):
+            chunk = text[start:start + size]
+            delay = previous / 4 / tokens_per_second if tokens_per_second else 0.0
+            previous = len(chunk)
+            yield chunk, delay
+
+    def replay(self, text: str) -> Iterator[str]:
+        for chunk, delay in self._replay_plan(text):
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    async def areplay(self, text: str):
+        for chunk, delay in self._replay_plan(text):
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled(),
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+# Instance partagée par tout le process
+response_cache = ResponseCache()
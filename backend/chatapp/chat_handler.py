@@ -1,163 +1,262 @@
 import os
-import json
-import queue
-import threading
+import asyncio
 import logging
+import threading
 import traceback
 import time
-from typing import Dict, Any, Generator, Optional
+from concurrent import futures
+from typing import Dict, Any, AsyncGenerator, Generator, Optional
+
+from django.conf import settings
 
 # Import des composants de LangChain
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain.memory import ConversationBufferMemory
+from langchain.schema import HumanMessage
 from langchain.prompts import PromptTemplate
 
-# Callback personnalisé pour le streaming
-class StreamingCallbackHandler(BaseCallbackHandler):
+class LLMRun:
     """
-    Callback handler qui place chaque token généré dans une file d'attente.
-    Une fois la génération terminée, un sentinel (None) est placé pour signaler la fin.
+    Appel LLM en cours : modèle, prompt et flux natif du provider (llm.stream / llm.astream),
+    lu directement par le générateur de réponse, sans callback ni file intermédiaire ; seule
+    une lecture à attente bornée (tampon de regroupement en attente) passe par un thread de
+    lecture (WSGI) ou une tâche de la boucle (ASGI).
+    Une erreur du provider termine le flux et reste dans `exception` ; la consommation
+    annoncée dans le dernier fragment (modèles de chat) reste dans `usage`.
     """
-    def __init__(self):
-        self.queue = queue.Queue()
-        self.done = False
+    def __init__(self, model_id: str, formatted_prompt: str, stream=None):
+        self.model_id = model_id
+        self.formatted_prompt = formatted_prompt
+        self.stream = stream
+        self.started_at = time.perf_counter()
+        self.exception = None
+        self.usage = None
+        # Lecture sur un autre thread (read_token / abort) ou en tâche de fond (attente bornée)
+        self._lock = threading.Lock()
+        self._reading = False
+        self._close_response = None
+        self._pending_read = None
+        self.aborted = False
 
-    def on_llm_new_token(self, token: str, **kwargs):
-        self.queue.put(token)
+    def text(self, chunk) -> str:
+        """LlamaLLM produit des chaînes, les modèles de chat des AIMessageChunk"""
+        if isinstance(chunk, str):
+            return chunk
+        usage = chunk_usage(chunk)
+        if usage:
+            self.usage = usage
+        return chunk.content if isinstance(chunk.content, str) else ""
+
+    def _read(self) -> Optional[str]:
+        try:
+            for chunk in self.stream:
+                text = self.text(chunk)
+                if text:
+                    return text
+        except Exception as e:
+            self.exception = e
+        return None
+
+    def next_token(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Prochain texte non vide du flux ; None en fin de flux ou en cas d'erreur.
+        Avec `timeout`, la lecture passe par token_read_executor et l'attente est bornée :
+        TimeoutError si rien n'est arrivé, la lecture continue et l'appel suivant la reprend.
+        Sans thread de lecture libre, la lecture est faite directement, sans borne.
+        """
+        if self._pending_read is None and timeout is not None:
+            self._pending_read = token_read_executor.try_submit(self.read_token)
+        if self._pending_read is None:
+            return self._read()
+        token = self._pending_read.result(timeout)
+        self._pending_read = None
+        return token
+
+    async def _aread(self) -> Optional[str]:
+        try:
+            async for chunk in self.stream:
+                text = self.text(chunk)
+                if text:
+                    return text
+        except Exception as e:
+            self.exception = e
+        return None
+
+    async def anext_token(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Variante asynchrone de next_token : avec `timeout`, la lecture est une tâche de la boucle
+        que l'expiration (asyncio.TimeoutError) n'annule pas ; l'appel suivant la reprend.
+        """
+        if self._pending_read is None:
+            if timeout is None:
+                return await self._aread()
+            self._pending_read = asyncio.ensure_future(self._aread())
+        done, _ = await asyncio.wait({self._pending_read}, timeout=timeout)
+        if not done:
+            raise asyncio.TimeoutError()
+        task, self._pending_read = self._pending_read, None
+        return task.result()
+
+    def bind_response(self, close_response):
+        """Fermeture de la réponse HTTP, exposée par les providers qui le permettent (`on_response`)"""
+        with self._lock:
+            self._close_response = close_response
+            aborted = self.aborted
+        if aborted:
+            close_response()
+
+    def read_token(self) -> Optional[str]:
+        """Lecture pour le compte d'un autre thread : un flux abandonné pendant la lecture est fermé à sa fin"""
+        with self._lock:
+            if self.aborted:
+                return None
+            self._reading = True
+        try:
+            return self._read()
+        finally:
+            with self._lock:
+                self._reading = False
+            if self.aborted:
+                self.close()
+
+    def abort(self):
+        """
+        Abandon depuis un autre thread, même pendant une lecture en cours : la réponse du provider
+        est fermée tout de suite (la lecture bloquée échoue), le flux par le thread lecteur.
+        """
+        with self._lock:
+            self.aborted = True
+            reading = self._reading
+            close_response = self._close_response
+        if close_response is not None:
+            try:
+                close_response()
+            except Exception as e:
+                logging.warning(f"Fermeture de la réponse {self.model_id} : {e}")
+        if not reading:
+            self.close()
+
+    def close(self):
+        """Interrompt le flux : la réponse HTTP du provider est fermée au lieu d'être consommée"""
+        try:
+            self.stream.close()
+        except Exception as e:
+            logging.warning(f"Fermeture du flux {self.model_id} : {e}")
+
+    async def aclose(self):
+        if self._pending_read is not None:
+            # Lecture en tâche de fond (attente bornée) : annulée avant la fermeture du flux
+            self._pending_read.cancel()
+            await asyncio.gather(self._pending_read, return_exceptions=True)
+            self._pending_read = None
+        try:
+            await self.stream.aclose()
+        except Exception as e:
+            logging.warning(f"Fermeture du flux {self.model_id} : {e}")
 
-    def on_llm_end(self, response, **kwargs):
-        self.done = True
-        self.queue.put(None)
-        
-    def on_llm_error(self, error: Exception, **kwargs):
-        """Gestion des erreurs du LLM"""
-        self.queue.put({"error": True, "message": str(error), "type": "llm_error"})
-        self.queue.put(None)  # Sentinel pour indiquer la fin
 
 # Import des LLM pour différents providers
 from langchain_openai import ChatOpenAI  # Pour OpenAI
 from langchain_community.chat_models import ChatAnthropic  # Pour Anthropic, etc.
 import getpass
 from .llama import LlamaLLM  # Notre LlamaLLM personnalisé
-from langchain.callbacks.manager import CallbackManager  # Utilisation de CallbackManager avec le paramètre 'handlers'
-
-class ChatHandlerError(Exception):
-    """Classe d'erreur personnalisée pour le ChatHandler"""
-    def __init__(self, message: str, error_type: str = "generation", status_code: int = 500, details: Optional[str] = None):
-        self.message = message
-        self.error_type = error_type
-        self.status_code = status_code
-        self.details = details
-        super().__init__(self.message)
-        
-    def to_dict(self) -> Dict[str, Any]:
-        """Convertit l'erreur en dictionnaire pour le frontend"""
-        error_dict = {
-            "error": True,
-            "message": self.message,
-            "type": self.error_type,
-            "status": self.status_code
-        }
-        if self.details:
-            error_dict["details"] = self.details
-        return error_dict
-        
-    def to_json(self) -> str:
-        """Convertit l'erreur en JSON pour le streaming"""
-        return json.dumps(self.to_dict())
+from .fake import FakeLLM, fake_profile, fake_provider_settings
+from .caching import response_cache
+from .errors import ChatHandlerError
+from .providers import provider_clients
+from .pacing import rate_limit_pacer
+from .executor import first_token_executor, token_read_executor
+from .metrics import generation_metrics
+from .streaming import TokenCoalescer
+from .resilience import RetryPolicy, circuit_breakers, retry_budget
+from .semantic import semantic_cache
+from .context import context_builder
+from .funnel import funnel_tracker
+from .tokens import token_counter
+from .usage import chunk_usage, usage_recorder
+from .registry import ModelSpec, model_registry
+from .routing import model_router
+from .hedging import hedge_policy
 
 if not os.environ.get("OPENAI_API_KEY"):
     os.environ["OPENAI_API_KEY"] = getpass.getpass("Enter your OpenAI API key: ")
 
-class ChatHandler:
-    """
-    Classe responsable de gérer la génération de réponse en streaming pour le chat.
-    """
-    def __init__(self):
-        # On pourrait charger ici une configuration globale (mappings modelId -> provider, etc.)
-        self.max_retries = 3
-        self.retry_delay = 2  # Délai initial en secondes pour le backoff exponentiel
-        
-    def get_llm(self, model_id: str, temperature: float, max_tokens: int):
-        """Retourne l'instance du LLM appropriée selon le modèle demandé"""
-        try:
-            # Pour le modèle Llama, on retourne notre LlamaLLM personnalisé
-            if model_id.lower() in ["llama", "llama-3.1-70b", "llama-3.1-70b-versatile"]:
-                return LlamaLLM(temperature=temperature, max_tokens=max_tokens)
-                
-            # Pour les modèles Claude d'Anthropic
-            if model_id.lower().startswith("claude"):
-                return ChatAnthropic(
-                    model=model_id,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    streaming=True,
-                )
-                
-            # Sinon, on utilise ChatOpenAI par défaut
-            return ChatOpenAI(
-                model=model_id,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                streaming=True,
-            )
-        except Exception as e:
-            # Gérer les erreurs d'initialisation du LLM
-            raise ChatHandlerError(
-                message=f"Erreur lors de l'initialisation du modèle {model_id}: {str(e)}",
-                error_type="model_init_error",
-                status_code=500,
-                details=traceback.format_exc()
-            )
+DEFAULT_MODEL_ID = "gpt-3.5-turbo"
 
-    def generate_response(self, payload: Dict[str, Any]) -> Generator[str, None, None]:
-        """Génère une réponse token par token à partir d'un modèle LLM"""
-        # Vérification des paramètres requis
-        # if not payload.get("messages"):
-        #     raise ChatHandlerError(
-        #         message="Historique de messages non fourni",
-        #         error_type="validation",
-        #         status_code=400
-        #     )
-            
-        # Extraction des paramètres du payload
-        content = payload.get("content", "")
-        if not content.strip():
-            raise ChatHandlerError(
-                message="Le contenu du message ne peut pas être vide",
-                error_type="validation",
-                status_code=400
-            )
-            
-        messages = payload.get("messages", [])
-        model_id = payload.get("modelId", "gpt-3.5-turbo")
-        temperature = payload.get("temperature", 0.7)
-        max_tokens = payload.get("maxTokens", 2000)
-        retries = 0
-        
-        while retries <= self.max_retries:
-            # Stockage de l'exception pour la propager à la fin si nécessaire
-            self.exception = None
-            callback_handler = StreamingCallbackHandler()
-            
-            try:
-                # Préparation de la mémoire de la conversation
-                memory = ConversationBufferMemory(return_messages=True)
-                for msg in messages:
-                    role = msg.get("author")
-                    text = msg.get("content", "")
-                    if role == "user":
-                        memory.chat_memory.add_user_message(text)
-                    elif role == "assistant":
-                        memory.chat_memory.add_ai_message(text)
-                    elif role == "system":
-                        memory.chat_memory.add_message(SystemMessage(content=text))
-
-                # Gestion du template
-                prompt_template_str = payload.get("promptTemplate")
-                if not prompt_template_str:
-                    prompt_template_str = ( """
+
+# Les `params` du registre complètent les arguments du LLM ; température et max_tokens
+# du tour restent prioritaires
+def _groq_llm(spec: ModelSpec, temperature: float, max_tokens: int, in_event_loop: bool):
+    # Notre LlamaLLM personnalisé
+    return LlamaLLM(**{
+        **spec.params,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "model": spec.provider_model,
+        "base_url": spec.endpoint,
+        "api_key": spec.api_key,
+    })
+
+
+def _anthropic_llm(spec: ModelSpec, temperature: float, max_tokens: int, in_event_loop: bool):
+    llm = ChatAnthropic(**{
+        **spec.params,
+        "model": spec.provider_model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "streaming": True,
+    })
+    llm.client = provider_clients.anthropic(spec.provider_model, spec.api_key, spec.endpoint)
+    if in_event_loop:
+        llm.async_client = provider_clients.async_anthropic(spec.provider_model, spec.api_key, spec.endpoint)
+    return llm
+
+
+def _openai_llm(spec: ModelSpec, temperature: float, max_tokens: int, in_event_loop: bool):
+    model, api_key = spec.provider_model, spec.api_key
+    return ChatOpenAI(**{
+        **spec.params,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "streaming": True,
+        # Consommation réelle annoncée dans le dernier fragment du flux
+        "stream_usage": True,
+        "api_key": api_key,
+        "base_url": spec.endpoint,
+        "http_client": provider_clients.http_client("openai", model, api_key),
+        "http_async_client": (provider_clients.async_http_client("openai", model, api_key)
+                              if in_event_loop else None),
+    })
+
+
+def _fake_llm(spec: ModelSpec, temperature: float, max_tokens: int, in_event_loop: bool):
+    # Fournisseur simulé (tests de charge) : profil LLM_FAKE_PROVIDER du modèle, puis params du registre
+    if not fake_provider_settings().get("enabled", False):
+        raise ValueError("le fournisseur simulé est désactivé (LLM_FAKE_PROVIDER)")
+    return FakeLLM(**{
+        **fake_profile(spec.provider_model),
+        **spec.params,
+        "model": spec.provider_model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    })
+
+
+# Construction du LLM par provider (ModelSpec.provider)
+LLM_FACTORIES = {
+    "groq": _groq_llm,
+    "anthropic": _anthropic_llm,
+    "openai": _openai_llm,
+    "fake": _fake_llm,
+}
+
+# Providers qui prennent le prompt sous forme de texte plutôt qu'une liste de messages
+TEXT_PROVIDERS = {"groq", "fake"}
+
+# Erreurs imputables au provider (comptées par le disjoncteur) et erreurs transitoires (rejouables)
+PROVIDER_FAILURE_TYPES = {"rate_limit", "timeout", "network", "generation"}
+RETRYABLE_ERROR_TYPES = {"rate_limit", "timeout", "network"}
+
+DEFAULT_PROMPT_TEMPLATE = """
                         Vous êtes OREMI, l'assistant IA d'AFG Assurances Bénin IARDT. Votre mission : faciliter la souscription d'assurance 100% digitale sans paperasse.
 
                         ## PRODUITS AFG DISPONIBLES
@@ -194,157 +293,737 @@ class ChatHandler:
                         Context: {history}
                         User: {input}
                         Assistant:"""
-                    )
-                prompt = PromptTemplate(
-                    input_variables=["history", "input"],
-                    template=prompt_template_str,
-                )
 
-                # Préparation du prompt en injectant l'historique et le message courant
-                history_text = memory.buffer
-                formatted_prompt = prompt.format(history=history_text, input=content)
-
-                # Instanciation de l'LLM
-                llm = self.get_llm(model_id, temperature, max_tokens)
-
-                # Création du CallbackManager
-                callback_manager = CallbackManager(handlers=[callback_handler])
-
-                def run_llm():
-                    try:
-                        if model_id.lower() in ["llama", "llama-3.1-70b", "llama-3.1-70b-versatile"]:
-                            llm.invoke(formatted_prompt, callback_manager=callback_handler)
-                        else:
-                            llm.invoke([HumanMessage(content=formatted_prompt)], callback_manager=callback_handler)
-                    except Exception as e:
-                        logging.error(f"Erreur lors de la génération LLM : {str(e)}\n{traceback.format_exc()}")
-                        self.exception = e
-                        # Envoyer l'erreur dans la file pour la gestion du streaming
-                        error_message = {
-                            "error": True,
-                            "message": str(e),
-                            "type": "generation",
-                            "status": 500,
-                            "details": traceback.format_exc()
-                        }
-                        callback_handler.queue.put(json.dumps(error_message))
-                    finally:
-                        # On s'assure de placer le sentinel pour terminer la boucle de streaming
-                        callback_handler.queue.put(None)
-
-                # Lancer l'appel au LLM dans un thread séparé
-                thread = threading.Thread(target=run_llm)
-                thread.start()
-
-                # Génération en streaming en lisant la file d'attente des tokens
-                while True:
-                    token = callback_handler.queue.get()
-                    if token is None:
-                        break
-                        
-                    # Vérification si c'est un message d'erreur
-                    if isinstance(token, dict) and token.get("error"):
-                        # C'est une erreur du callback, la convertir en JSON pour le frontend
-                        yield json.dumps(token)
-                        break
-                    elif isinstance(token, str) and token.startswith('{"error":'):
-                        # C'est déjà un JSON d'erreur, le transmettre tel quel
-                        print("TOKEN YIELD :::::::::", token)
-                        yield token
-                        break
-                    else:
-                        # C'est un token normal, le transmettre
-                        yield token
-
-                thread.join()
+
+class ChatHandler:
+    """
+    Classe responsable de gérer la génération de réponse en streaming pour le chat.
+    Deux chemins sont disponibles :
+      - generate_response  : générateur synchrone (WSGI), flux du provider lu par le thread de la requête
+      - agenerate_response : générateur asynchrone (ASGI), aucun thread par flux
+    """
+    def __init__(self):
+        self.retry_policy = RetryPolicy.from_settings()
+        
+    def get_llm(self, model_id: str, temperature: float, max_tokens: int):
+        """
+        Retourne l'instance du LLM appropriée selon le modèle demandé.
+        Provider, nom du modèle, endpoint, paramètres et limites proviennent du registre
+        des modèles (LLM_MODEL_REGISTRY + LLMConfiguration) : le routage est une lecture de table.
+        Les clients HTTP/SDK sous-jacents proviennent du registre partagé (keep-alive) :
+        instancier le LLM ne coûte donc plus de poignée de main TLS.
+        """
+        try:
+            spec = model_registry.resolve(model_id)
+            factory = LLM_FACTORIES.get(spec.provider)
+            if factory is None:
+                raise ValueError(f"provider '{spec.provider}' inconnu pour le modèle {model_id}")
+            return factory(spec, temperature, spec.max_tokens(max_tokens), provider_clients.in_event_loop())
+        except Exception as e:
+            # Gérer les erreurs d'initialisation du LLM
+            raise ChatHandlerError(
+                message=f"Erreur lors de l'initialisation du modèle {model_id}: {str(e)}",
+                error_type="model_init_error",
+                status_code=500,
+                details=traceback.format_exc()
+            )
+
+    def provider_for(self, model_id: str) -> str:
+        return model_registry.resolve(model_id).provider
+
+    def provider_model(self, model_id: str) -> str:
+        """Nom du modèle côté provider (celui sous lequel le quota est décompté)"""
+        return model_registry.resolve(model_id).provider_model
+
+    def route(self, payload: Dict[str, Any]) -> str:
+        """
+        Modèle effectivement utilisé pour le tour (LLM_ROUTING) : un tour court ou trivial
+        part sur le candidat le plus rapide mesuré, plutôt que sur le modèle par défaut.
+        Un modèle choisi par le client (`modelId`) est respecté, sauf `autoRoute: true` ;
+        `autoRoute: false` désactive toujours le routage. Le payload est mis à jour
+        (`modelId`, `requestedModelId`).
+        """
+        requested = payload.get("modelId", DEFAULT_MODEL_ID)
+        auto_route = payload.get("autoRoute")
+        if not model_router.enabled() or auto_route is False or ("modelId" in payload and not auto_route):
+            return requested
+        decision = model_router.decide(requested, payload.get("content", ""),
+                                       available=lambda model_id: self.breaker_for(model_id).state != "open")
+        payload["requestedModelId"] = requested
+        payload["modelId"] = decision["chosen"]
+        return decision["chosen"]
+
+    @staticmethod
+    def fallback_for(model_id: str) -> Optional[str]:
+        return getattr(settings, "LLM_FALLBACK_MODELS", {}).get(model_id)
+
+    def breaker_for(self, model_id: str):
+        return circuit_breakers.get(f"{self.provider_for(model_id)}:{model_id}")
+
+    def select_model(self, model_id: str, pinned: bool = False) -> str:
+        """
+        Vérifie le disjoncteur du modèle demandé. S'il est ouvert, bascule sur le modèle
+        de repli configuré (LLM_FALLBACK_MODELS) ; sinon échoue immédiatement en 503.
+        Un modèle épinglé (`pinned`, mode comparaison) n'est jamais remplacé.
+        """
+        breaker = self.breaker_for(model_id)
+        if breaker.allow():
+            return model_id
+        fallback = None if pinned else self.fallback_for(model_id)
+        if fallback and self.breaker_for(fallback).allow():
+            logging.warning(f"Disjoncteur ouvert pour {model_id}, bascule sur {fallback}")
+            return fallback
+        raise ChatHandlerError(
+            message="Le service LLM est momentanément indisponible. Veuillez réessayer dans quelques instants.",
+            error_type="circuit_open",
+            status_code=503,
+            retry_after=breaker.retry_after()
+        )
+
+    @staticmethod
+    def estimate_tokens(formatted_prompt: str, max_tokens: int) -> int:
+        """Estimation grossière (≈ 4 caractères par token) du coût décompté par le provider"""
+        return len(formatted_prompt) // 4 + max_tokens
+
+    def pace(self, model_id: str, estimated_tokens: int, pinned: bool = False,
+             max_wait: Optional[float] = None):
+        """
+        Consulte le quota restant annoncé par le provider avant l'appel.
+        Retourne (modèle, délai) : délai à respecter, éventuellement après bascule
+        sur le modèle de repli (sauf modèle épinglé) si celui-ci peut partir plus tôt. Au-delà de
+        LLM_PACING['max_wait'] (ou de `max_wait` s'il est plus court), on refuse tout de suite
+        en 429 avec Retry-After plutôt que de laisser partir une requête vouée à l'échec.
+        """
+        conf = getattr(settings, "LLM_PACING", {})
+        limit = conf.get("max_wait", 10.0) if max_wait is None else min(max_wait, conf.get("max_wait", 10.0))
+        provider, provider_model = self.provider_for(model_id), self.provider_model(model_id)
+        delay = rate_limit_pacer.delay_for(provider, provider_model, estimated_tokens)
+
+        fallback = None if pinned else self.fallback_for(model_id)
+        if fallback and delay > conf.get("reroute_after", 1.0):
+            fb_provider, fb_model = self.provider_for(fallback), self.provider_model(fallback)
+            fb_delay = rate_limit_pacer.delay_for(fb_provider, fb_model, estimated_tokens)
+            if fb_delay < delay and self.breaker_for(fallback).allow():
+                logging.warning(f"Quota bas pour {model_id} ({delay:.1f}s d'attente), bascule sur {fallback}")
+                self.breaker_for(model_id).release()
+                rate_limit_pacer.record_reroute(provider, provider_model)
+                model_id, provider, provider_model, delay = fallback, fb_provider, fb_model, fb_delay
+
+        if delay > limit:
+            rate_limit_pacer.record_rejection(provider, provider_model)
+            raise ChatHandlerError(
+                message="Limite de requêtes atteinte. Veuillez réessayer plus tard.",
+                error_type="rate_limit",
+                status_code=429,
+                retry_after=int(delay) + 1
+            )
+        rate_limit_pacer.commit(provider, provider_model, estimated_tokens, delay)
+        return model_id, delay
+
+    def record_outcome(self, model_id: str, error: Optional[ChatHandlerError]):
+        """Met à jour le disjoncteur du modèle selon l'issue de l'appel"""
+        breaker = self.breaker_for(model_id)
+        if error is None:
+            breaker.record_success()
+        elif error.error_type in PROVIDER_FAILURE_TYPES:
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+    def record_cancellation(self, model_id: str, emitted: int, max_tokens: int):
+        saved = generation_metrics.record_cancellation(model_id, emitted, max_tokens)
+        logging.info(
+            f"Flux {model_id} abandonné après {emitted} tokens : "
+            f"~{saved['tokens_saved']} tokens et {saved['seconds_saved']:.1f}s économisés"
+        )
+
+    def record_usage(self, payload: Dict[str, Any], model_id: str, formatted_prompt: str,
+                     completion: str, usage: Optional[Dict[str, int]]):
+        """
+        Consommation du tour : chiffres du provider s'il les fournit, sinon comptage local.
+        Elle est aussi laissée dans `payload["usage"]` pour l'appelant (mode comparaison),
+        avec le modèle qui a effectivement servi le tour (`payload["servedModelId"]`).
+        """
+        estimated = usage is None
+        if estimated:
+            usage = {"prompt_tokens": token_counter.count(formatted_prompt, model_id),
+                     "completion_tokens": token_counter.count(completion, model_id)}
+        payload["usage"] = {**usage, "estimated": estimated}
+        payload["servedModelId"] = model_id
+        # Écriture en base, quota et seau de tokens (throttling) : thread du usage_recorder
+        usage_recorder.record(payload.get("userId"), payload.get("chatId"), model_id,
+                              usage["prompt_tokens"], usage["completion_tokens"], estimated)
+
+    def retry_delay_for(self, model_id: str, error: ChatHandlerError, emitted: int, attempt: int) -> Optional[float]:
+        """
+        Délai avant nouvelle tentative, ou None si l'erreur doit être renvoyée au client.
+        On ne rejoue jamais une réponse déjà partiellement transmise, ni au-delà du budget partagé.
+        """
+        if error.error_type not in RETRYABLE_ERROR_TYPES or emitted or attempt >= self.retry_policy.max_retries:
+            return None
+        if not retry_budget.try_acquire():
+            logging.warning(f"Budget de retry épuisé, pas de nouvelle tentative pour {model_id}")
+            return None
+        # Disjoncteur ouvert avec repli disponible : on bascule sans attendre
+        fallback = self.fallback_for(model_id)
+        if fallback and self.breaker_for(model_id).state == "open":
+            return 0.0
+        return self.retry_policy.delay(attempt + 1)
+
+    @staticmethod
+    def prompt_template(payload: Dict[str, Any]) -> str:
+        return payload.get("promptTemplate") or DEFAULT_PROMPT_TEMPLATE
+
+    def build_prompt(self, payload: Dict[str, Any], model_id: str) -> str:
+        """
+        Construit le prompt final (template + historique + message courant).
+        L'historique est fenêtré sous le budget de tokens du modèle (LLM_CONTEXT) ;
+        les messages couverts par le résumé de la conversation sont remplacés par celui-ci,
+        et l'état du parcours de souscription est injecté en bloc compact.
+        """
+        content = payload.get("content", "")
+        messages = payload.get("messages", [])
+
+        # Gestion du template
+        prompt_template_str = self.prompt_template(payload)
+        prompt = PromptTemplate(
+            input_variables=["history", "input"],
+            template=prompt_template_str,
+        )
+
+        # Historique retenu sous le budget restant après le template et le message courant
+        fixed_tokens = token_counter.count(prompt.format(history="", input=content), model_id)
+        summary = payload.get("summary") or {}
+        window = context_builder.build(messages, content, model_id, fixed_tokens,
+                                       summary=summary.get("text"), summary_through=summary.get("throughOrder", 0),
+                                       state=funnel_tracker.render(payload.get("funnel")))
+        generation_metrics.record_context(model_id, window.report)
+        if window.report["dropped"] or window.report["compressed"]:
+            logging.info(
+                f"Historique fenêtré pour {model_id} : {window.report['kept']}/{window.report['messages']} messages "
+                f"({window.report['compressed']} tronqués, {window.report['dropped']} omis), "
+                f"{window.report['tokens_saved']} tokens économisés"
+            )
+
+        # Préparation du prompt en injectant l'historique et le message courant
+        return prompt.format(history=window.history, input=content)
+
+    def llm_input(self, model_id: str, formatted_prompt: str):
+        """LlamaLLM et le fournisseur simulé attendent une chaîne, les modèles de chat une liste de messages"""
+        if self.provider_for(model_id) in TEXT_PROVIDERS:
+            return formatted_prompt
+        return [HumanMessage(content=formatted_prompt)]
+
+    def classify_exception(self, exception: Exception) -> ChatHandlerError:
+        """Associe une exception LLM à une erreur exploitable par le frontend"""
+        error_message = str(exception).lower()
+
+        # Erreurs de rate limit (à adapter selon les messages exacts des providers)
+        if any(term in error_message for term in ["rate limit", "too many requests", "429"]):
+            error = ChatHandlerError(
+                message="Limite de requêtes atteinte. Veuillez réessayer plus tard.",
+                error_type="rate_limit",
+                status_code=429
+            )
+
+        # Erreurs d'authentification
+        elif any(term in error_message for term in ["authentication", "unauthorized", "api key", "401"]):
+            error = ChatHandlerError(
+                message="Erreur d'authentification avec le service LLM. Veuillez vérifier vos identifiants.",
+                error_type="auth",
+                status_code=401
+            )
+
+        # Erreurs de timeout
+        elif any(term in error_message for term in ["timeout", "timed out"]):
+            error = ChatHandlerError(
+                message="Le service LLM met trop de temps à répondre. Veuillez réessayer.",
+                error_type="timeout",
+                status_code=504
+            )
+
+        # Erreurs réseau pendant l'appel
+        elif any(term in error_message for term in ["network", "connection"]):
+            error = ChatHandlerError(
+                message="Impossible de se connecter au service LLM. Vérifiez votre connexion.",
+                error_type="network",
+                status_code=503
+            )
+
+        # Autres exceptions non gérées spécifiquement
+        else:
+            error = ChatHandlerError(
+                message=f"Erreur lors de la génération: {str(exception)}",
+                error_type="generation",
+                status_code=500,
+                details="".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
+            )
+        return error
+
+    def classify_external_exception(self, exception: Exception, model_id: str) -> ChatHandlerError:
+        """Erreurs survenues hors de l'appel LLM (initialisation, réseau, modèle introuvable)"""
+        if isinstance(exception, ChatHandlerError):
+            return exception
+
+        error_type = "unknown"
+        status_code = 500
+        message = str(exception)
+
+        # Analyse du message d'erreur pour déterminer le type
+        error_message = message.lower()
+        if any(term in error_message for term in ["network", "connection"]):
+            error_type = "network"
+            status_code = 503
+            message = "Impossible de se connecter au service LLM. Vérifiez votre connexion."
+        elif any(term in error_message for term in ["model", "not found", "404"]):
+            error_type = "not_found"
+            status_code = 404
+            message = f"Le modèle '{model_id}' n'a pas été trouvé ou n'est pas disponible."
+
+        return ChatHandlerError(
+            message=message,
+            error_type=error_type,
+            status_code=status_code,
+            details=traceback.format_exc()
+        )
+
+    def _validate(self, payload: Dict[str, Any]):
+        content = payload.get("content", "")
+        if not content.strip():
+            raise ChatHandlerError(
+                message="Le contenu du message ne peut pas être vide",
+                error_type="validation",
+                status_code=400
+            )
+
+    def cache_key(self, payload: Dict[str, Any]) -> Optional[str]:
+        return response_cache.key_for(payload, self.prompt_template(payload),
+                                      payload.get("modelId", DEFAULT_MODEL_ID))
+
+    @staticmethod
+    def direct_answer(payload: Dict[str, Any]) -> Optional[str]:
+        """Étape du parcours qui n'est que de la donnée (pièces manquantes, devis calculé) : pas d'appel LLM"""
+        return funnel_tracker.direct_answer(payload.get("funnel"), payload.get("content", ""))
+
+    def cached_answer(self, payload: Dict[str, Any], cache_key: Optional[str]) -> Optional[str]:
+        """Cache exact d'abord, puis cache sémantique pour les premières questions"""
+        answer = response_cache.get(cache_key)
+        if answer is None:
+            answer = semantic_cache.lookup(payload, self.prompt_template(payload),
+                                           payload.get("modelId", DEFAULT_MODEL_ID))
+        return answer
+
+    def remember_answer(self, payload: Dict[str, Any], cache_key: Optional[str], chunks):
+        """Met la réponse en cache sous le modèle demandé, sauf si un repli ou une couverture l'a servie"""
+        model_id = payload.get("modelId", DEFAULT_MODEL_ID)
+        if payload.get("servedModelId", model_id) != model_id:
+            return
+        response_cache.store(cache_key, chunks)
+        semantic_cache.store(payload, self.prompt_template(payload), model_id, chunks)
+
+    def generate_response(self, payload: Dict[str, Any]) -> Generator[str, None, None]:
+        """Génère une réponse en flux ; une question déjà traitée à l'identique est rejouée depuis le cache"""
+        self._validate(payload)
+        cache_key = self.cache_key(payload)
+        cached = self.direct_answer(payload)
+        if cached is None:
+            cached = self.cached_answer(payload, cache_key)
+        if cached is not None:
+            yield from response_cache.replay(cached)
+            return
+
+        chunks = []
+        stream = self._generate_response(payload)
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # Propage une fermeture anticipée (client parti) jusqu'à l'appel au provider
+            stream.close()
+        self.remember_answer(payload, cache_key, chunks)
+
+    def _start_run(self, model_id: str, formatted_prompt: str, temperature: float, max_tokens: int) -> "LLMRun":
+        """
+        Ouvre le flux natif du LLM ; l'appel au provider part à la lecture du premier fragment.
+        LlamaLLM et le fournisseur simulé exposent la fermeture de leur réponse (`on_response`),
+        ce qui permet d'interrompre une lecture en cours (LLMRun.abort).
+        """
+        llm = self.get_llm(model_id, temperature, max_tokens)
+        run = LLMRun(model_id, formatted_prompt)
+        options = {"on_response": run.bind_response} if self.provider_for(model_id) in TEXT_PROVIDERS else {}
+        run.stream = llm.stream(self.llm_input(model_id, formatted_prompt), **options)
+        return run
+
+    def _abandon_run(self, run: "LLMRun", payload: Dict[str, Any]):
+        """Perdant d'une couverture : prompt décompté, issue neutre pour le disjoncteur (flux fermé par l'appelant)"""
+        self.breaker_for(run.model_id).release()
+        self.record_usage(payload, run.model_id, run.formatted_prompt, "", None)
+
+    def _end_without_token(self, run: "LLMRun", payload: Dict[str, Any]):
+        """Candidat terminé (erreur ou réponse vide) avant tout token pendant une couverture"""
+        if run.exception is not None:
+            self.record_outcome(run.model_id, self.classify_exception(run.exception))
+            generation_metrics.record_failure(run.model_id)
+        else:
+            self.breaker_for(run.model_id).release()
+            self.record_usage(payload, run.model_id, run.formatted_prompt, "", None)
+
+    def _first_token(self, run: "LLMRun", payload: Dict[str, Any], temperature: float, max_tokens: int):
+        """
+        Lit le premier token du flux (None : fin ou erreur, cf. `run.exception`). Si le modèle
+        est couvert (LLM_HEDGING) et reste muet au-delà de son échéance, la requête part aussi
+        vers le modèle de secours : le premier qui produit un token est retenu, l'autre est abandonné
+        sans attendre la fin de sa lecture. Seule cette attente passe par first_token_executor
+        (sans thread libre, pas de couverture) ; la suite du flux retenu est lue directement.
+        Un modèle épinglé (`pinModel`) n'est pas couvert. Retourne (appel retenu, premier token).
+        """
+        plan = None if payload.get("pinModel") else hedge_policy.plan(run.model_id)
+        primary_read = first_token_executor.try_submit(run.read_token) if plan else None
+        if primary_read is None:
+            return run, run.next_token()
+        primary = run
+        pending = {primary_read: primary}
+        done, _ = futures.wait(pending, timeout=plan["deadline"])
+        backup = None
+        if not done:
+            backup = self._start_hedge(primary, plan["backup"], payload,
+                                       lambda model_id, prompt: self._start_run(model_id, prompt, temperature, max_tokens))
+            backup_read = first_token_executor.try_submit(backup.read_token) if backup else None
+            if backup_read is not None:
+                pending[backup_read] = backup
+            elif backup is not None:
+                # Aucun thread libre : la couverture n'a pas été lue, aucun appel n'est parti
+                backup.close()
+                self.breaker_for(backup.model_id).release()
+                hedge_policy.record_unavailable(primary.model_id)
+                backup = None
+
+        while True:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                candidate = pending.pop(future)
+                token = future.result()
+                if backup is None:
+                    return candidate, token
+                if token is None and pending:
+                    # Ce candidat a échoué avant son premier token : l'autre reste en lice
+                    self._end_without_token(candidate, payload)
+                    continue
+                for loser in pending.values():
+                    # Flux perdant interrompu tout de suite, même au milieu de sa lecture
+                    loser.abort()
+                    self._abandon_run(loser, payload)
+                winner = None if token is None else ("primary" if candidate is primary else "backup")
+                hedge_policy.record_outcome(primary.model_id, winner)
+                if winner == "backup":
+                    logging.warning(f"Couverture gagnante : {backup.model_id} a devancé {primary.model_id}")
+                return candidate, token
+
+    def _start_hedge(self, primary: "LLMRun", backup_model: str, payload: Dict[str, Any], start):
+        """
+        Lance la requête de couverture (`start(modèle, prompt)`) si le budget et le disjoncteur
+        du secours le permettent ; None sinon. Le secours passe par le pacing comme tout appel,
+        sans attente : s'il lui faudrait patienter pour son quota, la couverture n'a plus d'intérêt.
+        """
+        if not self.breaker_for(backup_model).allow():
+            hedge_policy.record_unavailable(primary.model_id)
+            return None
+        if not hedge_policy.try_fire(primary.model_id):
+            self.breaker_for(backup_model).release()
+            return None
+        try:
+            formatted_prompt = self.build_prompt(payload, backup_model)
+            self.pace(backup_model, self.estimate_tokens(formatted_prompt, payload.get("maxTokens", 2000)),
+                      pinned=True, max_wait=0.0)
+            logging.info(f"Aucun token de {primary.model_id} avant l'échéance, couverture sur {backup_model}")
+            return start(backup_model, formatted_prompt)
+        except Exception as e:
+            logging.error(f"Couverture sur {backup_model} impossible : {e}")
+            self.breaker_for(backup_model).release()
+            hedge_policy.record_unavailable(primary.model_id)
+            return None
+
+    def _generate_response(self, payload: Dict[str, Any]) -> Generator[str, None, None]:
+        """
+        Génère une réponse token par token à partir d'un modèle LLM.
+        Les attentes (pacing, délai avant nouvelle tentative) bloquent le thread worker :
+        elles sont plafonnées par LLM_PACING['sync_max_sleep'] pour tout le tour, au-delà
+        le client reçoit l'erreur avec Retry-After au lieu d'attendre.
+        """
+        # Extraction des paramètres du payload
+        requested_model = payload.get("modelId", DEFAULT_MODEL_ID)
+        temperature = payload.get("temperature", 0.7)
+        max_tokens = payload.get("maxTokens", 2000)
+        pinned = bool(payload.get("pinModel"))
+        attempt = 0
+        retry_budget.record_request()
+        sleep_deadline = time.monotonic() + getattr(settings, "LLM_PACING", {}).get("sync_max_sleep", 2.0)
+
+        while True:
+            model_id = requested_model
+
+            try:
+                model_id = self.select_model(requested_model, pinned)
+                formatted_prompt = self.build_prompt(payload, model_id)
+                model_id, pacing_delay = self.pace(model_id, self.estimate_tokens(formatted_prompt, max_tokens), pinned,
+                                                   max_wait=max(sleep_deadline - time.monotonic(), 0.0))
+                if pacing_delay:
+                    time.sleep(pacing_delay)
+
+                # Ouverture du flux du LLM et lecture du premier token
+                # (avec requête de couverture éventuelle : le modèle retenu peut changer)
+                run = self._start_run(model_id, formatted_prompt, temperature, max_tokens)
+                run, token = self._first_token(run, payload, temperature, max_tokens)
+                model_id, formatted_prompt = run.model_id, run.formatted_prompt
+                started_at = run.started_at
+                first_token_at = None
+
+                # Génération en streaming en lisant directement le flux du provider,
+                # regroupé en fragments (seuil de taille ou échéance de latence)
+                emitted = 0
+                completion = []
+                coalescer = TokenCoalescer.from_settings()
+                try:
+                    while token is not None:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        emitted += 1
+                        completion.append(token)
+                        chunk = coalescer.add(token)
+                        if chunk:
+                            yield chunk
+                        while True:
+                            try:
+                                # Attente bornée par l'échéance du tampon : une pause du provider
+                                # n'y retient pas le texte déjà reçu
+                                token = run.next_token(timeout=coalescer.timeout())
+                                break
+                            except TimeoutError:
+                                yield coalescer.flush()
+                    pending = coalescer.flush()
+                    if pending:
+                        yield pending
+                except GeneratorExit:
+                    # Client déconnecté : la fermeture du flux coupe la réponse du provider, même
+                    # pendant une lecture à attente bornée, et le disjoncteur est libéré (une sonde
+                    # demi-ouverte ne reste pas en vol)
+                    run.abort()
+                    self.breaker_for(model_id).release()
+                    self.record_cancellation(model_id, emitted, max_tokens)
+                    self.record_usage(payload, model_id, formatted_prompt, "".join(completion), None)
+                    raise
 
                 # Si aucune exception et streaming terminé, sortir de la boucle
-                if self.exception is None:
+                if run.exception is None:
+                    self.record_outcome(model_id, None)
+                    generation_metrics.record_completion(
+                        model_id,
+                        first_token_at - started_at if first_token_at else None,
+                        emitted,
+                        time.perf_counter() - started_at,
+                    )
+                    self.record_usage(payload, model_id, formatted_prompt, "".join(completion), run.usage)
                     break
-                    
+
+                logging.error(f"Erreur lors de la génération LLM : {str(run.exception)}")
                 # Gestion des erreurs connues qui nécessitent une nouvelle tentative
-                if isinstance(self.exception, Exception):
-                    error_message = str(self.exception).lower()
-                    
-                    # Erreurs de rate limit (à adapter selon les messages exacts des providers)
-                    if any(term in error_message for term in ["rate limit", "too many requests", "429"]):
-                        if retries < self.max_retries:
-                            retries += 1
-                            wait_time = self.retry_delay * (2 ** retries)  # Backoff exponentiel
-                            logging.warning(f"Rate limit atteint, nouvelle tentative dans {wait_time}s... ({retries}/{self.max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            # Convertir en ChatHandlerError pour le frontend
-                            error = ChatHandlerError(
-                                message="Limite de requêtes atteinte. Veuillez réessayer plus tard.",
-                                error_type="rate_limit",
-                                status_code=429
-                            )
-                            yield error.to_json()
-                            return
-                            
-                    # Erreurs d'authentification
-                    elif any(term in error_message for term in ["authentication", "unauthorized", "api key", "401"]):
-                        error = ChatHandlerError(
-                            message="Erreur d'authentification avec le service LLM. Veuillez vérifier vos identifiants.",
-                            error_type="auth",
-                            status_code=401
-                        )
-                        yield error.to_json()
-                        return
-                        
-                    # Erreurs de timeout
-                    elif any(term in error_message for term in ["timeout", "timed out"]):
-                        if retries < self.max_retries:
-                            retries += 1
-                            wait_time = self.retry_delay * (2 ** retries)
-                            logging.warning(f"Timeout, nouvelle tentative dans {wait_time}s... ({retries}/{self.max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            error = ChatHandlerError(
-                                message="Le service LLM met trop de temps à répondre. Veuillez réessayer.",
-                                error_type="timeout",
-                                status_code=504
-                            )
-                            yield error.to_json()
-                            return
-                
-                # Autres exceptions non gérées spécifiquement
-                error = ChatHandlerError(
-                    message=f"Erreur lors de la génération: {str(self.exception)}",
-                    error_type="generation",
-                    status_code=500,
-                    details=traceback.format_exc()
-                )
+                error = self.classify_exception(run.exception)
+                self.record_outcome(model_id, error)
+                generation_metrics.record_failure(model_id)
+                wait_time = self.retry_delay_for(model_id, error, emitted, attempt)
+                if wait_time is not None and wait_time > sleep_deadline - time.monotonic():
+                    # Attente au-delà du budget du thread worker : le client réessaiera lui-même
+                    error.retry_after = max(error.retry_after or 0, int(wait_time) + 1)
+                    wait_time = None
+                if wait_time is not None:
+                    attempt += 1
+                    logging.warning(f"{error.error_type}, nouvelle tentative dans {wait_time:.2f}s... ({attempt}/{self.retry_policy.max_retries})")
+                    time.sleep(wait_time)
+                    continue
                 yield error.to_json()
                 return
-                
+
+            except ChatHandlerError as e:
+                # Disjoncteur ouvert sans repli, ou modèle impossible à initialiser
+                if e.error_type != "circuit_open":
+                    self.breaker_for(model_id).release()
+                yield e.to_json()
+                return
+
             except Exception as e:
-                # Erreurs hors du thread de génération
-                logging.error(f"Erreur externe au thread LLM: {str(e)}\n{traceback.format_exc()}")
-                
-                error_type = "unknown"
-                status_code = 500
-                message = str(e)
-                
-                # Analyse du message d'erreur pour déterminer le type
-                error_message = message.lower()
-                if any(term in error_message for term in ["network", "connection"]):
-                    error_type = "network"
-                    status_code = 503
-                    message = "Impossible de se connecter au service LLM. Vérifiez votre connexion."
-                elif any(term in error_message for term in ["model", "not found", "404"]):
-                    error_type = "not_found"
-                    status_code = 404
-                    message = f"Le modèle '{model_id}' n'a pas été trouvé ou n'est pas disponible."
-                
-                error = ChatHandlerError(
-                    message=message,
-                    error_type=error_type,
-                    status_code=status_code,
-                    details=traceback.format_exc()
+                # Erreurs hors de l'appel LLM (prompt, pacing, initialisation)
+                logging.error(f"Erreur externe à l'appel LLM: {str(e)}\n{traceback.format_exc()}")
+                self.breaker_for(model_id).release()
+                yield self.classify_external_exception(e, model_id).to_json()
+                return
+
+    def _astart_run(self, model_id: str, formatted_prompt: str, temperature: float, max_tokens: int) -> "LLMRun":
+        """Ouvre le flux natif asynchrone du LLM, lu sur la boucle d'événements"""
+        llm = self.get_llm(model_id, temperature, max_tokens)
+        return LLMRun(model_id, formatted_prompt, llm.astream(self.llm_input(model_id, formatted_prompt)))
+
+    async def _afirst_token(self, run: "LLMRun", payload: Dict[str, Any], temperature: float, max_tokens: int):
+        """Variante asynchrone de _first_token : les deux flux sont lus ensemble sur la boucle, sans thread"""
+        plan = None if payload.get("pinModel") else hedge_policy.plan(run.model_id)
+        if plan is None:
+            return run, await run.anext_token()
+        primary = run
+        pending = {asyncio.ensure_future(primary.anext_token()): primary}
+        backup = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=plan["deadline"])
+            if not done:
+                backup = self._start_hedge(primary, plan["backup"], payload,
+                                           lambda model_id, prompt: self._astart_run(model_id, prompt, temperature, max_tokens))
+                if backup is not None:
+                    pending[asyncio.ensure_future(backup.anext_token())] = backup
+
+            while True:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    candidate = pending.pop(task)
+                    token = task.result()
+                    if backup is None:
+                        return candidate, token
+                    if token is None and pending:
+                        # Ce candidat a échoué avant son premier token : l'autre reste en lice
+                        self._end_without_token(candidate, payload)
+                        continue
+                    while pending:
+                        # L'annulation de la lecture ferme le flux perdant
+                        loser_task, loser = pending.popitem()
+                        loser_task.cancel()
+                        await asyncio.gather(loser_task, return_exceptions=True)
+                        await loser.aclose()
+                        self._abandon_run(loser, payload)
+                    winner = None if token is None else ("primary" if candidate is primary else "backup")
+                    hedge_policy.record_outcome(primary.model_id, winner)
+                    if winner == "backup":
+                        logging.warning(f"Couverture gagnante : {backup.model_id} a devancé {primary.model_id}")
+                    return candidate, token
+        except BaseException:
+            # Client parti pendant l'attente : les lectures sont annulées, la couverture libérée,
+            # le flux principal est fermé par l'appelant
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if backup is not None and backup in pending.values():
+                await backup.aclose()
+                self.breaker_for(backup.model_id).release()
+            raise
+
+    async def agenerate_response(self, payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """Variante asynchrone de generate_response (cache compris) pour le serveur ASGI"""
+        self._validate(payload)
+        # Lectures partagées rafraîchies hors de la boucle : le reste du tour ne fait aucune requête
+        await model_registry.arefresh()
+        await semantic_cache.arefresh_switch()
+        cache_key = self.cache_key(payload)
+        cached = self.direct_answer(payload)
+        if cached is None:
+            cached = self.cached_answer(payload, cache_key)
+        if cached is not None:
+            async for chunk in response_cache.areplay(cached):
+                yield chunk
+            return
+
+        chunks = []
+        stream = self._agenerate_response(payload)
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        self.remember_answer(payload, cache_key, chunks)
+
+    async def _agenerate_response(self, payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        Génération asynchrone pour le serveur ASGI.
+        Le flux asynchrone du provider est lu directement sur la boucle d'événements :
+        un flux ouvert ne mobilise ni thread worker ni tâche intermédiaire, et l'attente
+        entre deux tentatives ne bloque rien.
+        """
+        requested_model = payload.get("modelId", DEFAULT_MODEL_ID)
+        temperature = payload.get("temperature", 0.7)
+        max_tokens = payload.get("maxTokens", 2000)
+        pinned = bool(payload.get("pinModel"))
+        attempt = 0
+        retry_budget.record_request()
+
+        while True:
+            emitted = 0
+            model_id = requested_model
+            try:
+                model_id = self.select_model(requested_model, pinned)
+                formatted_prompt = self.build_prompt(payload, model_id)
+                model_id, pacing_delay = self.pace(model_id, self.estimate_tokens(formatted_prompt, max_tokens), pinned)
+                if pacing_delay:
+                    await asyncio.sleep(pacing_delay)
+                run = self._astart_run(model_id, formatted_prompt, temperature, max_tokens)
+            except Exception as e:
+                logging.error(f"Erreur externe à l'appel LLM: {str(e)}\n{traceback.format_exc()}")
+                if not (isinstance(e, ChatHandlerError) and e.error_type == "circuit_open"):
+                    self.breaker_for(model_id).release()
+                yield self.classify_external_exception(e, model_id).to_json()
+                return
+
+            first_token_at = None
+            completion = []
+            coalescer = TokenCoalescer.from_settings()
+            try:
+                # Premier token, avec requête de couverture éventuelle : le modèle retenu peut changer
+                run, token = await self._afirst_token(run, payload, temperature, max_tokens)
+                while token is not None:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    emitted += 1
+                    completion.append(token)
+                    chunk = coalescer.add(token)
+                    if chunk:
+                        yield chunk
+                    while True:
+                        try:
+                            token = await run.anext_token(timeout=coalescer.timeout())
+                            break
+                        except asyncio.TimeoutError:
+                            # Échéance du tampon atteinte pendant une pause du provider
+                            yield coalescer.flush()
+                pending = coalescer.flush()
+                if pending:
+                    yield pending
+            except BaseException:
+                # Fermeture anticipée du générateur (déconnexion détectée par le handler ASGI) :
+                # la fermeture du flux coupe la réponse du provider
+                await run.aclose()
+                self.breaker_for(run.model_id).release()
+                self.record_cancellation(run.model_id, emitted, max_tokens)
+                self.record_usage(payload, run.model_id, run.formatted_prompt, "".join(completion), None)
+                raise
+
+            model_id, formatted_prompt = run.model_id, run.formatted_prompt
+            exception = run.exception
+            if exception is None:
+                self.record_outcome(model_id, None)
+                generation_metrics.record_completion(
+                    model_id,
+                    first_token_at - run.started_at if first_token_at else None,
+                    emitted,
+                    time.perf_counter() - run.started_at,
                 )
-                yield error.to_json()
-                return
\ No newline at end of file
+                self.record_usage(payload, model_id, formatted_prompt, "".join(completion), run.usage)
+                return
+
+            logging.error(f"Erreur lors de la génération LLM : {str(exception)}")
+            error = self.classify_exception(exception)
+            self.record_outcome(model_id, error)
+            generation_metrics.record_failure(model_id)
+            wait_time = self.retry_delay_for(model_id, error, emitted, attempt)
+            if wait_time is not None:
+                attempt += 1
+                logging.warning(f"{error.error_type}, nouvelle tentative dans {wait_time:.2f}s... ({attempt}/{self.retry_policy.max_retries})")
+                await asyncio.sleep(wait_time)
+                continue
+            yield error.to_json()
+            return
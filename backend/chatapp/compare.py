@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, Generator, List, Optional
+
+from django.conf import settings
+
+from .errors import ERROR_CHUNK_PREFIX, ChatHandlerError
+from .executor import admission_controller, generation_executor
+from .streaming import managed_stream, sse_frame
+from .tokens import token_counter
+
+
+def compare_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_COMPARE", {})
+
+
+class ModelTrack:
+    """Mesures d'un modèle pendant une comparaison (horloge commune à tous les modèles)"""
+    def __init__(self, model_id: str, started_at: float):
+        self.model_id = model_id
+        self.started_at = started_at
+        self.first_chunk_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.parts: List[str] = []
+        self.error: Optional[Dict[str, Any]] = None
+
+    def on_chunk(self, chunk: str) -> Dict[str, Any]:
+        """Enregistre un fragment et retourne l'évènement à transmettre sur le canal du modèle"""
+        if chunk.startswith(ERROR_CHUNK_PREFIX):
+            self.error = json.loads(chunk)
+            return {"type": "error", "model": self.model_id, "error": self.error}
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        self.parts.append(chunk)
+        return {"type": "token", "model": self.model_id, "text": chunk}
+
+    def result(self, usage: Optional[Dict[str, Any]], served_model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Bilan du modèle : TTFT, débit, latence totale et tokens (provider, sinon comptage local),
+        avec le modèle qui a effectivement répondu (None si aucun appel n'est parti)
+        """
+        finished_at = self.finished_at or time.perf_counter()
+        completion = "".join(self.parts)
+        if usage:
+            prompt_tokens, completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+        else:
+            prompt_tokens, completion_tokens = None, token_counter.count(completion, self.model_id)
+        ttft = self.first_chunk_at - self.started_at if self.first_chunk_at else None
+        streaming_time = finished_at - self.first_chunk_at if self.first_chunk_at else 0.0
+        return {
+            "type": "result",
+            "model": self.model_id,
+            "served_model": served_model,
+            "status": "error" if self.error else "completed",
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "tokens_per_second": (round((completion_tokens - 1) / streaming_time, 1)
+                                  if completion_tokens > 1 and streaming_time > 0 else None),
+            "latency_ms": round((finished_at - self.started_at) * 1000, 1),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "usage_source": ("estimated" if usage.get("estimated") else "provider") if usage else "estimated",
+            "chars": len(completion),
+        }
+
+
+class ModelComparator:
+    """
+    Mode comparaison : un même tour envoyé simultanément à plusieurs modèles.
+    Chaque modèle est généré par son propre ChatHandler (retries, disjoncteur, pacing et décompte
+    de tokens compris, sans cache) et reste épinglé : ni repli, ni bascule de quota, ni couverture,
+    une colonne ne contient que la réponse de son modèle. Les flux sont multiplexés dans une seule réponse, un
+    évènement par fragment avec le modèle comme canal (`token`, `error`), puis un bilan par modèle
+    (`result`) et un récapitulatif (`summary`). Le temps total est celui du modèle le plus lent.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.comparisons = 0
+        self.model_runs = 0
+        self.seconds_saved = 0.0
+
+    def validate(self, models) -> List[str]:
+        """Liste des modèles à comparer, ou ChatHandlerError (400)"""
+        conf = compare_settings()
+        if not conf.get("enabled", True):
+            raise ChatHandlerError(message="Le mode comparaison est désactivé.",
+                                   error_type="validation", status_code=400)
+        max_models = conf.get("max_models", 4)
+        if (not isinstance(models, list) or not all(isinstance(model, str) and model.strip() for model in models)
+                or len(set(models)) != len(models) or not 2 <= len(models) <= max_models):
+            raise ChatHandlerError(
+                message=f"compareModels doit lister entre 2 et {max_models} modèles distincts.",
+                error_type="validation",
+                status_code=400,
+            )
+        return models
+
+    @staticmethod
+    def encode(event: Dict[str, Any], sse: bool) -> str:
+        """Une ligne JSON par évènement, ou un évènement SSE nommé selon son type"""
+        data = json.dumps(event, ensure_ascii=False)
+        return sse_frame(data, event=event["type"]) if sse else data + "\n"
+
+    @staticmethod
+    def model_payload(payload: Dict[str, Any], model_id: str) -> Dict[str, Any]:
+        return {**payload, "modelId": model_id, "autoRoute": False, "pinModel": True}
+
+    def summary(self, results: List[Dict[str, Any]], started_at: float) -> Dict[str, Any]:
+        wall = time.perf_counter() - started_at
+        sequential = sum(result["latency_ms"] for result in results) / 1000
+        with self._lock:
+            self.comparisons += 1
+            self.model_runs += len(results)
+            self.seconds_saved += max(sequential - wall, 0.0)
+        logging.info(
+            f"Comparaison de {len(results)} modèles en {wall:.2f}s (séquentiel : {sequential:.2f}s) : "
+            + ", ".join(f"{result['model']} ttft={result['ttft_ms']}ms" for result in results)
+        )
+        return {
+            "type": "summary",
+            "wall_ms": round(wall * 1000, 1),
+            "sequential_ms": round(sequential * 1000, 1),
+            "models": [result["model"] for result in results],
+        }
+
+    # ---- WSGI : une pompe par modèle dans generation_executor, évènements multiplexés dans une file ----
+
+    def stream(self, handler_factory, payload: Dict[str, Any], models: List[str], tickets,
+               max_wait: float, sse: bool = False):
+        """Flux multiplexé ; les slots pas encore remis à une pompe sont rendus à sa fermeture, même jamais itéré"""
+        waiting = dict(zip(models, tickets))
+        return managed_stream(
+            self._stream(handler_factory, payload, models, waiting, max_wait, sse),
+            on_close=[lambda: [ticket.release() for ticket in list(waiting.values())]],
+        )
+
+    def _stream(self, handler_factory, payload: Dict[str, Any], models: List[str], waiting: Dict[str, Any],
+                max_wait: float, sse: bool) -> Generator[str, None, None]:
+        started_at = time.perf_counter()
+        events: "queue.Queue" = queue.Queue()
+        stop = threading.Event()
+        tracks = {model_id: ModelTrack(model_id, started_at) for model_id in models}
+
+        def pump(model_id: str, ticket):
+            track = tracks[model_id]
+            model_payload = self.model_payload(payload, model_id)
+            try:
+                generation = handler_factory()._generate_response(model_payload)
+                try:
+                    for chunk in generation:
+                        if chunk:
+                            events.put(track.on_chunk(chunk))
+                        if stop.is_set():
+                            break
+                finally:
+                    # Client parti : la fermeture interrompt l'appel au provider
+                    generation.close()
+            except Exception as e:
+                events.put(track.on_chunk(ChatHandlerError(message=str(e)).to_json()))
+            finally:
+                ticket.release()
+                track.finished_at = time.perf_counter()
+                events.put(track.result(model_payload.get("usage"), model_payload.get("servedModelId")))
+
+        # Comme pour un tour simple, l'attente en file se fait dans le thread de la requête : une
+        # pompe n'occupe un thread de generation_executor qu'une fois son slot d'admission obtenu.
+        # Les slots déjà accordés partent d'abord, les autres partagent la même échéance.
+        deadline = time.monotonic() + max_wait
+        try:
+            for model_id in sorted(models, key=lambda model_id: not waiting[model_id].granted):
+                ticket = waiting[model_id]
+                if ticket.wait(max(deadline - time.monotonic(), 0.0)):
+                    generation_executor.submit(pump, model_id, ticket)
+                else:
+                    ticket.release()
+                    track = tracks[model_id]
+                    events.put(track.on_chunk(admission_controller.rejection().to_json()))
+                    track.finished_at = time.perf_counter()
+                    events.put(track.result(None))
+                del waiting[model_id]
+
+            results = []
+            while len(results) < len(models):
+                event = events.get()
+                if event["type"] == "result":
+                    results.append(event)
+                yield self.encode(event, sse)
+            yield self.encode(self.summary(results, started_at), sse)
+        finally:
+            stop.set()
+
+    # ---- ASGI : une tâche par modèle sur la boucle d'événements ----
+
+    async def astream(self, handler_factory, payload: Dict[str, Any], models: List[str], tickets,
+                      max_wait: float, sse: bool = False) -> AsyncGenerator[str, None]:
+        started_at = time.perf_counter()
+        events: "asyncio.Queue" = asyncio.Queue()
+        tracks = {model_id: ModelTrack(model_id, started_at) for model_id in models}
+
+        async def pump(model_id: str, ticket):
+            track = tracks[model_id]
+            model_payload = self.model_payload(payload, model_id)
+            try:
+                if not await ticket.wait_async(max_wait):
+                    events.put_nowait(track.on_chunk(admission_controller.rejection().to_json()))
+                    return
+                generation = handler_factory()._agenerate_response(model_payload)
+                try:
+                    async for chunk in generation:
+                        if chunk:
+                            events.put_nowait(track.on_chunk(chunk))
+                finally:
+                    await generation.aclose()
+            except Exception as e:
+                events.put_nowait(track.on_chunk(ChatHandlerError(message=str(e)).to_json()))
+            finally:
+                ticket.release()
+                track.finished_at = time.perf_counter()
+                events.put_nowait(track.result(model_payload.get("usage"), model_payload.get("servedModelId")))
+
+        tasks = [asyncio.create_task(pump(model_id, ticket)) for model_id, ticket in zip(models, tickets)]
+        results = []
+        try:
+            while len(results) < len(models):
+                event = await events.get()
+                if event["type"] == "result":
+                    results.append(event)
+                yield self.encode(event, sse)
+            yield self.encode(self.summary(results, started_at), sse)
+        finally:
+            # Déconnexion : l'annulation des tâches ferme les flux providers en cours
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "comparisons": self.comparisons,
+                "model_runs": self.model_runs,
+                "seconds_saved_vs_sequential": round(self.seconds_saved, 2),
+            }
+
+
+# Instance partagée par tout le process
+model_comparator = ModelComparator()
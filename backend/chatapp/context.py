@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, get_buffer_string
+
+from .registry import model_registry
+from .tokens import token_counter
+
+
+def context_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_CONTEXT", {})
+
+
+class ContextWindow:
+    """Historique retenu pour le prompt et bilan du fenêtrage"""
+    def __init__(self, history: str, report: Dict[str, Any]):
+        self.history = history
+        self.report = report
+
+
+class ContextBuilder:
+    """
+    Construit l'historique injecté dans le prompt sous un budget de tokens par modèle :
+      - les messages système sont toujours conservés ;
+      - les `recent_messages` derniers messages sont repris tels quels tant qu'ils tiennent ;
+      - les plus anciens sont tronqués à `compressed_chars` caractères ;
+      - dès qu'un message ne tient plus, lui et tous les précédents sont omis.
+    Le message courant, déjà présent dans {input}, n'est pas répété dans l'historique.
+    Le résumé glissant et l'état du dossier, s'ils sont fournis, remplacent les messages anciens.
+    """
+    def __init__(self, counter=token_counter):
+        self.counter = counter
+
+    @staticmethod
+    def budget_for(model_id: str) -> int:
+        """Limite `context_budget` du registre des modèles, sinon LLM_CONTEXT"""
+        budget = model_registry.resolve(model_id).limits.get("context_budget")
+        if budget:
+            return budget
+        conf = context_settings()
+        return conf.get("budgets", {}).get(model_id, conf.get("default_budget", 4000))
+
+    @staticmethod
+    def _message(author: str, text: str):
+        if author == "user":
+            return HumanMessage(content=text)
+        if author == "assistant":
+            return AIMessage(content=text)
+        return SystemMessage(content=text)
+
+    def _cost(self, message, model_id: str) -> int:
+        # +1 pour le saut de ligne qui sépare les messages
+        return self.counter.count(get_buffer_string([message]), model_id) + 1
+
+    def build(self, messages: List[Dict[str, Any]], content: str, model_id: str,
+              fixed_tokens: int = 0, summary: Optional[str] = None, summary_through: int = 0,
+              state: Optional[str] = None) -> ContextWindow:
+        """
+        `fixed_tokens` : tokens du prompt hors historique (template et message courant).
+        `summary` : résumé des messages d'ordre <= `summary_through`, qui le remplace
+        dans l'historique (placé avant les messages retenus).
+        `state` : état structuré du dossier ; il porte les faits utiles, seuls les
+        `state_recent_messages` derniers messages sont alors conservés.
+        """
+        conf = context_settings()
+        recent_messages = conf.get("recent_messages", 6)
+        compressed_chars = conf.get("compressed_chars", 280)
+        budget = self.budget_for(model_id)
+
+        present = [msg for msg in messages if (msg.get("content") or "").strip()]
+        full_tokens = sum(self._cost(self._message(msg.get("author"), msg["content"]), model_id)
+                          for msg in present)
+
+        system = [self._message("system", msg["content"]) for msg in present if msg.get("author") == "system"]
+        turns = [msg for msg in present if msg.get("author") in ("user", "assistant")]
+        if turns and turns[-1].get("author") == "user" and turns[-1]["content"].strip() == (content or "").strip():
+            turns = turns[:-1]
+
+        summarized = 0
+        superseded = 0
+        if summary:
+            summarized = sum(1 for msg in turns if msg.get("order", summary_through + 1) <= summary_through)
+            turns = turns[summarized:]
+            system.append(SystemMessage(content=f"Résumé des échanges précédents : {summary}"))
+        if state:
+            system.append(SystemMessage(content=f"État du dossier : {state}"))
+            limit = conf.get("state_recent_messages", 4)
+            superseded = max(len(turns) - limit, 0)
+            turns = turns[superseded:]
+        remaining = budget - fixed_tokens - sum(self._cost(message, model_id) for message in system)
+
+        selected = []
+        compressed = 0
+        dropped = 0
+        for position, msg in enumerate(reversed(turns)):
+            text = msg["content"]
+            message = self._message(msg["author"], text)
+            cost = self._cost(message, model_id)
+            shortened = (position >= recent_messages or cost > remaining) and len(text) > compressed_chars
+            if shortened:
+                message = self._message(msg["author"], text[:compressed_chars].rstrip() + " […]")
+                cost = self._cost(message, model_id)
+            if cost > remaining:
+                dropped = len(turns) - position
+                break
+            selected.append(message)
+            remaining -= cost
+            compressed += shortened
+        selected.reverse()
+
+        dropped += superseded
+        if dropped:
+            system.append(SystemMessage(content=f"({dropped} messages plus anciens omis)"))
+        history = get_buffer_string(system + selected)
+        history_tokens = self.counter.count(history, model_id)
+        return ContextWindow(history, {
+            "budget": budget,
+            "prompt_tokens": fixed_tokens + history_tokens,
+            "history_tokens_full": full_tokens,
+            "history_tokens": history_tokens,
+            "tokens_saved": max(full_tokens - history_tokens, 0),
+            "messages": len(present),
+            "summarized": summarized,
+            "kept": len(selected),
+            "compressed": compressed,
+            "dropped": dropped,
+        })
+
+
+# Instance partagée par tout le process
+context_builder = ContextBuilder()
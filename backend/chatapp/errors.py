@@ -0,0 +1,36 @@
+import json
+from typing import Any, Dict, Optional
+
+
+# Les erreurs sont transmises dans le flux sous forme de JSON (ChatHandlerError.to_json)
+ERROR_CHUNK_PREFIX = '{"error": true'
+
+
+class ChatHandlerError(Exception):
+    """Classe d'erreur personnalisée pour le ChatHandler"""
+    def __init__(self, message: str, error_type: str = "generation", status_code: int = 500,
+                 details: Optional[str] = None, retry_after: Optional[int] = None):
+        self.message = message
+        self.error_type = error_type
+        self.status_code = status_code
+        self.details = details
+        self.retry_after = retry_after
+        super().__init__(self.message)
+        
+    def to_dict(self) -> Dict[str, Any]:
+        """Convertit l'erreur en dictionnaire pour le frontend"""
+        error_dict = {
+            "error": True,
+            "message": self.message,
+            "type": self.error_type,
+            "status": self.status_code
+        }
+        if self.details:
+            error_dict["details"] = self.details
+        if self.retry_after is not None:
+            error_dict["retryAfter"] = self.retry_after
+        return error_dict
+        
+    def to_json(self) -> str:
+        """Convertit l'erreur en JSON pour le streaming"""
+        return json.dumps(self.to_dict())
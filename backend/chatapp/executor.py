@@ -0,0 +1,266 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .errors import ChatHandlerError
+
+
+def concurrency_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_CONCURRENCY", {})
+
+
+class AdmissionRejected(ChatHandlerError):
+    """Requête refusée par le contrôle d'admission (429 par utilisateur, 503 en surcharge)"""
+
+
+class Ticket:
+    """
+    Place dans la file d'admission. Accordée immédiatement si les limites le permettent,
+    sinon en attente (FIFO) jusqu'à libération d'un slot ou expiration du délai.
+    """
+    def __init__(self, controller: "AdmissionController", user_key: str, provider: str):
+        self._controller = controller
+        self.user_key = user_key
+        self.provider = provider
+        self.granted = False
+        self.released = False
+        self._event = threading.Event()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def _grant(self):
+        # Appelée sous le verrou du contrôleur
+        self.granted = True
+        self._event.set()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters = []
+
+    def wait(self, timeout: float) -> bool:
+        """Attente bloquante (chemin WSGI) ; False si le délai est dépassé"""
+        if self._event.wait(timeout):
+            return True
+        return self._controller._abandon(self)
+
+    async def wait_async(self, timeout: float) -> bool:
+        """Attente sur la boucle d'événements (chemin ASGI) ; False si le délai est dépassé"""
+        event = asyncio.Event()
+        with self._controller._lock:
+            if self.granted:
+                return True
+            self._async_waiters.append((asyncio.get_running_loop(), event))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._controller._abandon(self)
+        except asyncio.CancelledError:
+            self._controller._abandon(self)
+            raise
+
+    def release(self):
+        """Libère le slot (idempotent) ; appelée à la fin ou à la fermeture du flux"""
+        self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Contrôle d'admission des générations :
+      - au plus `max_concurrent` générations actives, `per_provider` par provider
+        et `per_user` par utilisateur (actives + en attente) ;
+      - au-delà, file d'attente bornée (`max_waiting`) avec délai maximal (`max_wait`) ;
+      - file pleine ou quota utilisateur atteint : refus immédiat 503/429 avec Retry-After.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active_total = 0
+        self._active_provider: Dict[str, int] = {}
+        self._user_count: Dict[str, int] = {}
+        self._waiting: List[Ticket] = []
+        self.admitted = 0
+        self.queued = 0
+        self.shed_user = 0
+        self.shed_overload = 0
+        self.timed_out = 0
+
+    @staticmethod
+    def _limits() -> Dict[str, Any]:
+        conf = concurrency_settings()
+        return {
+            "max_concurrent": conf.get("max_concurrent", 64),
+            "per_provider": conf.get("per_provider", {}),
+            "default_per_provider": conf.get("default_per_provider", 32),
+            "per_user": conf.get("per_user", 2),
+            "max_waiting": conf.get("max_waiting", 100),
+            "retry_after": conf.get("retry_after", 5),
+        }
+
+    def _can_run(self, provider: str, limits: Dict[str, Any]) -> bool:
+        provider_limit = limits["per_provider"].get(provider, limits["default_per_provider"])
+        return (self._active_total < limits["max_concurrent"]
+                and self._active_provider.get(provider, 0) < provider_limit)
+
+    def _activate(self, ticket: Ticket):
+        self._active_total += 1
+        self._active_provider[ticket.provider] = self._active_provider.get(ticket.provider, 0) + 1
+        self.admitted += 1
+        ticket._grant()
+
+    def request(self, user_key: str, provider: str) -> Ticket:
+        limits = self._limits()
+        with self._lock:
+            if self._user_count.get(user_key, 0) >= limits["per_user"]:
+                self.shed_user += 1
+                raise AdmissionRejected(
+                    message="Trop de réponses en cours pour cet utilisateur. Veuillez patienter.",
+                    error_type="rate_limit",
+                    status_code=429,
+                    retry_after=limits["retry_after"]
+                )
+            ticket = Ticket(self, user_key, provider)
+            if not self._waiting and self._can_run(provider, limits):
+                self._activate(ticket)
+            elif len(self._waiting) >= limits["max_waiting"]:
+                self.shed_overload += 1
+                raise AdmissionRejected(
+                    message="Le service est momentanément surchargé. Veuillez réessayer dans quelques instants.",
+                    error_type="overloaded",
+                    status_code=503,
+                    retry_after=limits["retry_after"]
+                )
+            else:
+                self._waiting.append(ticket)
+                self.queued += 1
+            self._user_count[user_key] = self._user_count.get(user_key, 0) + 1
+            return ticket
+
+    def _grant_waiting(self):
+        # Appelée sous le verrou : accorde les tickets en attente dont le provider a de la place
+        limits = self._limits()
+        for ticket in list(self._waiting):
+            if self._active_total >= limits["max_concurrent"]:
+                break
+            if self._can_run(ticket.provider, limits):
+                self._waiting.remove(ticket)
+                self._activate(ticket)
+
+    def _abandon(self, ticket: Ticket) -> bool:
+        """Fin d'attente sans slot ; retourne True si le ticket a été accordé entre-temps"""
+        with self._lock:
+            if ticket.granted:
+                return True
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                self.timed_out += 1
+            if not ticket.released:
+                ticket.released = True
+                self._decrement_user(ticket.user_key)
+            return False
+
+    def _decrement_user(self, user_key: str):
+        count = self._user_count.get(user_key, 0) - 1
+        if count > 0:
+            self._user_count[user_key] = count
+        else:
+            self._user_count.pop(user_key, None)
+
+    def _release(self, ticket: Ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._decrement_user(ticket.user_key)
+            if ticket.granted:
+                self._active_total -= 1
+                self._active_provider[ticket.provider] -= 1
+                self._grant_waiting()
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+
+    def rejection(self) -> AdmissionRejected:
+        """Erreur renvoyée quand l'attente en file dépasse `max_wait`"""
+        return AdmissionRejected(
+            message="Le service est momentanément surchargé. Veuillez réessayer dans quelques instants.",
+            error_type="overloaded",
+            status_code=503,
+            retry_after=self._limits()["retry_after"]
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": self._active_total,
+                "active_per_provider": dict(self._active_provider),
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shed_user_limit": self.shed_user,
+                "shed_overload": self.shed_overload,
+                "timed_out": self.timed_out,
+            }
+
+
+class GenerationExecutor:
+    """
+    Pool de threads borné pour les pompes des flux partagés du chemin synchrone (le flux du
+    provider est sinon lu directement par le thread de la requête). Dimensionné sur
+    `max_concurrent` (plus une marge pour les threads en cours d'interruption) : l'admission
+    borne le nombre de pompes. Une pompe n'attend jamais une autre tâche de ce pool : les
+    lectures faites pour son compte passent par `first_token_executor` / `token_read_executor`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, fn, *args, **kwargs):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    conf = concurrency_settings()
+                    workers = 2 * conf.get("max_concurrent", 64) + conf.get("executor_slack", 8)
+                    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        return self._pool.submit(fn, *args, **kwargs)
+
+
+class ReadExecutor:
+    """
+    Petit pool dédié aux lectures d'un flux du provider faites pour le compte d'un autre thread
+    (chemin synchrone) : premier token d'une couverture (LLM_HEDGING), lecture à attente bornée
+    du flux regroupé (LLM_STREAM_COALESCING). Distinct de generation_executor dont les pompes
+    attendent ces lectures. Une lecture n'est acceptée que si l'un des threads (`workers_setting`
+    de LLM_CONCURRENCY) est libre : elle ne patiente jamais en file, l'appelant lit alors
+    lui-même son flux, sans attente bornée.
+    """
+    def __init__(self, workers_setting: str = "hedge_workers", default_workers: int = 16,
+                 thread_name_prefix: str = "llm-first-token"):
+        self.workers_setting = workers_setting
+        self.default_workers = default_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.Semaphore] = None
+        self.rejected = 0
+
+    def try_submit(self, fn, *args, **kwargs) -> Optional[Future]:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    workers = concurrency_settings().get(self.workers_setting, self.default_workers)
+                    self._slots = threading.Semaphore(workers)
+                    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.thread_name_prefix)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return None
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+# Instances partagées par tout le process
+admission_controller = AdmissionController()
+generation_executor = GenerationExecutor()
+first_token_executor = ReadExecutor()
+token_read_executor = ReadExecutor("read_workers", 64, "llm-token-read")
@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import random
+import threading
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from langchain.llms.base import LLM
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+
+# Vocabulaire des réponses simulées (le texte n'a pas de sens, seule sa forme compte)
+FAKE_VOCABULARY = [
+    "assurance", "contrat", "prime", "garantie", "véhicule", "moto", "habitation", "voyage",
+    "santé", "devis", "carte", "grise", "permis", "souscription", "paiement", "Mobile", "Money",
+    "FCFA", "Cotonou", "agence", "courtier", "couverture", "annuelle", "document", "client",
+    "dossier", "pièce", "votre", "notre", "pour", "avec", "sans", "la", "le", "les", "un", "une",
+    "des", "et", "de", "du", "est", "sont", "peut", "être", "vous", "nous", "en", "sur", "au",
+]
+
+# Messages reconnus par ChatHandler.classify_exception, comme ceux des vrais providers
+FAKE_ERRORS = {
+    "rate_limit": "Error code: 429 - rate limit exceeded (fournisseur simulé)",
+    "timeout": "Request timed out (fournisseur simulé)",
+    "auth": "Error code: 401 - unauthorized, invalid api key (fournisseur simulé)",
+    "midstream": "Connection reset by peer pendant le flux (fournisseur simulé)",
+}
+
+# Numéro d'appel par profil : la suite des tirages (erreurs, gigue) est reproductible d'une exécution à l'autre
+_call_counters: Dict[str, Any] = {}
+
+
+def fake_provider_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_FAKE_PROVIDER", {})
+
+
+def fake_profile(model_id: str) -> Dict[str, Any]:
+    """Paramètres du profil `model_id` complétés par les valeurs par défaut"""
+    conf = fake_provider_settings()
+    return {**conf.get("defaults", {}), **conf.get("profiles", {}).get(model_id, {})}
+
+
+class FakeLLM(LLM):
+    """
+    Fournisseur local simulé pour les tests de charge et de latence, sans appel externe.
+    Délai avant le premier token (`ttft`), délai entre tokens (`token_delay`, `jitter` relatif),
+    longueur de la réponse (`tokens`, plafonnée par `max_tokens`) et injection d'erreurs
+    (`error` : rate_limit, timeout, auth ou midstream après `error_after` tokens, avec la
+    probabilité `error_rate`) sont configurables. Le texte ne dépend que du prompt et de
+    `seed` ; les tirages ne dépendent que de `seed` et du rang de l'appel.
+    """
+    model: str = "fake"
+    temperature: float = 0.7
+    max_tokens: int = 1024
+    ttft: float = 0.3
+    token_delay: float = 0.02
+    jitter: float = 0.0
+    tokens: int = 120
+    error: Optional[str] = None
+    error_rate: float = 1.0
+    error_after: int = 20
+    seed: int = 42
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _plan(self, prompt: str, stop: Optional[List[str]]) -> Tuple[List[Tuple[float, str]], Optional[str]]:
+        """Tokens à émettre avec le délai qui précède chacun, et erreur éventuelle à lever"""
+        if stop is not None:
+            raise ValueError("Les arguments 'stop' ne sont pas supportés dans cette implémentation.")
+        if self.error is not None and self.error not in FAKE_ERRORS:
+            raise ValueError(f"erreur simulée '{self.error}' inconnue (attendu : {', '.join(FAKE_ERRORS)})")
+        counter = _call_counters.setdefault(self.model, itertools.count())
+        draws = random.Random(f"{self.seed}:{self.model}:{next(counter)}")
+        text = random.Random(f"{self.seed}:{zlib.crc32(prompt.encode('utf-8'))}")
+
+        failure = self.error if self.error and draws.random() < self.error_rate else None
+        count = min(self.tokens, self.max_tokens)
+        if failure == "midstream":
+            count = min(count, self.error_after)
+        elif failure is not None:
+            count = 0
+
+        plan = []
+        capitalize = True
+        for index in range(count):
+            word = text.choice(FAKE_VOCABULARY)
+            if capitalize:
+                word = word.capitalize()
+            token = word if index == 0 else f" {word}"
+            capitalize = text.random() < 0.08
+            if capitalize or index == count - 1:
+                token += "."
+            delay = self.ttft if index == 0 else self.token_delay * (1 + self.jitter * (2 * draws.random() - 1))
+            plan.append((max(delay, 0.0), token))
+        if failure == "timeout":
+            plan.append((self.ttft, ""))
+        return plan, failure
+
+    @staticmethod
+    def _failure(failure: str) -> Exception:
+        if failure == "timeout":
+            return TimeoutError(FAKE_ERRORS[failure])
+        if failure == "midstream":
+            return ConnectionError(FAKE_ERRORS[failure])
+        return RuntimeError(FAKE_ERRORS[failure])
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        plan, failure = self._plan(prompt, stop)
+        # Équivalent de la fermeture de la réponse HTTP (`on_response`) : interrompt l'attente en cours
+        closed = threading.Event()
+        if kwargs.get("on_response"):
+            kwargs["on_response"](closed.set)
+        for delay, token in plan:
+            if closed.wait(delay) if delay else closed.is_set():
+                raise ConnectionError("réponse fermée par le client (fournisseur simulé)")
+            if not token:
+                continue
+            generation = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=generation)
+            yield generation
+        if failure is not None:
+            raise self._failure(failure)
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        plan, failure = self._plan(prompt, stop)
+        for delay, token in plan:
+            if delay:
+                await asyncio.sleep(delay)
+            if not token:
+                continue
+            generation = GenerationChunk(text=token)
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=generation)
+            yield generation
+        if failure is not None:
+            raise self._failure(failure)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        parts = [chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)]
+        return "".join(parts)
+
+    @property
+    def _identifying_params(self):
+        return {
+            "model": self.model,
+            "ttft": self.ttft,
+            "token_delay": self.token_delay,
+            "tokens": self.tokens,
+            "error": self.error,
+            "seed": self.seed,
+        }
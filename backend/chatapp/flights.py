@@ -0,0 +1,374 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .errors import ERROR_CHUNK_PREFIX
+from .executor import generation_executor
+
+
+def single_flight_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_SINGLE_FLIGHT", {})
+
+
+def flight_key(user_key: str, data: Dict[str, Any]) -> Optional[str]:
+    """
+    Clé d'idempotence d'un tour de conversation : `createMessageId` et id du dernier
+    message assistant fournis par le client. Le contenu, l'édition et le modèle en font
+    partie pour qu'une requête différente réutilisant les mêmes ids ne soit jamais rejouée.
+    """
+    create_id = data.get("createMessageId")
+    messages = data.get("messages") or []
+    assistant_id = messages[-1].get("id") if messages and isinstance(messages[-1], dict) else None
+    if not create_id and not assistant_id:
+        return None
+    raw = json.dumps([
+        user_key, create_id, assistant_id, data.get("chatId"), data.get("editMessageId"),
+        data.get("modelId"), data.get("content"),
+    ], default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """
+    Une génération partagée par toutes les requêtes portant la même clé.
+    La génération est pompée indépendamment des réponses HTTP : chaque client est un
+    abonné qui relit le tampon depuis le début puis suit les nouveaux fragments.
+    Quand le dernier abonné part, la génération en amont est interrompue — après un
+    délai de grâce pour les flux SSE, le temps qu'un client déconnecté se reconnecte.
+    """
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, key: Optional[str] = None, owner: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.owner = owner
+        self.chunks: List[str] = []
+        self.state = self.RUNNING
+        self.subscribers = 0
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._source = None
+        self._started = False
+        self._cancel = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._on_finish: List[Callable[["Flight"], None]] = []
+        self.resume_grace = 0.0
+        self.journal = None
+        self._sinks: List[Any] = []
+
+    @property
+    def done(self) -> bool:
+        return self.state != self.RUNNING
+
+    # ---- Producteur ----
+
+    def bind(self, source, on_finish: List[Callable[["Flight"], None]] = ()):
+        """Associe le flux de génération (itérateur ou itérateur asynchrone) à pomper"""
+        with self._cond:
+            self._source = source
+        self.add_finish_callback(*on_finish)
+
+    def make_resumable(self, grace: float, journal=None):
+        """Flux SSE : délai de grâce avant abandon et journal disque optionnel (ReplayJournal)"""
+        with self._cond:
+            self.resume_grace = grace
+            self.journal = journal
+        if journal is not None:
+            self.add_sink(journal)
+
+    def add_sink(self, sink):
+        """
+        Abonné côté producteur (journal de reprise, persistance...) : reçoit chaque fragment
+        via `append(chunk)` puis l'état final via `close(state)`, même en cas d'échec ou d'abandon.
+        """
+        with self._cond:
+            for chunk in self.chunks:
+                sink.append(chunk)
+            if not self.done:
+                self._sinks.append(sink)
+                return
+        sink.close(self.state)
+
+    def add_finish_callback(self, *callbacks: Callable[["Flight"], None]):
+        with self._cond:
+            if not self.done:
+                self._on_finish.extend(callbacks)
+                return
+        for callback in callbacks:
+            callback(self)
+
+    @property
+    def joinable(self) -> bool:
+        """Un doublon peut s'y abonner : en cours (et non abandonnée) ou terminée avec succès"""
+        return (self.state == self.COMPLETED
+                or (self.state == self.RUNNING and not self._cancel.is_set()))
+
+    def _wake(self):
+        # Appelée sous le verrou
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters = []
+
+    def publish(self, chunk: str):
+        with self._cond:
+            if self.done:
+                return
+            self.chunks.append(chunk)
+            for sink in self._sinks:
+                sink.append(chunk)
+            if chunk.startswith(ERROR_CHUNK_PREFIX):
+                self.state = self.FAILED
+                self.finished_at = time.monotonic()
+            self._wake()
+
+    def finish(self, state: Optional[str] = None):
+        """Termine la génération ; un état déjà FAILED (fragment d'erreur publié) est conservé"""
+        with self._cond:
+            if self.state == self.RUNNING:
+                self.state = state or self.COMPLETED
+                self.finished_at = time.monotonic()
+            sinks, self._sinks = self._sinks, []
+            for sink in sinks:
+                sink.close(self.state)
+            self._wake()
+            callbacks, self._on_finish = self._on_finish, []
+        for callback in callbacks:
+            callback(self)
+
+    def fail(self, chunk: str):
+        """Échec avant le démarrage de la génération (admission, préparation) : le signale aux abonnés"""
+        self.publish(chunk)
+        self.finish(self.FAILED)
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._started or self._source is None or self.done:
+                return
+            self._started = True
+            source = self._source
+        if hasattr(source, "__aiter__"):
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._apump(source))
+        else:
+            generation_executor.submit(self._pump, source)
+
+    def _pump(self, source):
+        try:
+            for chunk in source:
+                self.publish(chunk)
+                if self._cancel.is_set():
+                    break
+        finally:
+            # Ferme le générateur dans le thread qui l'itère : propage l'annulation au provider
+            source.close()
+            self.finish(self.CANCELLED if self._cancel.is_set() else self.COMPLETED)
+
+    async def _apump(self, source):
+        try:
+            async for chunk in source:
+                self.publish(chunk)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await source.aclose()
+            self.finish(self.CANCELLED if self._cancel.is_set() else self.COMPLETED)
+
+    def _cancel_upstream(self):
+        self._cancel.set()
+        if self._task is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        elif not self._started:
+            close = getattr(self._source, "close", None)
+            if close and not hasattr(self._source, "__aiter__"):
+                close()
+            self.finish(self.CANCELLED)
+
+    # ---- Abonnés ----
+
+    def subscribe(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+            abandoned = self.subscribers <= 0 and not self.done
+        if not abandoned:
+            return
+        if self.resume_grace > 0:
+            self._arm_grace_timer()
+        else:
+            self._cancel_upstream()
+
+    def _arm_grace_timer(self):
+        timer = threading.Timer(self.resume_grace, self._grace_expired)
+        timer.daemon = True
+        timer.start()
+
+    def _grace_expired(self):
+        with self._cond:
+            if self.subscribers > 0 or self.done:
+                return
+        # Client repris sur un autre worker via le journal disque
+        if self.journal is not None and self.journal.reader_seen_within(self.resume_grace):
+            self._arm_grace_timer()
+            return
+        self._cancel_upstream()
+
+    def iter_chunks(self, start: int = 0):
+        """Lecture bloquante (chemin WSGI) du tampon puis des fragments à venir"""
+        self._ensure_started()
+        index = start
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[index:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                return
+
+    async def aiter_chunks(self, start: int = 0):
+        """Lecture sur la boucle d'événements (chemin ASGI)"""
+        self._ensure_started()
+        index = start
+        while True:
+            event = None
+            with self._cond:
+                pending = self.chunks[index:]
+                finished = self.done
+                if not pending and not finished:
+                    event = asyncio.Event()
+                    self._async_waiters.append((asyncio.get_running_loop(), event))
+            if event is not None:
+                await event.wait()
+                continue
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                return
+
+
+class FlightRegistry:
+    """
+    Générations en cours et réponses récentes, indexées par clé d'idempotence et par id.
+      - doublon concurrent : s'abonne à la génération en cours ;
+      - doublon après la fin : rejoue la réponse complète sans rappeler le LLM ;
+      - génération échouée ou annulée : oubliée, le client peut relancer ;
+      - reprise SSE (Last-Event-ID) : retrouve la génération par son id.
+    Le registre est propre au process (un worker) et borné (LRU, `max_entries`) : au-delà
+    (expiration, redémarrage, autre worker), la vue rejoue la réponse enregistrée en base
+    (`replay_stored`).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: "OrderedDict[str, Flight]" = OrderedDict()
+        self._by_id: "OrderedDict[str, Flight]" = OrderedDict()
+        self.started = 0
+        self.joined = 0
+        self.replayed = 0
+        self.replayed_stored = 0
+        self.resumed = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return single_flight_settings().get("enabled", True)
+
+    def _prune(self, now: float):
+        conf = single_flight_settings()
+        ttl = conf.get("replay_ttl", 300)
+        max_entries = conf.get("max_entries", 1000)
+        for index in (self._flights, self._by_id):
+            for key, flight in list(index.items()):
+                if flight.done and flight.finished_at is not None and now - flight.finished_at > ttl:
+                    del index[key]
+            while len(index) > max_entries:
+                index.popitem(last=False)
+
+    def acquire(self, key: Optional[str], owner: Optional[str] = None) -> Tuple[Flight, bool]:
+        """
+        Retourne, déjà abonnée, la génération existante pour `key` ou une nouvelle
+        (created=True). Sans clé, la génération n'est pas dédupliquée.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            flight = self._flights.get(key) if key is not None else None
+            if flight is not None and flight.joinable:
+                self._flights.move_to_end(key)
+                if flight.done:
+                    self.replayed += 1
+                else:
+                    self.joined += 1
+                flight.subscribe()
+                return flight, False
+            flight = Flight(key, owner)
+            flight.subscribe()
+            if key is not None:
+                flight.add_finish_callback(self._forget_failed)
+                self._flights[key] = flight
+            self._by_id[flight.id] = flight
+            self.started += 1
+            return flight, True
+
+    def replay_stored(self, flight: Flight, content: str):
+        """
+        Termine une génération nouvellement acquise avec une réponse déjà enregistrée :
+        les doublons suivants la rejouent depuis le registre, sans relire la base
+        """
+        flight.publish(content)
+        flight.finish(Flight.COMPLETED)
+        with self._lock:
+            self.replayed_stored += 1
+
+    def attach(self, generation_id: str, owner: str) -> Optional[Flight]:
+        """Abonne un client qui reprend le flux `generation_id` (None si inconnu de ce process)"""
+        with self._lock:
+            flight = self._by_id.get(generation_id)
+            if flight is None or flight.owner != owner:
+                return None
+            self.resumed += 1
+            flight.subscribe()
+            return flight
+
+    def _forget_failed(self, flight: Flight):
+        if flight.state == Flight.COMPLETED:
+            return
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for flight in self._by_id.values() if not flight.done)
+            return {
+                "running": running,
+                "completed_cached": sum(1 for flight in self._flights.values() if flight.done),
+                "started": self.started,
+                "joined": self.joined,
+                "replayed": self.replayed,
+                "replayed_from_database": self.replayed_stored,
+                "resumed": self.resumed,
+            }
+
+
+# Instance partagée par tout le process
+flight_registry = FlightRegistry()
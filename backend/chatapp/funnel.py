@@ -0,0 +1,234 @@
+import copy
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from .caching import normalize_text
+from .models import Conversation
+from .semantic import strip_accents
+
+
+PRODUCT_LABELS = {
+    "automobile": "Automobile",
+    "moto": "Moto 2/3 roues",
+    "habitation": "Habitation",
+    "voyage": "Voyage",
+    "sante": "Santé (SOHU)",
+}
+DOCUMENT_LABELS = {
+    "carte_grise": "Carte grise",
+    "cip": "Carte CIP",
+    "permis": "Permis de conduire",
+}
+
+# Expressions (sans accents, en minuscules) reconnues dans les messages du client
+PRODUCT_KEYWORDS = {
+    "moto": ("moto", "motos", "scooter", "2 roues", "deux roues", "3 roues", "trois roues", "tricycle", "zemidjan"),
+    "automobile": ("auto", "automobile", "voiture", "vehicule", "camion", "taxi"),
+    "habitation": ("habitation", "maison", "logement", "appartement", "locataire", "proprietaire"),
+    "voyage": ("voyage", "visa"),
+    "sante": ("sante", "sohu", "maladie", "hospitalisation"),
+}
+DOCUMENT_KEYWORDS = {
+    "carte_grise": ("carte grise", "certificat d immatriculation"),
+    "cip": ("cip", "carte cip"),
+    "permis": ("permis", "permis de conduire"),
+}
+USAGE_KEYWORDS = {
+    "personnel": ("personnel", "personnelle", "prive", "privee", "particulier"),
+    "professionnel": ("professionnel", "professionnelle", "livraison", "transport", "taxi", "zemidjan"),
+}
+PROVIDED = ("voici", "ci joint", "joint", "jointe", "envoye", "envoyee", "envoie", "transmis", "transmets",
+            "televerse", "telecharge", "fourni", "fournis", "en piece jointe")
+ACCEPTED = ("j accepte", "je valide", "je confirme", "on y va", "je souscris", "je veux souscrire", "d accord pour")
+DOCUMENT_QUESTIONS = ("quels documents", "quelles pieces", "quels papiers", "quelles pieces manquent",
+                      "documents manquants", "pieces manquantes", "que dois je fournir", "quoi fournir",
+                      "quels justificatifs", "il manque quoi", "que manque t il")
+QUOTE_QUESTIONS = ("prix", "prime", "tarif", "combien", "cout", "devis", "montant")
+
+_WORD_RE = re.compile(r"\w+")
+_PLATE_RE = re.compile(r"\b([a-z]{1,2}) ?(\d{4}) ?(rb)\b")
+_POWER_RE = re.compile(r"\b(\d{1,2}) ?(?:cv|chevaux)\b")
+_PHONE_RE = re.compile(r"(?<!\d)(?:\+?229 ?)?((?:01 ?)?\d{2}(?: ?\d{2}){3})(?!\d)")
+
+
+def funnel_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_FUNNEL", {})
+
+
+def _canonical(text: str) -> str:
+    return f" {' '.join(_WORD_RE.findall(strip_accents(normalize_text(text))))} "
+
+
+def _mentions(canonical: str, phrases: Iterable[str]) -> bool:
+    return any(f" {phrase} " in canonical for phrase in phrases)
+
+
+def empty_state() -> Dict[str, Any]:
+    return {
+        "stage": "besoin",
+        "product": None,
+        "vehicle": {},
+        "documents_received": [],
+        "fields": {},
+        "quote": {"status": "aucun", "amount": None},
+    }
+
+
+class FunnelTracker:
+    """
+    État structuré du parcours de souscription d'une conversation (besoin → documents →
+    prime → finalisation), mis à jour à chaque message client par des règles déterministes,
+    sans appel au modèle : produit, véhicule, pièces reçues, champs extraits, statut du devis.
+    Cet état est injecté dans le prompt sous forme d'un bloc compact qui remplace l'historique
+    ancien ; les étapes qui ne sont que des données (pièces manquantes, devis calculable à partir
+    de la grille `tariffs`) sont servies directement, sans LLM.
+    """
+
+    # ---- Mise à jour ----
+
+    @staticmethod
+    def required_documents(product: Optional[str]) -> List[str]:
+        if product is None:
+            return []
+        return funnel_settings().get("documents", {}).get(product, ["cip"])
+
+    def missing_documents(self, state: Dict[str, Any]) -> List[str]:
+        received = set(state.get("documents_received", []))
+        return [doc for doc in self.required_documents(state.get("product")) if doc not in received]
+
+    def apply(self, state: Optional[Dict[str, Any]], content: str) -> Dict[str, Any]:
+        """Nouvel état après un message client (l'état reçu n'est pas modifié)"""
+        state = copy.deepcopy(state) if state else empty_state()
+        canonical = _canonical(content)
+        raw = strip_accents((content or "").lower())
+
+        for product, keywords in PRODUCT_KEYWORDS.items():
+            if _mentions(canonical, keywords):
+                if product != state["product"]:
+                    # Changement de produit : le devis éventuel ne vaut plus
+                    state["quote"] = {"status": "aucun", "amount": None}
+                state["product"] = product
+                break
+
+        if _mentions(canonical, PROVIDED):
+            for document, keywords in DOCUMENT_KEYWORDS.items():
+                if _mentions(canonical, keywords) and document not in state["documents_received"]:
+                    state["documents_received"].append(document)
+
+        plate = _PLATE_RE.search(raw)
+        if plate:
+            state["vehicle"]["immatriculation"] = " ".join(plate.groups()).upper()
+        power = _POWER_RE.search(raw)
+        if power:
+            state["vehicle"]["puissance_cv"] = int(power.group(1))
+        for usage, keywords in USAGE_KEYWORDS.items():
+            if _mentions(canonical, keywords):
+                state["vehicle"]["usage"] = usage
+                break
+        phone = _PHONE_RE.search(raw)
+        if phone:
+            state["fields"]["telephone"] = phone.group(1).replace(" ", "")
+        for zone in funnel_settings().get("zones", []):
+            if _mentions(canonical, [" ".join(_WORD_RE.findall(strip_accents(zone.lower())))]):
+                state["fields"]["zone"] = zone
+                break
+
+        if state["quote"]["status"] == "calcule" and _mentions(canonical, ACCEPTED):
+            state["quote"]["status"] = "accepte"
+        elif state["quote"]["status"] != "accepte" and state["product"] and not self.missing_documents(state):
+            # Recalculé à chaque message : une puissance ou un usage corrigé change la prime
+            amount = self.premium(state)
+            state["quote"] = {"status": "calcule" if amount is not None else "aucun", "amount": amount}
+
+        state["stage"] = self.stage(state)
+        return state
+
+    def rebuild(self, contents: Iterable[str]) -> Dict[str, Any]:
+        """État recalculé depuis les messages client (après une édition qui en supprime)"""
+        state = empty_state()
+        for content in contents:
+            state = self.apply(state, content)
+        return state
+
+    def stage(self, state: Dict[str, Any]) -> str:
+        if not state.get("product"):
+            return "besoin"
+        if self.missing_documents(state):
+            return "documents"
+        if state["quote"]["status"] != "accepte":
+            return "prime"
+        return "finalisation"
+
+    @staticmethod
+    def premium(state: Dict[str, Any]) -> Optional[int]:
+        """Prime annuelle en FCFA selon la grille configurée, ou None si le produit n'y figure pas"""
+        tariff = funnel_settings().get("tariffs", {}).get(state.get("product"))
+        if not tariff:
+            return None
+        amount = tariff.get("base", 0)
+        if "per_cv" in tariff:
+            power = state["vehicle"].get("puissance_cv")
+            if power is None:
+                return None
+            amount += tariff["per_cv"] * power
+        if state["vehicle"].get("usage") == "professionnel":
+            amount *= tariff.get("professional_factor", 1.0)
+        return int(round(amount))
+
+    def track(self, conversation: Conversation, content: str, rebuild: bool = False) -> Dict[str, Any]:
+        """Met à jour et enregistre l'état de la conversation pour le message courant"""
+        if rebuild:
+            contents = conversation.messages.filter(author="user").values_list("content", flat=True)
+            state = self.rebuild(contents)
+        else:
+            state = self.apply(conversation.funnel_state, content)
+        if state != conversation.funnel_state:
+            Conversation.objects.filter(pk=conversation.pk).update(funnel_state=state)
+            conversation.funnel_state = state
+        return state
+
+    # ---- Restitution ----
+
+    def render(self, state: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Bloc compact injecté dans le prompt, ou None tant que le besoin n'est pas identifié"""
+        if not state or not state.get("product"):
+            return None
+        parts = [f"produit={PRODUCT_LABELS.get(state['product'], state['product'])}", f"étape={state['stage']}"]
+        received = [DOCUMENT_LABELS.get(doc, doc) for doc in state.get("documents_received", [])]
+        missing = [DOCUMENT_LABELS.get(doc, doc) for doc in self.missing_documents(state)]
+        parts.append(f"pièces reçues={', '.join(received) or 'aucune'}")
+        if missing:
+            parts.append(f"pièces manquantes={', '.join(missing)}")
+        parts += [f"{name}={value}" for name, value in state.get("vehicle", {}).items()]
+        parts += [f"{name}={value}" for name, value in state.get("fields", {}).items()]
+        quote = state.get("quote", {})
+        if quote.get("amount") is not None:
+            parts.append(f"devis={quote['status']} ({quote['amount']:,} FCFA)".replace(",", " "))
+        else:
+            parts.append(f"devis={quote.get('status', 'aucun')}")
+        return " ; ".join(parts)
+
+    def direct_answer(self, state: Optional[Dict[str, Any]], content: str) -> Optional[str]:
+        """Réponse servie sans LLM quand la question ne porte que sur des données de l'état"""
+        if not funnel_settings().get("direct_answers", True) or not state or not state.get("product"):
+            return None
+        canonical = _canonical(content)
+        label = PRODUCT_LABELS.get(state["product"], state["product"])
+        if _mentions(canonical, DOCUMENT_QUESTIONS):
+            missing = [DOCUMENT_LABELS.get(doc, doc) for doc in self.missing_documents(state)]
+            if missing:
+                return (f"Pour votre assurance {label}, il reste à fournir : {', '.join(missing)}. "
+                        f"Vous pouvez les envoyer ici en pièce jointe.")
+            return f"Toutes les pièces de votre dossier {label} sont reçues. Passons au calcul de votre prime."
+        quote = state.get("quote", {})
+        if quote.get("amount") is not None and _mentions(canonical, QUOTE_QUESTIONS):
+            amount = f"{quote['amount']:,}".replace(",", " ")
+            return (f"Votre prime annuelle pour l'assurance {label} est estimée à {amount} FCFA. "
+                    f"Souhaitez-vous valider ce devis pour finaliser la souscription ?")
+        return None
+
+
+# Instance partagée par tout le process
+funnel_tracker = FunnelTracker()
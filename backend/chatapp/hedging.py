@@ -0,0 +1,123 @@
+import threading
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from .resilience import RetryBudget
+
+
+def hedging_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_HEDGING", {})
+
+
+class HedgeStats:
+    """Compteurs de couverture d'un modèle principal"""
+    def __init__(self):
+        self.eligible = 0
+        self.fired = 0
+        self.primary_wins = 0
+        self.backup_wins = 0
+        self.no_winner = 0
+        self.budget_rejected = 0
+        self.unavailable = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        decided = self.primary_wins + self.backup_wins
+        return {
+            "eligible": self.eligible,
+            "fired": self.fired,
+            "hedge_rate": round(self.fired / self.eligible, 4) if self.eligible else 0.0,
+            "primary_wins": self.primary_wins,
+            "backup_wins": self.backup_wins,
+            "backup_win_rate": round(self.backup_wins / decided, 4) if decided else None,
+            "no_winner": self.no_winner,
+            "budget_rejected": self.budget_rejected,
+            "backup_unavailable": self.unavailable,
+        }
+
+
+class HedgePolicy:
+    """
+    Requêtes de couverture (« hedged requests ») sur le premier token, partagées par tout le process.
+    Si le modèle principal n'a produit aucun token après `deadline` secondes, la même requête part
+    vers le modèle de secours (`backup`, en général un autre provider) ; le premier des deux qui
+    produit un token est servi, l'autre est annulé. Le trafic de couverture est plafonné par un
+    budget glissant (`budget_ratio` des requêtes éligibles, plus un plancher par seconde) pour
+    qu'un provider lent ne double pas la charge de son secours.
+    """
+    def __init__(self):
+        conf = hedging_settings()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, HedgeStats] = {}
+        self.budget = RetryBudget(
+            ratio=conf.get("budget_ratio", 0.1),
+            min_per_second=conf.get("budget_min_per_second", 0.1),
+            window=conf.get("budget_window", 60.0),
+        )
+
+    def _model_stats(self, model_id: str) -> HedgeStats:
+        stats = self._stats.get(model_id)
+        if stats is None:
+            stats = self._stats.setdefault(model_id, HedgeStats())
+        return stats
+
+    def plan(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """Échéance et modèle de secours du modèle, ou None s'il n'est pas couvert"""
+        conf = hedging_settings()
+        if not conf.get("enabled", False):
+            return None
+        model_conf = conf.get("models", {}).get(model_id)
+        if not model_conf or not model_conf.get("backup") or model_conf["backup"] == model_id:
+            return None
+        self.budget.record_request()
+        with self._lock:
+            self._model_stats(model_id).eligible += 1
+        return {
+            "deadline": model_conf.get("deadline", conf.get("default_deadline", 2.0)),
+            "backup": model_conf["backup"],
+        }
+
+    def try_fire(self, model_id: str) -> bool:
+        """Consomme une couverture si le budget le permet"""
+        allowed = self.budget.try_acquire()
+        with self._lock:
+            stats = self._model_stats(model_id)
+            if allowed:
+                stats.fired += 1
+            else:
+                stats.budget_rejected += 1
+        return allowed
+
+    def record_unavailable(self, model_id: str):
+        """Secours indisponible (disjoncteur ouvert, initialisation impossible)"""
+        with self._lock:
+            self._model_stats(model_id).unavailable += 1
+
+    def record_outcome(self, model_id: str, winner: Optional[str]):
+        """`winner` : 'primary', 'backup', ou None si aucun des deux n'a produit de token"""
+        with self._lock:
+            stats = self._model_stats(model_id)
+            if winner == "primary":
+                stats.primary_wins += 1
+            elif winner == "backup":
+                stats.backup_wins += 1
+            else:
+                stats.no_winner += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        budget = self.budget.snapshot()
+        with self._lock:
+            return {
+                "enabled": hedging_settings().get("enabled", False),
+                "budget": {
+                    "window_seconds": budget["window_seconds"],
+                    "eligible_requests": budget["requests"],
+                    "hedges": budget["retries"],
+                    "rejected": budget["rejected"],
+                },
+                "models": {model_id: stats.snapshot() for model_id, stats in self._stats.items()},
+            }
+
+
+# Instance partagée par tout le process
+hedge_policy = HedgePolicy()
@@ -1,15 +1,21 @@
 import os
-from typing import Any, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 from langchain.llms.base import LLM
-from langchain.callbacks.manager import CallbackManagerForLLMRun
-from groq import Groq
-from langchain.schema import BaseMessage
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+
+from .providers import provider_clients
+
+# Modèle Groq utilisé quand le registre ne précise pas de modèle
+LLAMA_GROQ_MODEL = "llama-3.3-70b-versatile"
 
 class LlamaLLM(LLM):
     temperature: float = 0.95
     max_tokens: int = 1024
     top_p: float = 0.95
     api_key: Optional[str] = None
+    model: str = LLAMA_GROQ_MODEL
+    base_url: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -31,61 +37,111 @@ class LlamaLLM(LLM):
 
     @property
     def _llm_type(self):
-        return "llama-3.3-70b-versatile"
+        return self.model
 
-    def _call(
-        self,
-        prompt: Union[str, List[BaseMessage]],
-        stop: Optional[List[str]] = None,
-        callback_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ):
-        # run_manager: Optional[CallbackManagerForLLMRun] = kwargs.pop("run_manager", None)
+    def _request(self, prompt: str, stop: Optional[List[str]]) -> Dict[str, Any]:
         if stop is not None:
             raise ValueError("Les arguments 'stop' ne sont pas supportés dans cette implémentation.")
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+            "stream": True,
+        }
 
-        # Si prompt est une liste de messages, on joint leur contenu en une chaîne
-        if isinstance(prompt, list):
-            prompt = "\n".join([m.content for m in prompt if hasattr(m, "content")])
-        
-        client = Groq(api_key=self.api_key)
-        messages = [{"role": "user", "content": prompt}]
-        full_response = ""
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """
+        Flux Groq natif : chaque token est remis à l'appelant dès sa réception (llm.stream),
+        sans file ni callback intermédiaire. Fermer l'itérateur coupe la réponse HTTP ;
+        `on_response` reçoit cette fermeture, utilisable pendant une lecture en cours.
+        """
+        # Client Groq partagé : la connexion keep-alive est réutilisée d'un tour à l'autre
+        client = provider_clients.groq(self.model, self.api_key, self.base_url)
+        stream_resp = client.chat.completions.create(**self._request(prompt, stop))
+        if kwargs.get("on_response"):
+            # Fermeture possible depuis un autre thread (couverture abandonnée pendant la lecture)
+            kwargs["on_response"](stream_resp.close)
+        emitted = False
         try:
-            # Appel à l'API Groq en mode streaming
-            stream_resp = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                top_p=self.top_p,
-                stream=True  # En mode streaming
-            )
             for chunk in stream_resp:
-                token = ""
-                try:
-                    token = chunk.choices[0].delta.content
-                    # print("hereeeeeeeeeeee  is the chunk :::::::::::::::::::", chunk)
-                    # print("here is the token :::::::::::::::", token)
-                except AttributeError:
-                    token = chunk.choices[0].message.content
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                emitted = True
+                generation = GenerationChunk(text=token)
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=generation)
+                yield generation
+            if not emitted:
+                # Réponse vide : LangChain attend au moins un fragment
+                yield GenerationChunk(text="")
+        finally:
+            # Interruption (client déconnecté, erreur) : on coupe le flux HTTP au lieu de le consommer
+            stream_resp.close()
 
-                # Assurez-vous que token est une chaîne (si None, on remplace par "")
-                if token is None:
-                    token = ""
-                
-                full_response += token
-                if callback_manager:
-                    callback_manager.on_llm_new_token(token)
-            return full_response.strip()
-        except Exception as e:
-            print(f"Erreur lors de l'appel à l'API Groq : {str(e)}")
-            raise
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """Version asynchrone native : le flux Groq est consommé sur la boucle d'événements"""
+        client = provider_clients.async_groq(self.model, self.api_key, self.base_url)
+        stream_resp = await client.chat.completions.create(**self._request(prompt, stop))
+        emitted = False
+        try:
+            async for chunk in stream_resp:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                emitted = True
+                generation = GenerationChunk(text=token)
+                if run_manager:
+                    await run_manager.on_llm_new_token(token, chunk=generation)
+                yield generation
+            if not emitted:
+                yield GenerationChunk(text="")
+        finally:
+            # Fermeture explicite : libère la connexion si la tâche est annulée
+            await stream_resp.close()
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Réponse complète (invoke), assemblée à partir du flux"""
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs)).strip()
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        parts = [chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)]
+        return "".join(parts).strip()
 
     @property
     def _identifying_params(self):
         return {
-            "model": "llama-3.3-70b-versatile",
+            "model": self.model,
             "temperature": self.temperature,
             "max_tokens": self.max_tokens,
             "top_p": self.top_p
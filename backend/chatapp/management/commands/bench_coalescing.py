@@ -0,0 +1,155 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatapp.metrics import _percentile
+from chatapp.streaming import TokenCoalescer
+
+
+SAMPLE_TEXT = (
+    "Bonjour ! Pour votre assurance auto, nous avons besoin de la marque, du modèle, "
+    "de l'année de mise en circulation et de la valeur du véhicule. Le devis est établi "
+    "en quelques minutes et vous pouvez souscrire directement en ligne. "
+)
+
+
+def sample_tokens(count):
+    """Découpe un texte d'exemple en tokens d'environ 4 caractères, comme un tokenizer BPE"""
+    text = SAMPLE_TEXT * (count * 4 // len(SAMPLE_TEXT) + 1)
+    return [text[i:i + 4] for i in range(0, count * 4, 4)]
+
+
+def run_stream(tokens, rate, coalescer):
+    """
+    Rejoue un flux de tokens (producteur cadencé à `rate` tokens/s, 0 = sans pause) à
+    travers le coalesceur, comme la boucle de ChatHandler, et écrit chaque fragment
+    dans un pipe : compte les écritures et mesure la latence ajoutée à chaque token.
+    """
+    token_queue = queue.Queue()
+    read_fd, write_fd = os.pipe()
+
+    def produce():
+        start = time.monotonic()
+        for index, token in enumerate(tokens):
+            if rate:
+                delay = start + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            token_queue.put((token, time.monotonic()))
+        token_queue.put(None)
+
+    def drain():
+        while os.read(read_fd, 65536):
+            pass
+
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    producer = threading.Thread(target=produce, daemon=True)
+
+    writes = 0
+    written = 0
+    latencies = []
+    pending = []
+
+    def write(chunk):
+        nonlocal writes, written
+        os.write(write_fd, chunk.encode("utf-8"))
+        writes += 1
+        written += len(chunk)
+        now = time.monotonic()
+        latencies.extend(now - arrived for arrived in pending)
+        pending.clear()
+
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    producer.start()
+    while True:
+        try:
+            item = token_queue.get(timeout=coalescer.timeout())
+        except queue.Empty:
+            write(coalescer.flush())
+            continue
+        if item is None:
+            break
+        token, arrived = item
+        pending.append(arrived)
+        chunk = coalescer.add(token)
+        if chunk:
+            write(chunk)
+    rest = coalescer.flush()
+    if rest:
+        write(rest)
+    cpu = time.thread_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    os.close(write_fd)
+    drainer.join()
+    os.close(read_fd)
+    return {
+        "writes": writes,
+        "bytes_per_write": round(written / writes, 1) if writes else 0,
+        "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+        "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "latency_max_ms": round(max(latencies) * 1000, 2),
+        "consumer_cpu_ms": round(cpu * 1000, 1),
+        "elapsed_s": round(elapsed, 3),
+        "tokens_per_second": round(len(tokens) / elapsed, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Mesure le regroupement des tokens (LLM_STREAM_COALESCING) : écritures par réponse, "
+            "latence ajoutée à chaque token et débit maximal, pour plusieurs seuils.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tokens", type=int, default=2000, help="Tokens par réponse simulée")
+        parser.add_argument("--rate", type=float, default=100.0,
+                            help="Cadence du provider simulé en tokens/s (mesure de latence)")
+        parser.add_argument("--configs", default="0:0,32:20,128:50,256:50,1024:100",
+                            help="Seuils à comparer, 'octets:ms' séparés par des virgules (0:0 = sans regroupement)")
+        parser.add_argument("--json", action="store_true", help="Sortie JSON")
+
+    def handle(self, *args, **options):
+        tokens = sample_tokens(options["tokens"])
+        results = []
+        for config in options["configs"].split(","):
+            max_bytes, max_delay_ms = (int(value) for value in config.split(":"))
+
+            def coalescer():
+                return TokenCoalescer(max_bytes=max_bytes, max_delay=max_delay_ms / 1000)
+
+            paced = run_stream(tokens, options["rate"], coalescer())
+            unpaced = run_stream(tokens, 0, coalescer())
+            results.append({
+                "max_bytes": max_bytes,
+                "max_delay_ms": max_delay_ms,
+                "paced": paced,
+                "max_throughput_tokens_per_second": unpaced["tokens_per_second"],
+                "unpaced_writes": unpaced["writes"],
+                "unpaced_consumer_cpu_ms": unpaced["consumer_cpu_ms"],
+            })
+
+        if options["json"]:
+            self.stdout.write(json.dumps({"tokens": options["tokens"], "rate": options["rate"],
+                                          "results": results}, indent=2))
+            return
+
+        self.stdout.write(f"{options['tokens']} tokens, provider à {options['rate']:g} tokens/s\n")
+        header = (f"{'seuil':>12} {'écritures':>10} {'o/écrit.':>9} {'lat. p50':>9} {'lat. p95':>9} "
+                  f"{'lat. max':>9} {'CPU ms':>8} | {'max tok/s':>10} {'écritures':>10} {'CPU ms':>8}")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for result in results:
+            paced = result["paced"]
+            label = f"{result['max_bytes']}o/{result['max_delay_ms']}ms"
+            self.stdout.write(
+                f"{label:>12} {paced['writes']:>10} {paced['bytes_per_write']:>9} "
+                f"{paced['latency_p50_ms']:>9} {paced['latency_p95_ms']:>9} {paced['latency_max_ms']:>9} "
+                f"{paced['consumer_cpu_ms']:>8} | {result['max_throughput_tokens_per_second']:>10} "
+                f"{result['unpaced_writes']:>10} {result['unpaced_consumer_cpu_ms']:>8}"
+            )
+        self.stdout.write("\nLatence : délai ajouté entre l'arrivée d'un token et son écriture (flux cadencé).")
+        self.stdout.write("Colonnes de droite : flux non cadencé (débit maximal de l'étage de regroupement).")
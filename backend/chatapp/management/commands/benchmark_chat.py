@@ -0,0 +1,198 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chatapp.benchmark import (
+    BENCHMARK_SCENARIOS,
+    DRIVERS,
+    commit_info,
+    compare_results,
+    machine_info,
+    run_scenario,
+    server_errors,
+)
+from chatapp.models import User
+
+
+class Command(BaseCommand):
+    help = ("Banc de charge de bout en bout de /api/chat/message/generate/ : N utilisateurs simultanés "
+            "sur les piles WSGI et ASGI avec le fournisseur simulé (TTFT p50/p95/p99, tokens/s, requêtes "
+            "SQL par tour, RSS et threads au pic). Résultats en JSON, comparables d'un commit à l'autre.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=sorted(BENCHMARK_SCENARIOS),
+                            help="Cas à exécuter (répétable ; défaut : steady)")
+        parser.add_argument("--all", action="store_true", help="Exécute tous les cas")
+        parser.add_argument("--stack", choices=["wsgi", "asgi", "both"], default="both")
+        parser.add_argument("--users", type=int, help="Utilisateurs simultanés (remplace la valeur du cas)")
+        parser.add_argument("--turns", type=int, help="Tours par utilisateur (remplace la valeur du cas)")
+        parser.add_argument("--model", help="Profil du fournisseur simulé (remplace celui du cas)")
+        parser.add_argument("--think", type=float, default=0.0, help="Pause entre deux tours d'un utilisateur (s)")
+        parser.add_argument("--warmup", type=int, default=1, help="Tours de chauffe non mesurés par pile")
+        parser.add_argument("--output", help="Fichier JSON des résultats (défaut : data/benchmarks/chat-<commit>-<date>.json)")
+        parser.add_argument("--no-save", action="store_true", help="N'écrit pas de fichier de résultats")
+        parser.add_argument("--compare", help="Résultats de référence (JSON) à comparer")
+        parser.add_argument("--fail-on-regression", type=float,
+                            help="Échoue si une métrique se dégrade de plus de ce pourcentage par rapport à --compare")
+        parser.add_argument("--keep-caches", action="store_true",
+                            help="Garde les caches de réponses (sinon désactivés pour mesurer la génération)")
+        parser.add_argument("--keep-rate-limits", action="store_true",
+                            help="Garde la limitation de débit par utilisateur (sinon désactivée)")
+        parser.add_argument("--json", action="store_true", help="Sortie JSON")
+
+    def handle(self, *args, **options):
+        names = sorted(BENCHMARK_SCENARIOS) if options["all"] else (options["scenario"] or ["steady"])
+        stacks = list(DRIVERS) if options["stack"] == "both" else [options["stack"]]
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"], encoding="utf-8") as handle:
+                    baseline = json.load(handle)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Référence illisible ({options['compare']}) : {e}")
+
+        report = {
+            "datetime": datetime.now().isoformat(timespec="seconds"),
+            "commit_info": commit_info(),
+            "machine_info": machine_info(),
+            "options": {key: options[key] for key in ("stack", "think", "warmup", "keep_caches", "keep_rate_limits")},
+            "benchmarks": [],
+        }
+        with self.isolated_database():
+            for name in names:
+                scenario = BENCHMARK_SCENARIOS[name]
+                params = {
+                    "model": options["model"] or scenario["model"],
+                    "users": options["users"] or scenario["users"],
+                    "turns": options["turns"] or scenario["turns"],
+                    "profile": scenario.get("profile", {}),
+                }
+                users = self.create_users(name, params["users"])
+                with override_settings(**self.benchmark_settings(params, options)):
+                    for stack in stacks:
+                        if options["warmup"]:
+                            run_scenario(stack, users[:1], options["warmup"], params["model"])
+                        if not options["json"]:
+                            self.stderr.write(f"{name}[{stack}] : {params['users']} utilisateurs x "
+                                              f"{params['turns']} tours ({params['model']})...")
+                        stats = run_scenario(stack, users, params["turns"], params["model"], options["think"])
+                        report["benchmarks"].append({
+                            "name": f"{name}[{stack}]",
+                            "group": name,
+                            "stack": stack,
+                            "params": params,
+                            "stats": stats,
+                        })
+
+        if not options["no_save"]:
+            path = Path(options["output"] or self.default_output(report))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+            if not options["json"]:
+                self.stderr.write(f"Résultats enregistrés dans {path}")
+
+        rows = compare_results(report, baseline) if baseline else []
+        if options["json"]:
+            self.stdout.write(json.dumps({**report, "comparison": rows} if baseline else report, indent=2))
+        else:
+            self.write_table(report)
+            if baseline:
+                self.write_comparison(rows, baseline)
+
+        failures = server_errors(report)
+        if failures:
+            raise CommandError(
+                "Erreurs serveur pendant le banc (HTTP 500) : "
+                + ", ".join(f"{name} x{count}" for name, count in failures.items())
+            )
+
+        threshold = options["fail_on_regression"]
+        if baseline and threshold is not None:
+            regressions = [row for row in rows if row["change"] * 100 > threshold]
+            if regressions:
+                raise CommandError(
+                    f"{len(regressions)} métrique(s) dégradée(s) de plus de {threshold:g}% : "
+                    + ", ".join(f"{row['name']} {row['metric']} {row['change']:+.1%}" for row in regressions)
+                )
+
+    @contextmanager
+    def isolated_database(self):
+        """Base de test jetable (comme le lanceur de tests) : la base de l'application n'est pas modifiée"""
+        if connection.vendor == "sqlite":
+            # Fichier temporaire : la base en mémoire partagée supporte mal les écritures de plusieurs threads
+            handle, path = tempfile.mkstemp(prefix="benchmark-", suffix=".sqlite3")
+            os.close(handle)
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = path
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def create_users(scenario: str, count: int):
+        """Un compte et un jeton d'accès JWT par utilisateur simulé (authentification réelle à chaque tour)"""
+        users = []
+        for index in range(count):
+            user = User.objects.create_user(email=f"bench-{scenario}-{index}@example.com", name=f"Bench {index}")
+            users.append({"id": user.pk, "token": str(RefreshToken.for_user(user).access_token)})
+        return users
+
+    @staticmethod
+    def benchmark_settings(params, options):
+        """Fournisseur simulé activé (profil ajusté par le cas) ; aucun appel externe, résumés compris"""
+        fake = getattr(settings, "LLM_FAKE_PROVIDER", {})
+        profiles = dict(fake.get("profiles", {}))
+        if params["profile"]:
+            profiles[params["model"]] = {**profiles.get(params["model"], {}), **params["profile"]}
+        overrides = {
+            "LLM_FAKE_PROVIDER": {**fake, "enabled": True, "profiles": profiles},
+            "LLM_CONVERSATION_SUMMARY": {**getattr(settings, "LLM_CONVERSATION_SUMMARY", {}), "model": params["model"]},
+        }
+        if not options["keep_caches"]:
+            for name in ("LLM_RESPONSE_CACHE", "LLM_SEMANTIC_CACHE"):
+                overrides[name] = {**getattr(settings, name, {}), "enabled": False}
+        if not options["keep_rate_limits"]:
+            overrides["LLM_RATE_LIMIT"] = {**getattr(settings, "LLM_RATE_LIMIT", {}), "enabled": False}
+        return overrides
+
+    @staticmethod
+    def default_output(report) -> Path:
+        commit = (report["commit_info"]["id"] or "local")[:10]
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return Path(settings.BASE_DIR) / "data" / "benchmarks" / f"chat-{commit}-{stamp}.json"
+
+    def write_table(self, report):
+        header = (f"{'cas':<22} {'tours':>6} {'err.':>5} {'ttft p50':>9} {'p95':>8} {'p99':>8} "
+                  f"{'tok/s':>8} {'SQL/tour':>9} {'RSS Mo':>7} {'threads':>8}")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for bench in report["benchmarks"]:
+            stats = bench["stats"]
+            self.stdout.write(
+                f"{bench['name']:<22} {stats['turns']:>6} {stats['errors']:>5} {str(stats['ttft_p50_ms']):>9} "
+                f"{str(stats['ttft_p95_ms']):>8} {str(stats['ttft_p99_ms']):>8} {str(stats['tokens_per_second']):>8} "
+                f"{str(stats['db_queries_per_turn']):>9} {stats['peak_rss_mb']:>7} {stats['peak_threads']:>8}"
+            )
+        for bench in report["benchmarks"]:
+            if bench["stats"]["error_types"]:
+                errors = ", ".join(f"{error_type} x{count}" for error_type, count in bench["stats"]["error_types"].items())
+                self.stdout.write(f"  {bench['name']} : {errors}")
+        self.stdout.write("\nTTFT en ms, mesuré côté client ; tok/s : débit cumulé de tous les flux ; "
+                          "RSS et threads : pics du process pendant le cas.")
+
+    def write_comparison(self, rows, baseline):
+        reference = (baseline.get("commit_info") or {}).get("id") or "référence"
+        self.stdout.write(f"\nComparaison avec {str(reference)[:10]} (positif = dégradation) :")
+        for row in rows:
+            self.stdout.write(f"  {row['name']:<22} {row['metric']:<20} {row['baseline']:>10} -> "
+                              f"{row['current']:>10} {row['change']:+8.1%}")
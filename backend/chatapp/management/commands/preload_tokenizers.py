@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatapp.tokens import token_counter, tokenizer_settings
+
+
+class Command(BaseCommand):
+    help = ("Télécharge et charge les encodages tiktoken de LLM_TOKENIZER dans leur répertoire de cache "
+            "(étape de build ou de déploiement) : le chemin des requêtes ne télécharge jamais rien.")
+
+    def handle(self, *args, **options):
+        errors = token_counter.preload()
+        for name in token_counter.preload_names():
+            if name not in errors:
+                self.stdout.write(f"{name} : prêt")
+        if errors:
+            raise CommandError(
+                f"Encodages indisponibles ({tokenizer_settings().get('cache_dir')}) : "
+                + ", ".join(f"{name} ({error})" for name, error in errors.items())
+            )
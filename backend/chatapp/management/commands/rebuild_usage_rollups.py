@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+from chatapp.models import ConversationUsage, DailyUsage, TokenUsage
+
+
+class Command(BaseCommand):
+    help = ("Recalcule les cumuls DailyUsage et ConversationUsage depuis TokenUsage "
+            "(reprise de l'historique ou correction après incident).")
+
+    def handle(self, *args, **options):
+        totals = dict(
+            requests=Count("id"),
+            prompt_tokens=Sum("prompt_tokens"),
+            completion_tokens=Sum("completion_tokens"),
+            tokens_used=Sum("tokens_used"),
+        )
+        daily = (TokenUsage.objects
+                 .annotate(day=TruncDate("recorded_at"), model=Coalesce("model_id", Value("")))
+                 .values("user_id", "day", "model")
+                 .annotate(**totals))
+        conversations = (TokenUsage.objects
+                         .filter(conversation__isnull=False)
+                         .values("conversation_id")
+                         .annotate(**totals))
+
+        with transaction.atomic():
+            DailyUsage.objects.all().delete()
+            ConversationUsage.objects.all().delete()
+            DailyUsage.objects.bulk_create([
+                DailyUsage(user_id=row["user_id"], day=row["day"], model_id=row["model"],
+                           **{field: row[field] or 0 for field in totals})
+                for row in daily
+            ])
+            ConversationUsage.objects.bulk_create([
+                ConversationUsage(conversation_id=row["conversation_id"],
+                                  **{field: row[field] or 0 for field in totals})
+                for row in conversations
+            ])
+        self.stdout.write(self.style.SUCCESS(
+            f"{DailyUsage.objects.count()} cumuls quotidiens, "
+            f"{ConversationUsage.objects.count()} cumuls de conversation "
+            f"(compteurs de quota en cache relus sous LLM_QUOTA['cache_ttl'] secondes)"
+        ))
@@ -0,0 +1,140 @@
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class ModelStats:
+    """Fenêtre glissante des mesures d'un modèle (TTFT, débit, longueur des réponses)"""
+    def __init__(self, window: int = 200):
+        self.ttft = deque(maxlen=window)
+        self.tokens_per_second = deque(maxlen=window)
+        self.completion_tokens = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.cancelled_tokens_emitted = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self.prompt_tokens = deque(maxlen=window)
+        self.prompts_windowed = 0
+        self.prompt_tokens_saved = 0
+
+    def avg_completion_tokens(self) -> Optional[float]:
+        if not self.completion_tokens:
+            return None
+        return sum(self.completion_tokens) / len(self.completion_tokens)
+
+    def avg_tokens_per_second(self) -> Optional[float]:
+        if not self.tokens_per_second:
+            return None
+        return sum(self.tokens_per_second) / len(self.tokens_per_second)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ttft_p50 = _percentile(self.ttft, 0.5)
+        ttft_p95 = _percentile(self.ttft, 0.95)
+        tps = self.avg_tokens_per_second()
+        avg_tokens = self.avg_completion_tokens()
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "ttft_p50_ms": round(ttft_p50 * 1000, 1) if ttft_p50 is not None else None,
+            "ttft_p95_ms": round(ttft_p95 * 1000, 1) if ttft_p95 is not None else None,
+            "tokens_per_second": round(tps, 1) if tps is not None else None,
+            "avg_completion_tokens": round(avg_tokens, 1) if avg_tokens is not None else None,
+            "cancelled": self.cancelled,
+            "cancelled_tokens_emitted": self.cancelled_tokens_emitted,
+            "tokens_saved": self.tokens_saved,
+            "seconds_saved": round(self.seconds_saved, 2),
+            "avg_prompt_tokens": round(sum(self.prompt_tokens) / len(self.prompt_tokens), 1) if self.prompt_tokens else None,
+            "prompts_windowed": self.prompts_windowed,
+            "prompt_tokens_saved": self.prompt_tokens_saved,
+        }
+
+
+class GenerationMetrics:
+    """
+    Mesures de génération par modèle, partagées par tout le process.
+    Les annulations (client parti en cours de réponse) sont valorisées à partir
+    de la longueur moyenne des réponses complètes et du débit observé du modèle.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelStats] = {}
+
+    def _stats(self, model_id: str) -> ModelStats:
+        stats = self._models.get(model_id)
+        if stats is None:
+            stats = self._models.setdefault(model_id, ModelStats())
+        return stats
+
+    def record_completion(self, model_id: str, ttft: Optional[float], tokens: int, duration: float):
+        with self._lock:
+            stats = self._stats(model_id)
+            stats.completed += 1
+            stats.completion_tokens.append(tokens)
+            if ttft is not None:
+                stats.ttft.append(ttft)
+                streaming_time = duration - ttft
+                if tokens > 1 and streaming_time > 0:
+                    stats.tokens_per_second.append((tokens - 1) / streaming_time)
+
+    def record_failure(self, model_id: str):
+        with self._lock:
+            self._stats(model_id).failed += 1
+
+    def record_cancellation(self, model_id: str, tokens_emitted: int, max_tokens: int) -> Dict[str, float]:
+        """Enregistre un flux abandonné et retourne l'estimation tokens/secondes économisés"""
+        with self._lock:
+            stats = self._stats(model_id)
+            expected = stats.avg_completion_tokens()
+            if expected is None:
+                expected = max_tokens
+            tokens_saved = int(max(min(expected, max_tokens) - tokens_emitted, 0))
+            tps = stats.avg_tokens_per_second()
+            seconds_saved = tokens_saved / tps if tps else 0.0
+            stats.cancelled += 1
+            stats.cancelled_tokens_emitted += tokens_emitted
+            stats.tokens_saved += tokens_saved
+            stats.seconds_saved += seconds_saved
+            return {"tokens_saved": tokens_saved, "seconds_saved": seconds_saved}
+
+    def record_context(self, model_id: str, report: Dict[str, Any]):
+        """Taille du prompt envoyé et tokens d'historique économisés par le fenêtrage"""
+        with self._lock:
+            stats = self._stats(model_id)
+            stats.prompt_tokens.append(report["prompt_tokens"])
+            if report["dropped"] or report["compressed"]:
+                stats.prompts_windowed += 1
+                stats.prompt_tokens_saved += report["tokens_saved"]
+
+    def latency_profile(self, model_id: str) -> Dict[str, Any]:
+        """TTFT médian (s), débit moyen (tokens/s) et nombre de mesures, pour le routage"""
+        with self._lock:
+            stats = self._models.get(model_id)
+            if stats is None:
+                return {"samples": 0, "ttft_p50": None, "tokens_per_second": None}
+            return {
+                "samples": len(stats.ttft),
+                "ttft_p50": _percentile(stats.ttft, 0.5),
+                "tokens_per_second": stats.avg_tokens_per_second(),
+            }
+
+    def model_snapshot(self, model_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._stats(model_id).snapshot()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {model_id: stats.snapshot() for model_id, stats in self._models.items()}
+
+
+# Instance partagée par tout le process
+generation_metrics = GenerationMetrics()
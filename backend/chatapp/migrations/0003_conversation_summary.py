@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0002_alter_conversation_id_alter_message_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, default='', help_text="Résumé glissant des échanges anciens, utilisé à la place de l'historique brut."),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_through_order',
+            field=models.PositiveIntegerField(default=0, help_text='Ordre du dernier message couvert par le résumé.'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_version',
+            field=models.PositiveIntegerField(default=0, help_text='Version du résumé, incrémentée à chaque mise à jour ou invalidation.'),
+        ),
+    ]
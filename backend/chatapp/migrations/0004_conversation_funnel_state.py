@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0003_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='funnel_state',
+            field=models.JSONField(blank=True, default=dict, help_text='État structuré du parcours de souscription (produit, pièces, devis).'),
+        ),
+    ]
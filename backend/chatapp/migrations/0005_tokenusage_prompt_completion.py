@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0004_conversation_funnel_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenusage',
+            name='model_id',
+            field=models.CharField(blank=True, help_text='Modèle ayant servi la réponse.', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='tokenusage',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tokenusage',
+            name='completion_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
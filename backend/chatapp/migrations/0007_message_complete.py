@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0006_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='complete',
+            field=models.BooleanField(default=True, help_text='Réponse assistant entièrement générée (rejouable pour un doublon) ; faux pendant la génération ou après un échec ou un abandon.'),
+        ),
+    ]
@@ -98,12 +98,28 @@ class Conversation(models.Model):
     use_constraints = models.BooleanField(default=False, help_text="Indique si les contraintes de rédaction sont appliquées.")
     model_id = models.CharField(max_length=100, blank=True, null=True, help_text="Identifiant du modèle LLM sélectionné.")
     total_tokens = models.PositiveIntegerField(default=0, help_text="Total des tokens utilisés pour la conversation.")
+    summary = models.TextField(blank=True, default='', help_text="Résumé glissant des échanges anciens, utilisé à la place de l'historique brut.")
+    summary_through_order = models.PositiveIntegerField(default=0, help_text="Ordre du dernier message couvert par le résumé.")
+    summary_version = models.PositiveIntegerField(default=0, help_text="Version du résumé, incrémentée à chaque mise à jour ou invalidation.")
+    funnel_state = models.JSONField(default=dict, blank=True, help_text="État structuré du parcours de souscription (produit, pièces, devis).")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title or f"Conversation {self.pk} - {self.user.name}"
 
+    def invalidate_summary(self, from_order):
+        """
+        Appelée quand les messages à partir de `from_order` sont modifiés ou supprimés.
+        Le résumé est effacé s'il les couvre ; la nouvelle version écarte dans tous les cas
+        une mise à jour calculée en arrière-plan sur l'ancien historique.
+        """
+        fields = {'summary_version': models.F('summary_version') + 1}
+        if self.summary_through_order >= from_order:
+            fields.update(summary='', summary_through_order=0)
+        Conversation.objects.filter(pk=self.pk).update(**fields)
+        self.refresh_from_db(fields=['summary', 'summary_through_order', 'summary_version'])
+
 
 class Message(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Ajouté
@@ -116,6 +132,7 @@ class Message(models.Model):
     author = models.CharField(max_length=20, choices=AUTHOR_CHOICES)
     content = models.TextField()
     order = models.PositiveIntegerField(default=0, help_text="Champ pour gérer l'ordre d'affichage des messages.")
+    complete = models.BooleanField(default=True, help_text="Réponse assistant entièrement générée (rejouable pour un doublon) ; faux pendant la génération ou après un échec ou un abandon.")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -180,6 +197,9 @@ class TokenUsage(models.Model):
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usages')
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='token_usages', blank=True, null=True)
+    model_id = models.CharField(max_length=100, blank=True, null=True, help_text="Modèle ayant servi la réponse.")
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
     tokens_used = models.PositiveIntegerField(default=0)
     recorded_at = models.DateTimeField(auto_now_add=True)
 
@@ -187,6 +207,42 @@ class TokenUsage(models.Model):
         return f"{self.user.name} - {self.tokens_used} tokens on {self.recorded_at.date()}"
 
 
+class DailyUsage(models.Model):
+    """
+    Cumul quotidien des tokens par utilisateur et par modèle, tenu à jour par lots
+    à partir de TokenUsage. Sert aux quotas et à la facturation sans parcourir les tours.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_usages')
+    day = models.DateField()
+    model_id = models.CharField(max_length=100, blank=True, default='')
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    tokens_used = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'model_id'], name='unique_daily_usage'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.day} - {self.model_id}: {self.tokens_used} tokens"
+
+
+class ConversationUsage(models.Model):
+    """Cumul des tokens d'une conversation (détail prompt / réponse), tenu à jour par lots."""
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='usage')
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    tokens_used = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Conversation {self.conversation_id}: {self.tokens_used} tokens"
+
+
 class SavedPrompt(models.Model):
     """
     Permet aux utilisateurs de sauvegarder leurs propres prompts personnalisés,
@@ -0,0 +1,198 @@
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """
+    Convertit un en-tête de reset en secondes restantes.
+    Formats rencontrés : '1s', '20ms', '6m0s', '2m59.56s' (OpenAI, Groq),
+    '12' (Retry-After) et horodatage RFC 3339 (Anthropic).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    matches = _DURATION_RE.findall(value)
+    if matches and "".join(n + u for n, u in matches) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in matches)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max((reset_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except ValueError:
+        return None
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class QuotaState:
+    """Dernier état de quota connu pour un provider/modèle, avec décompte local entre deux réponses"""
+    def __init__(self):
+        self.limit_requests: Optional[int] = None
+        self.remaining_requests: Optional[int] = None
+        self.requests_reset_at: float = 0.0
+        self.limit_tokens: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.tokens_reset_at: float = 0.0
+        self.last_dispatch: float = 0.0
+        self.updated_at: float = 0.0
+        self.paced = 0
+        self.rerouted = 0
+        self.rejected = 0
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "limit_requests": self.limit_requests,
+            "remaining_requests": self.remaining_requests,
+            "requests_reset_in": round(max(self.requests_reset_at - now, 0.0), 2),
+            "limit_tokens": self.limit_tokens,
+            "remaining_tokens": self.remaining_tokens,
+            "tokens_reset_in": round(max(self.tokens_reset_at - now, 0.0), 2),
+            "updated_seconds_ago": round(now - self.updated_at, 1) if self.updated_at else None,
+            "paced": self.paced,
+            "rerouted": self.rerouted,
+            "rejected": self.rejected,
+        }
+
+
+class RateLimitPacer:
+    """
+    Planificateur de cadence alimenté par les en-têtes x-ratelimit-* des providers.
+    Plutôt que d'attendre un 429, il calcule avant chaque appel le délai nécessaire :
+      - quota épuisé (requêtes ou tokens) : attendre le reset annoncé ;
+      - quota sous le seuil bas : étaler les requêtes restantes jusqu'au reset,
+        ce qui transforme un pic en ralentissement progressif.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[Tuple[str, str], QuotaState] = {}
+
+    @staticmethod
+    def _conf() -> Dict[str, Any]:
+        return getattr(settings, "LLM_PACING", {})
+
+    def _state(self, provider: str, model: str) -> QuotaState:
+        key = (provider, model)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states.setdefault(key, QuotaState())
+        return state
+
+    def observe(self, provider: str, model: str, headers, status_code: int = 200):
+        """Met à jour le quota à partir des en-têtes d'une réponse provider"""
+        if provider == "anthropic":
+            prefix = "anthropic-ratelimit-"
+            names = {
+                "limit_requests": prefix + "requests-limit",
+                "remaining_requests": prefix + "requests-remaining",
+                "reset_requests": prefix + "requests-reset",
+                "limit_tokens": prefix + "tokens-limit",
+                "remaining_tokens": prefix + "tokens-remaining",
+                "reset_tokens": prefix + "tokens-reset",
+            }
+        else:
+            names = {
+                "limit_requests": "x-ratelimit-limit-requests",
+                "remaining_requests": "x-ratelimit-remaining-requests",
+                "reset_requests": "x-ratelimit-reset-requests",
+                "limit_tokens": "x-ratelimit-limit-tokens",
+                "remaining_tokens": "x-ratelimit-remaining-tokens",
+                "reset_tokens": "x-ratelimit-reset-tokens",
+            }
+        remaining_requests = _int(headers.get(names["remaining_requests"]))
+        remaining_tokens = _int(headers.get(names["remaining_tokens"]))
+        retry_after = parse_reset(headers.get("retry-after"))
+        if remaining_requests is None and remaining_tokens is None and retry_after is None:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(provider, model)
+            state.updated_at = now
+            if remaining_requests is not None:
+                state.remaining_requests = remaining_requests
+                state.limit_requests = _int(headers.get(names["limit_requests"])) or state.limit_requests
+                reset = parse_reset(headers.get(names["reset_requests"]))
+                if reset is not None:
+                    state.requests_reset_at = now + reset
+            if remaining_tokens is not None:
+                state.remaining_tokens = remaining_tokens
+                state.limit_tokens = _int(headers.get(names["limit_tokens"])) or state.limit_tokens
+                reset = parse_reset(headers.get(names["reset_tokens"]))
+                if reset is not None:
+                    state.tokens_reset_at = now + reset
+            if status_code == 429 and retry_after is not None:
+                state.remaining_requests = 0
+                state.requests_reset_at = max(state.requests_reset_at, now + retry_after)
+
+    def delay_for(self, provider: str, model: str, estimated_tokens: int = 0) -> float:
+        """Délai (secondes) à respecter avant d'envoyer une requête de `estimated_tokens` tokens"""
+        conf = self._conf()
+        low_watermark = conf.get("low_watermark", 0.1)
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get((provider, model))
+            if state is None:
+                return 0.0
+            delay = 0.0
+
+            if state.remaining_requests is not None and now < state.requests_reset_at:
+                window = state.requests_reset_at - now
+                if state.remaining_requests <= 0:
+                    delay = max(delay, window)
+                elif state.limit_requests and state.remaining_requests <= state.limit_requests * low_watermark:
+                    # Étalement des dernières requêtes sur le temps restant avant reset
+                    interval = window / state.remaining_requests
+                    delay = max(delay, state.last_dispatch + interval - now)
+
+            if state.remaining_tokens is not None and now < state.tokens_reset_at:
+                if state.remaining_tokens < estimated_tokens:
+                    delay = max(delay, state.tokens_reset_at - now)
+
+            return max(delay, 0.0)
+
+    def commit(self, provider: str, model: str, estimated_tokens: int = 0, delay: float = 0.0):
+        """Enregistre l'envoi d'une requête : décompte local en attendant les prochains en-têtes"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(provider, model)
+            state.last_dispatch = now + delay
+            if delay > 0:
+                state.paced += 1
+            if state.remaining_requests is not None:
+                state.remaining_requests = max(state.remaining_requests - 1, 0)
+            if state.remaining_tokens is not None:
+                state.remaining_tokens = max(state.remaining_tokens - estimated_tokens, 0)
+
+    def record_reroute(self, provider: str, model: str):
+        with self._lock:
+            self._state(provider, model).rerouted += 1
+
+    def record_rejection(self, provider: str, model: str):
+        with self._lock:
+            self._state(provider, model).rejected += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {f"{provider}:{model}": state.snapshot(now) for (provider, model), state in self._states.items()}
+
+
+# Instance partagée par tout le process
+rate_limit_pacer = RateLimitPacer()
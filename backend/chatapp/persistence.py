@@ -0,0 +1,130 @@
+import atexit
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .errors import ERROR_CHUNK_PREFIX
+from .flights import Flight
+from .models import Message
+
+
+def persistence_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_MESSAGE_PERSISTENCE", {})
+
+
+class WriteBehindWriter:
+    """
+    Écritures différées du contenu des messages assistant, partagées par tout le process.
+    Les flux déposent le dernier état de leur message ; un thread unique les écrit par lots
+    (un seul UPDATE groupé par transaction), au plus toutes les `flush_interval` secondes,
+    ce qui épargne à SQLite une écriture par token et par flux. Le dernier dépôt d'un flux
+    terminé avec succès marque le message comme complet (`Message.complete`).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # Un flush (arrêt, fin de tour) attend le lot en cours d'écriture par le thread
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[str, bool]] = {}
+        self._thread = None
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def submit(self, message_id: str, content: str, urgent: bool = False, complete: bool = False):
+        """Dépose le contenu courant du message ; `urgent` (fin de flux) déclenche l'écriture"""
+        with self._lock:
+            self._pending[message_id] = (content, complete)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+        if urgent:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(persistence_settings().get("flush_interval", 0.5))
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            close_old_connections()
+            messages = [Message(id=message_id, content=content, complete=complete)
+                        for message_id, (content, complete) in batch.items()]
+            with transaction.atomic():
+                Message.objects.bulk_update(messages, ["content", "complete"])
+            self.batches += 1
+            self.rows += len(messages)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Écriture différée des messages impossible ({len(batch)} messages) : {e}")
+            # Nouvelle tentative au lot suivant, sans écraser un contenu plus récent
+            with self._lock:
+                for message_id, entry in batch.items():
+                    self._pending.setdefault(message_id, entry)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "rows": self.rows,
+                "errors": self.errors,
+            }
+
+
+class AssistantMessagePersister:
+    """
+    Collecteur de flux (Flight.add_sink) pour un message assistant : accumule la réponse
+    et la dépose dans le writer tous les `checkpoint_tokens` tokens (estimés) ou toutes
+    les `checkpoint_seconds` secondes, puis une dernière fois à la fin du flux — y compris
+    en cas d'erreur ou d'abandon, ce qui conserve la réponse partielle.
+    """
+    def __init__(self, message_id: str, writer: WriteBehindWriter):
+        conf = persistence_settings()
+        self.message_id = str(message_id)
+        self.writer = writer
+        self.checkpoint_chars = conf.get("checkpoint_tokens", 50) * 4
+        self.checkpoint_seconds = conf.get("checkpoint_seconds", 2.0)
+        self._parts: List[str] = []
+        self._unsaved_chars = 0
+        self._last_checkpoint = time.monotonic()
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    def append(self, chunk: str):
+        # Les erreurs transmises dans le flux ne font pas partie de la réponse
+        if chunk.startswith(ERROR_CHUNK_PREFIX):
+            return
+        self._parts.append(chunk)
+        self._unsaved_chars += len(chunk)
+        now = time.monotonic()
+        if (self._unsaved_chars >= self.checkpoint_chars
+                or now - self._last_checkpoint >= self.checkpoint_seconds):
+            self.writer.submit(self.message_id, self.content)
+            self._unsaved_chars = 0
+            self._last_checkpoint = now
+
+    def close(self, state: str):
+        if self._parts:
+            self.writer.submit(self.message_id, self.content, urgent=True, complete=state == Flight.COMPLETED)
+
+
+# Instance partagée par tout le process ; les contenus en attente sont écrits à l'arrêt
+message_writer = WriteBehindWriter()
+atexit.register(message_writer.flush)
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+from django.conf import settings
+
+from .pacing import rate_limit_pacer
+
+
+def credential_fingerprint(api_key: Optional[str]) -> str:
+    """Empreinte courte d'une clé API : la clé brute n'est jamais conservée dans les index ni les stats"""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class PoolStats:
+    """
+    Compteurs d'un pool HTTP partagé.
+    Les événements de connexion proviennent de l'extension 'trace' de httpcore :
+    une requête qui ne déclenche pas de connect_tcp a réutilisé une connexion keep-alive.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.handshake_seconds = 0.0
+        self._pending: Dict[int, float] = {}
+
+    def on_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def on_trace(self, event_name: str):
+        now = time.perf_counter()
+        key = threading.get_ident()
+        with self._lock:
+            if event_name == "connection.connect_tcp.started":
+                self._pending[key] = now
+            elif event_name == "connection.connect_tcp.complete":
+                self.new_connections += 1
+            elif event_name == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+                started = self._pending.pop(key, None)
+                if started is not None:
+                    self.handshake_seconds += now - started
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            avg_handshake = self.handshake_seconds / self.tls_handshakes if self.tls_handshakes else 0.0
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_requests": reused,
+                "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+                "tls_handshakes": self.tls_handshakes,
+                "avg_handshake_ms": round(avg_handshake * 1000, 2),
+                # Estimation : chaque requête réutilisée a économisé une poignée de main complète
+                "estimated_handshake_ms_saved": round(reused * avg_handshake * 1000, 2),
+            }
+
+
+class LoopClients:
+    """
+    Clients asynchrones rattachés à une boucle d'événements.
+    Une tâche de garde reste suspendue tant que la boucle tourne : à l'arrêt de la boucle
+    (asyncio.run annule les tâches restantes), elle ferme les pools httpx et se retire du registre.
+    """
+    def __init__(self, registry: "ProviderClientRegistry", loop: asyncio.AbstractEventLoop):
+        self.clients: Dict[Tuple, Any] = {}
+        self._registry = registry
+        self._loop = loop
+        self.keeper = loop.create_task(self._close_on_exit())
+
+    async def _close_on_exit(self):
+        try:
+            await self._loop.create_future()
+        finally:
+            self._registry._forget_loop(self._loop, self)
+            await self.aclose()
+
+    async def aclose(self):
+        # Les clients SDK délèguent au pool httpx : fermer les pools suffit
+        for client in list(self.clients.values()):
+            if isinstance(client, httpx.AsyncClient) and not client.is_closed:
+                try:
+                    await client.aclose()
+                except Exception as e:
+                    logging.warning(f"Fermeture d'un client HTTP asynchrone impossible : {e}")
+        self.clients.clear()
+
+    def abandon(self):
+        """Boucle fermée sans annuler ses tâches : pools inutilisables, la tâche de garde ne s'exécutera plus"""
+        self.clients.clear()
+        self.keeper._log_destroy_pending = False
+
+
+class ProviderClientRegistry:
+    """
+    Registre process-wide des clients providers (Groq, OpenAI, Anthropic).
+    Chaque client est créé une seule fois par (provider, modèle, identifiants) avec un pool
+    HTTP keep-alive, puis partagé entre threads et requêtes. Les en-têtes de quota de
+    chaque réponse alimentent le RateLimitPacer. Les clients asynchrones sont
+    en plus rattachés à leur boucle d'événements, un pool httpx ne pouvant pas changer de boucle :
+    ils sont indexés par une référence faible vers la boucle et fermés quand elle s'arrête.
+    """
+    def __init__(self):
+        # RLock : la création d'un client SDK crée elle-même son client HTTP sous le verrou
+        self._lock = threading.RLock()
+        self._clients: Dict[Tuple, Any] = {}
+        self._http_clients: Dict[Tuple, Any] = {}
+        self._loops: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LoopClients]" = weakref.WeakKeyDictionary()
+        self._stats: Dict[Tuple, PoolStats] = {}
+
+    @staticmethod
+    def _pool_settings() -> Dict[str, Any]:
+        return getattr(settings, "LLM_HTTP_POOL", {})
+
+    def _limits(self) -> httpx.Limits:
+        conf = self._pool_settings()
+        return httpx.Limits(
+            max_connections=conf.get("max_connections", 100),
+            max_keepalive_connections=conf.get("max_keepalive_connections", 20),
+            keepalive_expiry=conf.get("keepalive_expiry", 120.0),
+        )
+
+    def _timeout(self) -> httpx.Timeout:
+        conf = self._pool_settings()
+        return httpx.Timeout(conf.get("timeout", 60.0), connect=conf.get("connect_timeout", 10.0))
+
+    @staticmethod
+    def in_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    def _key(self, provider: str, model: str, api_key: Optional[str], is_async: bool) -> Tuple:
+        return (provider, model, credential_fingerprint(api_key), "async" if is_async else "sync")
+
+    def _loop_store(self) -> Dict[Tuple, Any]:
+        """Clients asynchrones de la boucle courante (à appeler depuis la boucle)"""
+        loop = asyncio.get_running_loop()
+        entry = self._loops.get(loop)
+        if entry is not None:
+            return entry.clients
+        with self._lock:
+            # Boucles fermées sans annuler leurs tâches : leurs pools ne sont plus utilisables
+            for closed in [other for other in self._loops.keys() if other.is_closed()]:
+                self._loops.pop(closed).abandon()
+            entry = self._loops.get(loop)
+            if entry is None:
+                entry = self._loops[loop] = LoopClients(self, loop)
+            return entry.clients
+
+    def _forget_loop(self, loop: asyncio.AbstractEventLoop, entry: LoopClients):
+        with self._lock:
+            if self._loops.get(loop) is entry:
+                del self._loops[loop]
+
+    def _get_or_create(self, store: Dict[Tuple, Any], key: Tuple, factory: Callable[[], Any]):
+        client = store.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = store.get(key)
+            if client is None:
+                client = factory()
+                store[key] = client
+            return client
+
+    def _stats_for(self, key: Tuple) -> PoolStats:
+        stats_key = key[:3]
+        with self._lock:
+            return self._stats.setdefault(stats_key, PoolStats())
+
+    def http_client(self, provider: str, model: str, api_key: Optional[str] = None) -> httpx.Client:
+        """Client httpx synchrone partagé avec instrumentation du pool"""
+        key = self._key(provider, model, api_key, is_async=False)
+        stats = self._stats_for(key)
+
+        def trace(event_name, info):
+            stats.on_trace(event_name)
+
+        def on_request(request):
+            stats.on_request()
+            request.extensions["trace"] = trace
+
+        def on_response(response):
+            rate_limit_pacer.observe(provider, model, response.headers, response.status_code)
+
+        return self._get_or_create(self._http_clients, key, lambda: httpx.Client(
+            limits=self._limits(),
+            timeout=self._timeout(),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        ))
+
+    def async_http_client(self, provider: str, model: str, api_key: Optional[str] = None) -> httpx.AsyncClient:
+        """Client httpx asynchrone partagé (un pool par boucle d'événements)"""
+        key = self._key(provider, model, api_key, is_async=True)
+        stats = self._stats_for(key)
+
+        async def trace(event_name, info):
+            stats.on_trace(event_name)
+
+        async def on_request(request):
+            stats.on_request()
+            request.extensions["trace"] = trace
+
+        async def on_response(response):
+            rate_limit_pacer.observe(provider, model, response.headers, response.status_code)
+
+        return self._get_or_create(self._loop_store(), key, lambda: httpx.AsyncClient(
+            limits=self._limits(),
+            timeout=self._timeout(),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        ))
+
+    def groq(self, model: str, api_key: Optional[str], base_url: Optional[str] = None):
+        from groq import Groq
+        key = ("groq-sdk", base_url) + self._key("groq", model, api_key, is_async=False)
+        return self._get_or_create(self._clients, key, lambda: Groq(
+            api_key=api_key, base_url=base_url, http_client=self.http_client("groq", model, api_key)
+        ))
+
+    def async_groq(self, model: str, api_key: Optional[str], base_url: Optional[str] = None):
+        from groq import AsyncGroq
+        key = ("groq-sdk", base_url) + self._key("groq", model, api_key, is_async=True)
+        return self._get_or_create(self._loop_store(), key, lambda: AsyncGroq(
+            api_key=api_key, base_url=base_url, http_client=self.async_http_client("groq", model, api_key)
+        ))
+
+    def anthropic(self, model: str, api_key: Optional[str], base_url: Optional[str] = None):
+        import anthropic
+        key = ("anthropic-sdk", base_url) + self._key("anthropic", model, api_key, is_async=False)
+        return self._get_or_create(self._clients, key, lambda: anthropic.Anthropic(
+            api_key=api_key, base_url=base_url, http_client=self.http_client("anthropic", model, api_key)
+        ))
+
+    def async_anthropic(self, model: str, api_key: Optional[str], base_url: Optional[str] = None):
+        import anthropic
+        key = ("anthropic-sdk", base_url) + self._key("anthropic", model, api_key, is_async=True)
+        return self._get_or_create(self._loop_store(), key, lambda: anthropic.AsyncAnthropic(
+            api_key=api_key, base_url=base_url, http_client=self.async_http_client("anthropic", model, api_key)
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques par pool, indexées par 'provider:modèle:empreinte'"""
+        with self._lock:
+            items = list(self._stats.items())
+            open_connections: Dict[Tuple, int] = {}
+            http_clients = list(self._http_clients.items())
+            for entry in list(self._loops.values()):
+                http_clients += [(key, client) for key, client in entry.clients.items()
+                                 if isinstance(client, httpx.AsyncClient)]
+            for key, client in http_clients:
+                try:
+                    count = len(client._transport._pool.connections)
+                except AttributeError:
+                    count = 0
+                open_connections[key[:3]] = open_connections.get(key[:3], 0) + count
+        return {
+            ":".join(key): {**stats.snapshot(), "open_connections": open_connections.get(key, 0)}
+            for key, stats in items
+        }
+
+
+# Instance unique partagée par tout le process
+provider_clients = ProviderClientRegistry()
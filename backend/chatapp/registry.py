@@ -0,0 +1,223 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LLMConfiguration
+from .providers import provider_clients
+
+# Variable d'environnement lue quand la configuration ne fournit pas de clé
+PROVIDER_API_KEY_ENV = {
+    "openai": "OPENAI_API_KEY",
+    "groq": "GROQ_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+}
+
+
+def model_registry_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_MODEL_REGISTRY", {})
+
+
+class ModelSpec:
+    """
+    Description d'un modèle exposé aux clients sous `model_id` :
+    provider, nom du modèle côté provider, endpoint et clé éventuels,
+    paramètres par défaut (`params`) et limites (`limits` : max_tokens, context_budget).
+    """
+    def __init__(self, model_id: str, provider: str, provider_model: Optional[str] = None,
+                 endpoint: Optional[str] = None, api_key: Optional[str] = None,
+                 params: Optional[Dict[str, Any]] = None, limits: Optional[Dict[str, Any]] = None,
+                 source: str = "settings"):
+        self.model_id = model_id
+        self.provider = provider
+        self.provider_model = provider_model or model_id
+        self.endpoint = endpoint or None
+        self._api_key = api_key or None
+        self.params = params or {}
+        self.limits = limits or {}
+        self.source = source
+
+    @property
+    def api_key(self) -> Optional[str]:
+        env = PROVIDER_API_KEY_ENV.get(self.provider)
+        return self._api_key or (os.environ.get(env) if env else None)
+
+    def max_tokens(self, requested: int) -> int:
+        """Nombre de tokens demandé, plafonné par la limite du modèle"""
+        cap = self.limits.get("max_tokens")
+        return min(requested, cap) if cap else requested
+
+    def describe(self) -> Dict[str, Any]:
+        """Vue exposable (sans la clé API)"""
+        return {
+            "model_id": self.model_id,
+            "provider": self.provider,
+            "provider_model": self.provider_model,
+            "endpoint": self.endpoint,
+            "params": self.params,
+            "limits": self.limits,
+            "source": self.source,
+        }
+
+
+class ModelRegistry:
+    """
+    Table modelId -> ModelSpec partagée par tout le process.
+    Elle est construite à partir de LLM_MODEL_REGISTRY['models'] (modèles livrés avec le code),
+    puis des lignes LLMConfiguration, qui les complètent ou les remplacent : on ajoute ou
+    règle un modèle depuis l'admin, sans déploiement. La table est gardée en mémoire et
+    rechargée après une modification (signaux post_save / post_delete du process) ou au plus
+    tard après `reload_interval` secondes pour les autres workers. La résolution d'un modèle
+    est une simple lecture de dictionnaire ; un identifiant inconnu est rattaché au provider
+    de son préfixe (`prefixes`) ou à `default_provider`. Sur la boucle d'événements (ASGI),
+    la table n'est jamais rechargée : `arefresh` le fait hors de la boucle en tête de tour.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._specs: Optional[Dict[str, ModelSpec]] = None
+        self._expires_at = 0.0
+        self.loads = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    # ---- Chargement ----
+
+    @staticmethod
+    def _spec_from_settings(model_id: str, conf: Dict[str, Any]) -> ModelSpec:
+        return ModelSpec(
+            model_id,
+            provider=conf.get("provider", model_registry_settings().get("default_provider", "openai")),
+            provider_model=conf.get("model"),
+            endpoint=conf.get("endpoint"),
+            params=conf.get("params"),
+            limits=conf.get("limits"),
+        )
+
+    @staticmethod
+    def _spec_from_row(row: LLMConfiguration) -> List[ModelSpec]:
+        """
+        Une ligne LLMConfiguration décrit un modèle : `name` est le modelId envoyé par le
+        frontend, `config_params` porte provider, model (nom côté provider), params, limits,
+        aliases et enabled.
+        """
+        params = row.config_params or {}
+        if not params.get("enabled", True):
+            return []
+        model_id = (params.get("model_id") or row.name).strip().lower()
+        spec = ModelSpec(
+            model_id,
+            provider=params.get("provider", model_registry_settings().get("default_provider", "openai")),
+            provider_model=params.get("model"),
+            endpoint=row.endpoint,
+            api_key=row.api_key,
+            params=params.get("params"),
+            limits=params.get("limits"),
+            source=f"db:{row.pk}",
+        )
+        aliases = [alias.strip().lower() for alias in params.get("aliases", [])]
+        return [spec] + [
+            ModelSpec(alias, spec.provider, spec.provider_model, spec.endpoint, row.api_key,
+                      spec.params, spec.limits, spec.source)
+            for alias in aliases
+        ]
+
+    @staticmethod
+    def _rows() -> List[LLMConfiguration]:
+        # Les lignes les plus récentes l'emportent en cas de doublon
+        return list(LLMConfiguration.objects.order_by("updated_at", "pk"))
+
+    def _load(self) -> Dict[str, ModelSpec]:
+        specs = self._settings_specs()
+        try:
+            rows = self._rows()
+        except DatabaseError as e:
+            # Table absente (migrations en cours) ou base indisponible : modèles livrés seulement
+            self.errors += 1
+            logging.warning(f"Registre des modèles : LLMConfiguration illisible ({e}), configuration par défaut")
+            return specs
+        for row in rows:
+            for spec in self._spec_from_row(row):
+                specs[spec.model_id] = spec
+        return specs
+
+    def _settings_specs(self) -> Dict[str, ModelSpec]:
+        return {
+            model_id.lower(): self._spec_from_settings(model_id.lower(), conf)
+            for model_id, conf in model_registry_settings().get("models", {}).items()
+        }
+
+    def _stale(self) -> bool:
+        return self._specs is None or time.monotonic() >= self._expires_at
+
+    def _reload(self) -> Dict[str, ModelSpec]:
+        with self._lock:
+            if self._stale():
+                self._specs = self._load()
+                self._expires_at = time.monotonic() + model_registry_settings().get("reload_interval", 60.0)
+                self.loads += 1
+            return self._specs
+
+    def _table(self) -> Dict[str, ModelSpec]:
+        specs = self._specs
+        if specs is not None and not self._stale():
+            return specs
+        if provider_clients.in_event_loop():
+            # Jamais de requête sur la boucle d'événements : table courante, même périmée
+            # (rechargée par `arefresh`), ou modèles livrés avant le premier chargement
+            return specs if specs is not None else self._settings_specs()
+        return self._reload()
+
+    async def arefresh(self):
+        """Recharge la table au besoin, hors de la boucle d'événements (chemin ASGI, en tête de tour)"""
+        if self._stale():
+            await sync_to_async(self._reload)()
+
+    def invalidate(self):
+        # La table courante reste lisible sur la boucle d'événements jusqu'au rechargement
+        with self._lock:
+            self._expires_at = 0.0
+            self.invalidations += 1
+
+    # ---- Résolution ----
+
+    def _default_spec(self, model_id: str) -> ModelSpec:
+        conf = model_registry_settings()
+        for prefix, provider in conf.get("prefixes", {}).items():
+            if model_id.startswith(prefix):
+                return ModelSpec(model_id, provider, source="prefix")
+        return ModelSpec(model_id, conf.get("default_provider", "openai"), source="default")
+
+    def resolve(self, model_id: str) -> ModelSpec:
+        key = (model_id or "").strip().lower()
+        specs = self._table()
+        spec = specs.get(key)
+        if spec is None:
+            # Non mémorisé : un modelId arbitraire envoyé par un client ne fait pas grossir la table
+            spec = self._default_spec(key)
+        return spec
+
+    def snapshot(self) -> Dict[str, Any]:
+        specs = self._table()
+        return {
+            "models": {model_id: spec.describe() for model_id, spec in specs.items()
+                       if spec.source not in ("prefix", "default")},
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+# Instance partagée par tout le process
+model_registry = ModelRegistry()
+
+
+@receiver([post_save, post_delete], sender=LLMConfiguration, dispatch_uid="model_registry_invalidate")
+def invalidate_model_registry(sender, **kwargs):
+    model_registry.invalidate()
@@ -10,4 +10,13 @@ class UserRenderer(renderers.JSONRenderer):
     else:
       response = json.dumps(data)
     
-    return response
\ No newline at end of file
+    return response
+
+class EventStreamRenderer(renderers.BaseRenderer):
+  """Accepte `Accept: text/event-stream` ; le flux SSE lui-même est une StreamingHttpResponse"""
+  media_type = 'text/event-stream'
+  format = 'sse'
+  charset = 'utf-8'
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    # Erreurs DRF (authentification, permissions) renvoyées en JSON dans un évènement SSE
+    return 'event: error\ndata: %s\n\n' % json.dumps(data)
@@ -0,0 +1,255 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .errors import ChatHandlerError
+
+
+def replay_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_STREAM_REPLAY", {})
+
+
+class JournalWriter:
+    """
+    Écritures des journaux de reprise, partagées par tout le process : les fragments publiés
+    (depuis la boucle d'événements en ASGI) sont mis en file et un thread unique les écrit,
+    puis vide chaque fichier touché pour que les autres workers puissent suivre le flux.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # Un flush (arrêt) attend le lot en cours d'écriture par le thread
+        self._flush_lock = threading.Lock()
+        self._pending: List[Tuple["ReplayJournal", Dict[str, Any]]] = []
+        self._thread = None
+        self.errors = 0
+
+    def submit(self, journal: "ReplayJournal", entry: Dict[str, Any]):
+        with self._lock:
+            self._pending.append((journal, entry))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="replay-journal-writer", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            self._write(batch)
+
+    def _write(self, items: List[Tuple["ReplayJournal", Dict[str, Any]]]):
+        touched = []
+        for journal, entry in items:
+            try:
+                journal.write(entry)
+                if journal not in touched:
+                    touched.append(journal)
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                logging.warning(f"Écriture du journal de reprise {journal.path} impossible : {e}")
+        for journal in touched:
+            try:
+                journal.sync()
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                logging.warning(f"Écriture du journal de reprise {journal.path} impossible : {e}")
+
+
+class ReplayJournal:
+    """
+    Journal disque d'une génération SSE : une ligne JSON par fragment, puis une ligne
+    de fin portant l'état final. Le fichier est créé avec son en-tête à l'ouverture ;
+    fragments et fin passent par `journal_writer`, publier ne touche donc pas le disque.
+    """
+    def __init__(self, path: str, owner: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._closing = False
+        self.write({"owner": owner})
+        self.sync()
+
+    def write(self, entry: Dict[str, Any]):
+        self._file.write(json.dumps(entry) + "\n")
+        if "end" in entry:
+            self._file.close()
+
+    def sync(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def append(self, chunk: str):
+        if not self._closing:
+            journal_writer.submit(self, {"c": chunk})
+
+    def close(self, state: str):
+        if not self._closing:
+            self._closing = True
+            journal_writer.submit(self, {"end": state})
+
+    def reader_seen_within(self, seconds: float) -> bool:
+        """Un client d'un autre worker suit-il ce flux ? (battement écrit par JournalReader)"""
+        try:
+            return time.time() - os.path.getmtime(self.path + ".hb") <= seconds
+        except OSError:
+            return False
+
+
+class JournalReader:
+    """
+    Relecture d'un journal écrit par un autre worker : fragments déjà écrits puis
+    suivi du fichier jusqu'à la ligne de fin. Un journal qui ne progresse plus pendant
+    `stale_after` secondes est considéré comme perdu (worker producteur arrêté).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Optional[str] = None
+        self._last_beat = 0.0
+
+    def _beat(self):
+        now = time.time()
+        if now - self._last_beat >= 1.0:
+            self._last_beat = now
+            with open(self.path + ".hb", "a"):
+                os.utime(self.path + ".hb")
+
+    def _read_new(self, handle, buffer: str):
+        """Retourne (fragments, fin, reste) pour les lignes complètes disponibles"""
+        buffer += handle.read()
+        chunks = []
+        *lines, rest = buffer.split("\n")
+        for line in lines:
+            entry = json.loads(line)
+            if "c" in entry:
+                chunks.append(entry["c"])
+            elif "end" in entry:
+                self.state = entry["end"]
+        return chunks, rest
+
+    def _lost(self) -> str:
+        self.state = "lost"
+        return ChatHandlerError(
+            message="La génération a été interrompue côté serveur. Veuillez relancer votre demande.",
+            error_type="stream_lost",
+            status_code=503,
+        ).to_json()
+
+    def _steps(self, start: int):
+        """Itération commune : produit des listes de fragments, ou None pour attendre"""
+        conf = replay_settings()
+        stale_after = conf.get("stale_after", 30.0)
+        index = 0
+        buffer = ""
+        last_progress = time.monotonic()
+        with open(self.path, encoding="utf-8") as handle:
+            handle.readline()  # en-tête (propriétaire)
+            while True:
+                chunks, buffer = self._read_new(handle, buffer)
+                pending = chunks[max(start - index, 0):]
+                index += len(chunks)
+                if chunks:
+                    last_progress = time.monotonic()
+                if pending:
+                    yield pending
+                if self.state is not None:
+                    return
+                if time.monotonic() - last_progress > stale_after:
+                    yield [self._lost()]
+                    return
+                self._beat()
+                yield None
+
+    def iter_chunks(self, start: int = 0):
+        poll_interval = replay_settings().get("poll_interval", 0.1)
+        for step in self._steps(start):
+            if step is None:
+                time.sleep(poll_interval)
+                continue
+            yield from step
+
+    async def aiter_chunks(self, start: int = 0):
+        """Lectures du fichier et battements faits hors de la boucle d'événements"""
+        poll_interval = replay_settings().get("poll_interval", 0.1)
+        steps = self._steps(start)
+        next_step = sync_to_async(next, thread_sensitive=False)
+        while True:
+            step = await next_step(steps, StopIteration)
+            if step is StopIteration:
+                return
+            if step is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            for chunk in step:
+                yield chunk
+
+
+class DiskReplayStore:
+    """
+    Tampons de reprise SSE sur disque local, partagés par les workers de la machine.
+    Les journaux plus anciens que `ttl` sont supprimés à la création des suivants.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    @staticmethod
+    def directory() -> str:
+        return str(replay_settings().get("directory", os.path.join(settings.BASE_DIR, "data", "streams")))
+
+    def _path(self, generation_id: str) -> str:
+        return os.path.join(self.directory(), f"{generation_id}.jsonl")
+
+    def _prune(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < 60:
+                return
+            self._last_prune = now
+        ttl = replay_settings().get("ttl", 600)
+        directory = self.directory()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def writer(self, generation_id: str, owner: str) -> ReplayJournal:
+        os.makedirs(self.directory(), exist_ok=True)
+        self._prune()
+        return ReplayJournal(self._path(generation_id), owner)
+
+    def reader(self, generation_id: str, owner: str) -> Optional[JournalReader]:
+        """Lecteur du journal s'il existe et appartient à `owner`, sinon None"""
+        if not generation_id.isalnum():
+            return None
+        path = self._path(generation_id)
+        try:
+            with open(path, encoding="utf-8") as handle:
+                header = json.loads(handle.readline())
+        except (OSError, ValueError):
+            return None
+        if header.get("owner") != owner:
+            return None
+        return JournalReader(path)
+
+
+# Instances partagées par tout le process ; les fragments en attente sont écrits à l'arrêt
+journal_writer = JournalWriter()
+atexit.register(journal_writer.flush)
+replay_store = DiskReplayStore()
@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+
+def _conf(name: str) -> Dict[str, Any]:
+    return getattr(settings, name, {})
+
+
+class RetryPolicy:
+    """
+    Backoff exponentiel avec « full jitter » : le délai est tiré uniformément dans
+    [0, min(max_delay, base_delay * 2**tentative)], ce qui désynchronise les clients
+    qui ont échoué en même temps au lieu de les faire revenir en rafale.
+    """
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 4.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        conf = _conf("LLM_RETRY")
+        return cls(
+            max_retries=conf.get("max_retries", 3),
+            base_delay=conf.get("base_delay", 0.5),
+            max_delay=conf.get("max_delay", 4.0),
+        )
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    Budget de retry partagé par tout le process, sur une fenêtre glissante.
+    Les retries sont limités à une fraction des requêtes récentes (plus un plancher
+    par seconde) : quand un provider tombe, le trafic de retry ne peut pas dépasser
+    `ratio` fois le trafic normal.
+    """
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+        self.rejected = 0
+
+    @classmethod
+    def from_settings(cls) -> "RetryBudget":
+        conf = _conf("LLM_RETRY")
+        return cls(
+            ratio=conf.get("budget_ratio", 0.2),
+            min_per_second=conf.get("budget_min_per_second", 1.0),
+            window=conf.get("budget_window", 10.0),
+        )
+
+    def _prune(self, now: float):
+        limit = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < limit:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_acquire(self) -> bool:
+        """Consomme un retry si le budget le permet"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            allowed = len(self._requests) * self.ratio + self.min_per_second * self.window
+            if len(self._retries) >= allowed:
+                self.rejected += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "window_seconds": self.window,
+                "requests": len(self._requests),
+                "retries": len(self._retries),
+                "rejected": self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur par provider/modèle.
+      - closed    : les appels passent ; `failure_threshold` échecs consécutifs l'ouvrent
+      - open      : échec immédiat pendant `reset_timeout` secondes
+      - half_open : un seul appel de test ; succès -> closed, échec -> open. Un appel de test
+                    sans issue après `reset_timeout` secondes (flux abandonné sans retour) est
+                    considéré perdu : un nouvel appel de test est admis.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.times_opened = 0
+
+    def _refresh(self, now: float):
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and (
+                not self._probe_in_flight or now - self._probe_started_at >= self.reset_timeout
+            ):
+                self._probe_in_flight = True
+                self._probe_started_at = now
+                return True
+            self.total_rejected += 1
+            return False
+
+    def retry_after(self) -> int:
+        """Secondes avant le prochain appel de test"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 1
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            return max(int(remaining) + 1, 1)
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.total_failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self):
+        """Issue neutre (annulation, erreur non imputable au provider) : libère l'appel de test"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+                "times_opened": self.times_opened,
+            }
+
+
+class CircuitBreakerRegistry:
+    """Disjoncteurs créés à la demande, indexés par 'provider:modèle'"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                conf = _conf("LLM_CIRCUIT_BREAKER")
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=conf.get("failure_threshold", 5),
+                    reset_timeout=conf.get("reset_timeout", 30.0),
+                )
+                self._breakers[name] = breaker
+            return breaker
+
+    def peek(self, name: str) -> Optional[CircuitBreaker]:
+        return self._breakers.get(name)
+
+    def reset(self, prefix: str = ""):
+        """Oublie les disjoncteurs dont le nom commence par `prefix` (recréés fermés au prochain appel)"""
+        with self._lock:
+            for name in [name for name in self._breakers if name.startswith(prefix)]:
+                del self._breakers[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            items = list(self._breakers.items())
+        return {name: breaker.snapshot() for name, breaker in items}
+
+
+# Instances partagées par tout le process
+circuit_breakers = CircuitBreakerRegistry()
+retry_budget = RetryBudget.from_settings()
@@ -0,0 +1,143 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from .caching import normalize_text
+from .metrics import generation_metrics
+from .semantic import strip_accents
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def routing_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_ROUTING", {})
+
+
+class ModelRouter:
+    """
+    Choix du modèle à chaque tour, partagé par tout le process.
+    Le message est d'abord classé (`court`, `standard`, `complexe`) par des règles simples :
+    longueur, formules de politesse ou d'acquiescement, mots-clés qui demandent du raisonnement.
+    Si `routes` associe des modèles candidats à cette catégorie, on retient celui dont la latence
+    attendue est la plus faible d'après les mesures en direct (TTFT médian + `expected_tokens`
+    au débit moyen) ; un candidat encore peu mesuré (< `min_samples`) est essayé en priorité
+    pour obtenir ses chiffres. Sinon le modèle demandé par le client est conservé.
+    Chaque décision est journalisée et gardée dans un historique borné, consultable par l'API.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._decisions = deque(maxlen=routing_settings().get("max_decisions", 200))
+        self.routed = 0
+        self.kept = 0
+        self.by_category: Dict[str, int] = {}
+
+    @staticmethod
+    def enabled() -> bool:
+        return routing_settings().get("enabled", False)
+
+    def classify(self, content: str) -> Dict[str, Any]:
+        """Catégorie du message et règle qui l'a déterminée"""
+        conf = routing_settings()
+        words = _WORD_RE.findall(strip_accents(normalize_text(content)))
+        canonical = f" {' '.join(words)} "
+        for keyword in conf.get("complex_keywords", []):
+            if f" {keyword} " in canonical:
+                return {"category": "complexe", "rule": f"mot-clé '{keyword}'", "words": len(words)}
+        if len(words) > conf.get("complex_min_words", 60):
+            return {"category": "complexe", "rule": f"plus de {conf.get('complex_min_words', 60)} mots",
+                    "words": len(words)}
+        if canonical.strip() in conf.get("trivial_phrases", []):
+            return {"category": "court", "rule": "formule courte", "words": len(words)}
+        if len(words) <= conf.get("short_max_words", 6) and len(content or "") <= conf.get("short_max_chars", 40):
+            return {"category": "court", "rule": f"{len(words)} mots", "words": len(words)}
+        return {"category": "standard", "rule": "par défaut", "words": len(words)}
+
+    @staticmethod
+    def expected_latency(model_id: str, expected_tokens: int) -> Dict[str, Any]:
+        """Latence attendue (s) d'une réponse de `expected_tokens` tokens, d'après les mesures du modèle"""
+        profile = generation_metrics.latency_profile(model_id)
+        latency = None
+        if profile["ttft_p50"] is not None:
+            tps = profile["tokens_per_second"]
+            latency = profile["ttft_p50"] + (expected_tokens / tps if tps else 0.0)
+        return {"samples": profile["samples"], "latency": latency}
+
+    def rank(self, candidates: List[str], expected_tokens: int) -> List[Dict[str, Any]]:
+        """Candidats du plus prometteur au moins prometteur (peu mesurés d'abord, puis plus rapides)"""
+        min_samples = routing_settings().get("min_samples", 5)
+        scored = [{"model": model, **self.expected_latency(model, expected_tokens)} for model in candidates]
+        return sorted(scored, key=lambda score: (
+            score["samples"] >= min_samples,
+            score["latency"] if score["latency"] is not None else 0.0,
+        ))
+
+    def decide(self, requested: str, content: str,
+               available: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        """
+        Modèle retenu pour le tour. `available` écarte les candidats indisponibles
+        (disjoncteur ouvert) ; faute de candidat, le modèle demandé est conservé.
+        """
+        conf = routing_settings()
+        decision = {"at": time.time(), "requested": requested, "chosen": requested,
+                    **self.classify(content), "scores": []}
+        candidates = conf.get("routes", {}).get(decision["category"], [])
+        if candidates:
+            expected_tokens = conf.get("expected_tokens", {}).get(decision["category"], 100)
+            decision["scores"] = self.rank(candidates, expected_tokens)
+            for score in decision["scores"]:
+                if available is None or available(score["model"]):
+                    decision["chosen"] = score["model"]
+                    break
+        self._record(decision)
+        return decision
+
+    def _record(self, decision: Dict[str, Any]):
+        with self._lock:
+            self._decisions.append(decision)
+            self.by_category[decision["category"]] = self.by_category.get(decision["category"], 0) + 1
+            if decision["chosen"] != decision["requested"]:
+                self.routed += 1
+            else:
+                self.kept += 1
+        if decision["chosen"] != decision["requested"]:
+            latencies = ", ".join(
+                f"{score['model']}={score['latency'] * 1000:.0f}ms" if score["latency"] is not None
+                else f"{score['model']}=non mesuré"
+                for score in decision["scores"]
+            )
+            logging.info(
+                f"Routage {decision['category']} ({decision['rule']}) : {decision['requested']} -> "
+                f"{decision['chosen']} [{latencies}]"
+            )
+
+    def snapshot(self, with_decisions: bool = False) -> Dict[str, Any]:
+        conf = routing_settings()
+        with self._lock:
+            data = {
+                "enabled": self.enabled(),
+                "rules": {
+                    "routes": conf.get("routes", {}),
+                    "expected_tokens": conf.get("expected_tokens", {}),
+                    "short_max_words": conf.get("short_max_words", 6),
+                    "short_max_chars": conf.get("short_max_chars", 40),
+                    "complex_min_words": conf.get("complex_min_words", 60),
+                    "complex_keywords": conf.get("complex_keywords", []),
+                    "trivial_phrases": conf.get("trivial_phrases", []),
+                    "min_samples": conf.get("min_samples", 5),
+                },
+                "routed": self.routed,
+                "kept": self.kept,
+                "by_category": dict(self.by_category),
+            }
+            if with_decisions:
+                data["decisions"] = list(self._decisions)
+        return data
+
+
+# Instance partagée par tout le process
+model_router = ModelRouter()
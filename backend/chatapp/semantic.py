@@ -0,0 +1,288 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import compact_history, normalize_text
+from .errors import ERROR_CHUNK_PREFIX
+from .providers import provider_clients
+
+
+KILL_SWITCH_KEY = "chat:semantic_cache:enabled"
+_WORD_RE = re.compile(r"\w+")
+
+# Mots vides du français ignorés par le plongement. Les mots qui portent le sens de la
+# question (négations, interrogatifs, prépositions, « ou »/« où ») restent indexés :
+# « pourquoi ne pas résilier » ne doit pas se confondre avec « pourquoi résilier »
+STOPWORDS = frozenset("""
+a au aux ce ces d de des du en est et il j je l la le les leur ma me mes mon
+nous on qu que qui sa se ses son t ta te tes ton tu un une vos votre vous y
+""".split())
+
+
+def semantic_cache_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_SEMANTIC_CACHE", {})
+
+
+def strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+class HashedNgramEmbedder:
+    """
+    Plongement local sans modèle : mots, paires de mots et n-grammes de caractères
+    hachés (crc32, signe aléatoire) dans un vecteur de `dim` dimensions, normalisé L2.
+    Les synonymes du domaine (`synonyms`) sont ramenés à une forme commune avant
+    hachage, ce qui rapproche des formulations sans vocabulaire commun.
+    """
+    def __init__(self, dim: int = 2048, char_ngrams=(3, 5), synonyms: Optional[Dict[str, str]] = None):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.synonyms = [(self._words(src), self._words(dst)) for src, dst in (synonyms or {}).items()]
+        # Les expressions les plus longues sont remplacées en premier
+        self.synonyms.sort(key=lambda pair: len(pair[0]), reverse=True)
+
+    @staticmethod
+    def _words(text: str) -> str:
+        return " ".join(_WORD_RE.findall(strip_accents(normalize_text(text))))
+
+    def canonical(self, text: str) -> str:
+        """Texte sans accents ni ponctuation, synonymes remplacés, mots vides retirés"""
+        text = f" {self._words(text)} "
+        for src, dst in self.synonyms:
+            text = text.replace(f" {src} ", f" {dst} ")
+        return " ".join(word for word in text.split() if word not in STOPWORDS)
+
+    def features(self, text: str) -> List[str]:
+        words = self.canonical(text).split()
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{first} {second}" for first, second in zip(words, words[1:])]
+        low, high = self.char_ngrams
+        for word in words:
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                features += [f"c:{padded[i:i + n]}" for i in range(max(len(padded) - n + 1, 0))]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(text):
+            digest = zlib.crc32(feature.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        # Fréquences amorties, puis normalisation : le produit scalaire est un cosinus
+        vector = np.sign(vector) * np.sqrt(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Cache sémantique des premières questions d'une conversation, local au process :
+    les questions déjà traitées sont indexées dans une matrice NumPy (une ligne par
+    question) et une nouvelle question réutilise la réponse la plus proche si le
+    cosinus dépasse `threshold`, pour le même modèle et le même template.
+    Activable / désactivable à chaud par un administrateur (cache Django partagé).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._embedder: Optional[HashedNgramEmbedder] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+        self._switch_checked_at = 0.0
+        self._switch_value: Optional[bool] = None
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+
+    # ---- Configuration ----
+
+    @property
+    def embedder(self) -> HashedNgramEmbedder:
+        if self._embedder is None:
+            conf = semantic_cache_settings()
+            self._embedder = HashedNgramEmbedder(
+                dim=conf.get("dim", 2048),
+                synonyms=conf.get("synonyms", {}),
+            )
+        return self._embedder
+
+    def _switch_stale(self) -> bool:
+        return time.monotonic() - self._switch_checked_at > 1.0
+
+    def _set_switch(self, value: Optional[bool]):
+        self._switch_value = value
+        self._switch_checked_at = time.monotonic()
+
+    def enabled(self) -> bool:
+        """
+        Interrupteur administrateur s'il a été actionné, sinon valeur des settings.
+        Sur la boucle d'événements, le cache Django (éventuellement en base) n'est pas relu :
+        la valeur rafraîchie par `arefresh_switch` est utilisée telle quelle.
+        """
+        if self._switch_stale() and not provider_clients.in_event_loop():
+            self._set_switch(cache.get(KILL_SWITCH_KEY))
+        if self._switch_value is not None:
+            return self._switch_value
+        return semantic_cache_settings().get("enabled", False)
+
+    async def arefresh_switch(self):
+        """Relit l'interrupteur sans bloquer la boucle d'événements (chemin ASGI)"""
+        if self._switch_stale():
+            self._set_switch(await cache.aget(KILL_SWITCH_KEY))
+
+    def set_enabled(self, enabled: bool):
+        cache.set(KILL_SWITCH_KEY, enabled, timeout=None)
+        self._set_switch(enabled)
+
+    @staticmethod
+    def scope(template: str, model_id: str) -> str:
+        return f"{model_id}:{hashlib.sha256(template.encode('utf-8')).hexdigest()[:16]}"
+
+    @staticmethod
+    def is_first_turn(payload: Dict[str, Any]) -> bool:
+        """Aucune réponse assistant dans l'historique et au plus la question courante"""
+        history = compact_history(payload.get("messages", []))
+        return (not any(author == "assistant" for author, _ in history)
+                and sum(1 for author, _ in history if author == "user") <= 1)
+
+    def _cacheable(self, payload: Dict[str, Any]) -> bool:
+        question = payload.get("content", "")
+        return (self.enabled() and self.is_first_turn(payload)
+                and 0 < len(question) <= semantic_cache_settings().get("max_question_chars", 200))
+
+    # ---- Index ----
+
+    def _search(self, vector: np.ndarray, scope: str, limit: int = 1):
+        # Appelée sous le verrou
+        if not self._entries:
+            return []
+        scores = self._matrix[:len(self._entries)] @ vector
+        order = np.argsort(-scores)
+        now = time.time()
+        ttl = semantic_cache_settings().get("ttl", 86400)
+        results = []
+        for index in order:
+            entry = self._entries[index]
+            if entry["scope"] != scope or now - entry["created_at"] > ttl:
+                continue
+            results.append((int(index), float(scores[index])))
+            if len(results) >= limit:
+                break
+        return results
+
+    def lookup(self, payload: Dict[str, Any], template: str, model_id: str) -> Optional[str]:
+        """Réponse d'une question suffisamment proche, ou None"""
+        if not self._cacheable(payload):
+            return None
+        vector = self.embedder.embed(payload.get("content", ""))
+        threshold = semantic_cache_settings().get("threshold", 0.92)
+        with self._lock:
+            self.lookups += 1
+            matches = self._search(vector, self.scope(template, model_id))
+            if not matches or matches[0][1] <= threshold:
+                return None
+            entry = self._entries[matches[0][0]]
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            self.hits += 1
+            self.tokens_saved += len(entry["answer"]) // 4
+            return entry["answer"]
+
+    def store(self, payload: Dict[str, Any], template: str, model_id: str, chunks: List[str]):
+        if not chunks or any(chunk.startswith(ERROR_CHUNK_PREFIX) for chunk in chunks):
+            return
+        if not self._cacheable(payload):
+            return
+        conf = semantic_cache_settings()
+        question = payload.get("content", "")
+        vector = self.embedder.embed(question)
+        scope = self.scope(template, model_id)
+        entry = {
+            "question": question,
+            "answer": "".join(chunks),
+            "scope": scope,
+            "created_at": time.time(),
+            "last_used": time.time(),
+            "hits": 0,
+        }
+        with self._lock:
+            # Question déjà couverte par une entrée quasi identique : on la remplace
+            matches = self._search(vector, scope)
+            if matches and matches[0][1] >= conf.get("dedupe_threshold", 0.97):
+                row = matches[0][0]
+            elif len(self._entries) < conf.get("max_entries", 1000):
+                row = len(self._entries)
+                self._grow(row + 1)
+                self._entries.append(entry)
+            else:
+                # Éviction de l'entrée la moins récemment utilisée
+                row = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self.evictions += 1
+            self._entries[row] = entry
+            self._matrix[row] = vector
+            self.stores += 1
+
+    def _grow(self, rows: int):
+        # Appelée sous le verrou : capacité doublée au besoin
+        if self._matrix is None:
+            self._matrix = np.zeros((64, self.embedder.dim), dtype=np.float32)
+        if rows > self._matrix.shape[0]:
+            grown = np.zeros((self._matrix.shape[0] * 2, self.embedder.dim), dtype=np.float32)
+            grown[:self._matrix.shape[0]] = self._matrix
+            self._matrix = grown
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+    # ---- Inspection ----
+
+    def nearest(self, question: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Entrées les plus proches d'une question, tous modèles confondus (diagnostic)"""
+        vector = self.embedder.embed(question)
+        with self._lock:
+            if not self._entries:
+                return []
+            scores = self._matrix[:len(self._entries)] @ vector
+            order = np.argsort(-scores)[:limit]
+            return [{"question": self._entries[i]["question"], "scope": self._entries[i]["scope"],
+                     "score": round(float(scores[i]), 4)} for i in order]
+
+    def snapshot(self, with_entries: bool = False) -> Dict[str, Any]:
+        conf = semantic_cache_settings()
+        with self._lock:
+            data = {
+                "enabled": self.enabled(),
+                "threshold": conf.get("threshold", 0.92),
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "tokens_saved": self.tokens_saved,
+            }
+            if with_entries:
+                now = time.time()
+                data["items"] = [{
+                    "question": entry["question"],
+                    "answer_preview": entry["answer"][:200],
+                    "scope": entry["scope"],
+                    "hits": entry["hits"],
+                    "age_seconds": int(now - entry["created_at"]),
+                } for entry in sorted(self._entries, key=lambda e: e["hits"], reverse=True)]
+            return data
+
+
+# Instance partagée par tout le process
+semantic_cache = SemanticCache()
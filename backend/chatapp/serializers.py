@@ -47,7 +47,7 @@ class LLMConfigurationSerializer(serializers.ModelSerializer):
 class TokenUsageSerializer(serializers.ModelSerializer):
     class Meta:
         model = TokenUsage
-        fields = ('id', 'user', 'conversation', 'tokens_used', 'recorded_at')
+        fields = ('id', 'user', 'conversation', 'model_id', 'prompt_tokens', 'completion_tokens', 'tokens_used', 'recorded_at')
 
 class SavedPromptSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,216 @@
+import json
+import time
+from typing import Callable, Iterable, List, Optional
+
+from django.conf import settings
+
+from .errors import ERROR_CHUNK_PREFIX
+
+
+class TokenCoalescer:
+    """
+    Regroupe les tokens du provider en fragments d'écriture : le tampon part dès qu'il
+    atteint `max_bytes` octets ou que son plus ancien token attend depuis `max_delay`
+    secondes, au premier des deux. Le premier token de la réponse part seul
+    (`flush_first`) pour ne pas retarder le premier octet.
+    Avec `max_bytes` <= 1 ou `max_delay` <= 0, chaque token part immédiatement.
+    Un lecteur qui consomme directement le flux du provider (sans attente bornée) vérifie
+    l'échéance à l'arrivée de chaque token ; `timeout` sert aux lecteurs qui attendent sur une file.
+    """
+    def __init__(self, max_bytes: int = 256, max_delay: float = 0.05, flush_first: bool = True):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.flush_first = flush_first
+        self._buffer: List[str] = []
+        self._size = 0
+        self._oldest = 0.0
+        self._first_sent = False
+
+    @classmethod
+    def from_settings(cls) -> "TokenCoalescer":
+        conf = getattr(settings, "LLM_STREAM_COALESCING", {})
+        if not conf.get("enabled", True):
+            return cls(max_bytes=0, max_delay=0)
+        return cls(
+            max_bytes=conf.get("max_bytes", 256),
+            max_delay=conf.get("max_delay_ms", 50) / 1000,
+            flush_first=conf.get("flush_first", True),
+        )
+
+    @property
+    def passthrough(self) -> bool:
+        return self.max_bytes <= 1 or self.max_delay <= 0
+
+    def add(self, token: str) -> Optional[str]:
+        """Ajoute un token ; retourne le fragment à écrire si un seuil est atteint"""
+        if self.passthrough or (self.flush_first and not self._first_sent):
+            self._first_sent = True
+            return token
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(token)
+        self._size += len(token.encode("utf-8"))
+        if self._size >= self.max_bytes or time.monotonic() - self._oldest >= self.max_delay:
+            return self.flush()
+        return None
+
+    def timeout(self) -> Optional[float]:
+        """Attente maximale avant l'échéance du tampon (None : tampon vide, attente libre)"""
+        if not self._buffer:
+            return None
+        return max(self._oldest + self.max_delay - time.monotonic(), 0.0)
+
+    def flush(self) -> str:
+        """Vide le tampon ('' s'il est vide)"""
+        chunk = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        return chunk
+
+
+class _ClosingStream:
+    """Base commune : callbacks de fermeture exécutés exactement une fois"""
+    def __init__(self, stream, on_close: Iterable[Callable[[], None]] = ()):
+        self.stream = stream
+        self._on_close = list(on_close)
+        self._closed = False
+
+    def _run_callbacks(self):
+        for callback in self._on_close:
+            callback()
+
+
+class ManagedStream(_ClosingStream):
+    """
+    Enveloppe un flux de génération synchrone et exécute ses callbacks de fermeture
+    exactement une fois : fin normale, erreur, déconnexion du client ou réponse jamais
+    itérée (StreamingHttpResponse appelle `close` dans tous les cas).
+    """
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self.stream, "close", None)
+            if close:
+                close()
+        finally:
+            self._run_callbacks()
+
+
+class AsyncManagedStream(_ClosingStream):
+    """Variante asynchrone (ASGI) : le flux est un générateur asynchrone"""
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.stream.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.stream.aclose()
+        finally:
+            self._run_callbacks()
+
+    def close(self):
+        # Appelée de façon synchrone par la réponse : le générateur est déjà terminé
+        # (fin, erreur et annulation passent par aclose) ou n'a jamais démarré.
+        if self._closed:
+            return
+        self._closed = True
+        self._run_callbacks()
+
+
+def managed_stream(stream, on_close: Iterable[Callable[[], None]] = ()):
+    """Choisit l'enveloppe adaptée au flux (itérateur ou itérateur asynchrone)"""
+    if hasattr(stream, "__aiter__"):
+        return AsyncManagedStream(stream, on_close)
+    return ManagedStream(stream, on_close)
+
+
+# ---- Server-Sent Events ----
+
+def sse_frame(data: str, event: Optional[str] = None, event_id: Optional[str] = None,
+              retry: Optional[int] = None) -> str:
+    """Sérialise un évènement SSE ; les données multi-lignes occupent plusieurs lignes `data:`"""
+    lines = []
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_event_id(value: str):
+    """'<generation_id>:<index>' -> (generation_id, index du prochain fragment), ou None"""
+    generation_id, _, index = (value or "").strip().rpartition(":")
+    if not generation_id or not index.isdigit():
+        return None
+    return generation_id, int(index) + 1
+
+
+class SSEFormatter:
+    """
+    Encadre les fragments d'une génération en évènements SSE identifiés
+    `<generation_id>:<index>` : un client qui se reconnecte avec Last-Event-ID
+    reprend au fragment suivant. Le flux se termine par un évènement `done`.
+    """
+    def __init__(self, generation_id: str, start: int = 0,
+                 final_state: Optional[Callable[[], str]] = None, retry_ms: int = 2000):
+        self.generation_id = generation_id
+        self.start = start
+        self.final_state = final_state
+        self.retry_ms = retry_ms
+
+    def head(self) -> str:
+        return sse_frame(json.dumps({"generationId": self.generation_id}), event="start", retry=self.retry_ms)
+
+    def frame(self, index: int, chunk: str) -> str:
+        event = "error" if chunk.startswith(ERROR_CHUNK_PREFIX) else "token"
+        return sse_frame(chunk, event=event, event_id=f"{self.generation_id}:{index}")
+
+    def done(self) -> str:
+        state = self.final_state() if self.final_state else "completed"
+        return sse_frame(json.dumps({"state": state}), event="done")
+
+    def iter(self, chunks):
+        yield self.head()
+        try:
+            for index, chunk in enumerate(chunks, self.start):
+                yield self.frame(index, chunk)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+        yield self.done()
+
+    async def aiter(self, chunks):
+        yield self.head()
+        index = self.start
+        try:
+            async for chunk in chunks:
+                yield self.frame(index, chunk)
+                index += 1
+        finally:
+            await chunks.aclose()
+        yield self.done()
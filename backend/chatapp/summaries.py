@@ -0,0 +1,155 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.db import close_old_connections
+from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string
+
+from .chat_handler import ChatHandler
+from .context import context_settings
+from .models import Conversation, Message
+
+
+SUMMARY_PROMPT = """Tu tiens à jour le résumé d'une conversation entre un client et un conseiller en assurance AFG.
+Intègre les nouveaux échanges au résumé existant, en français, en quelques phrases factuelles.
+Conserve tout ce qui sert à la souscription : produit visé, informations fournies par le client
+(véhicule, usage, zone, documents, budget), propositions faites, décisions et questions en suspens.
+N'invente rien et ne reformule pas en dialogue.
+
+Résumé existant :
+{summary}
+
+Nouveaux échanges :
+{messages}
+
+Résumé mis à jour :"""
+
+
+def summary_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_CONVERSATION_SUMMARY", {})
+
+
+class ConversationSummarizer:
+    """
+    Résumé glissant des conversations, tenu à jour en arrière-plan par un modèle peu coûteux.
+    Les messages sortis de la fenêtre récente (LLM_CONTEXT['recent_messages']) sont intégrés
+    au résumé par lots d'au moins `every_turns` échanges ; le prompt utilise ensuite le résumé
+    et les messages plus récents que `summary_through_order`.
+    L'écriture est conditionnée à la version lue : une édition (editMessageId) survenue pendant
+    le calcul incrémente la version et le résultat, devenu faux, est abandonné.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self.scheduled = 0
+        self.updates = 0
+        self.stale = 0
+        self.errors = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return summary_settings().get("enabled", True)
+
+    @staticmethod
+    def keep_recent() -> int:
+        # Au moins le dernier échange reste hors résumé : sa réponse est encore en cours d'écriture
+        return max(context_settings().get("recent_messages", 6), 2)
+
+    def candidates(self, messages: List[Dict[str, Any]], through_order: int) -> List[Dict[str, Any]]:
+        """Messages non encore résumés et sortis de la fenêtre récente"""
+        turns = [msg for msg in messages
+                 if msg.get("author") in ("user", "assistant") and msg.get("order", 0) > through_order]
+        older = turns[:-self.keep_recent()]
+        return [msg for msg in older if (msg.get("content") or "").strip()]
+
+    def is_due(self, messages: List[Dict[str, Any]], through_order: int) -> bool:
+        if not self.enabled():
+            return False
+        return len(self.candidates(messages, through_order)) >= 2 * summary_settings().get("every_turns", 4)
+
+    def schedule(self, conversation_id):
+        """Planifie la mise à jour du résumé (une seule en attente par conversation)"""
+        conversation_id = str(conversation_id)
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=summary_settings().get("workers", 1),
+                    thread_name_prefix="conversation-summary",
+                )
+            self.scheduled += 1
+        self._executor.submit(self._run, conversation_id)
+
+    def _run(self, conversation_id: str):
+        try:
+            close_old_connections()
+            self.update(conversation_id)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Mise à jour du résumé de la conversation {conversation_id} impossible : {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+            close_old_connections()
+
+    def update(self, conversation_id: str) -> bool:
+        conversation = Conversation.objects.filter(pk=conversation_id).values(
+            "summary", "summary_through_order", "summary_version"
+        ).first()
+        if conversation is None:
+            return False
+        messages = list(Message.objects.filter(conversation_id=conversation_id).values("author", "content", "order"))
+        batch = self.candidates(messages, conversation["summary_through_order"])
+        if len(batch) < 2 * summary_settings().get("every_turns", 4):
+            return False
+
+        summary = self.summarize(conversation["summary"], batch)
+        if not summary:
+            return False
+        version = conversation["summary_version"]
+        updated = Conversation.objects.filter(pk=conversation_id, summary_version=version).update(
+            summary=summary,
+            summary_through_order=batch[-1]["order"],
+            summary_version=version + 1,
+        )
+        if not updated:
+            self.stale += 1
+            logging.info(f"Résumé de la conversation {conversation_id} abandonné : historique modifié entre-temps")
+            return False
+        self.updates += 1
+        return True
+
+    @staticmethod
+    def summarize(previous: str, messages: List[Dict[str, Any]]) -> str:
+        conf = summary_settings()
+        model_id = conf.get("model", "gpt-4o-mini")
+        history = get_buffer_string([
+            HumanMessage(content=msg["content"]) if msg["author"] == "user" else AIMessage(content=msg["content"])
+            for msg in messages
+        ])
+        prompt = SUMMARY_PROMPT.format(summary=previous or "(aucun)", messages=history)
+        handler = ChatHandler()
+        llm = handler.get_llm(model_id, conf.get("temperature", 0.2), conf.get("max_tokens", 400))
+        result = llm.invoke(handler.llm_input(model_id, prompt))
+        text = getattr(result, "content", result)
+        return str(text).strip()[:conf.get("max_chars", 3000)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled(),
+                "pending": len(self._pending),
+                "scheduled": self.scheduled,
+                "updates": self.updates,
+                "stale": self.stale,
+                "errors": self.errors,
+            }
+
+
+# Instance partagée par tout le process
+conversation_summarizer = ConversationSummarizer()
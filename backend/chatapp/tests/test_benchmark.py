@@ -0,0 +1,91 @@
+import json
+
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from chatapp.benchmark import BENCHMARK_SCENARIOS, DRIVERS, compare_results, run_scenario, server_errors
+from chatapp.management.commands.benchmark_chat import Command
+
+# Erreurs attendues par cas : celles que le profil du fournisseur simulé injecte
+EXPECTED_ERRORS = {
+    "flaky-429": {"rate_limit", "circuit_open"},
+    "midstream": {"network"},
+}
+
+# Cas réduits pour la suite de tests : peu d'utilisateurs, délais du fournisseur raccourcis
+TEST_USERS = 3
+TEST_TURNS = 2
+TEST_TIMINGS = {"ttft": 0.01, "token_delay": 0.001, "jitter": 0.0}
+
+
+class BenchmarkScenarioTests(TransactionTestCase):
+    """Chaque cas nommé du banc, sur les piles WSGI et ASGI, à petite échelle"""
+    def run_case(self, name: str):
+        scenario = BENCHMARK_SCENARIOS[name]
+        params = {
+            "model": scenario["model"],
+            "users": min(scenario["users"], TEST_USERS),
+            "turns": min(scenario["turns"], TEST_TURNS),
+            "profile": {**scenario.get("profile", {}), **TEST_TIMINGS},
+        }
+        options = {"keep_caches": False, "keep_rate_limits": False}
+        users = Command.create_users(name, params["users"])
+        results = {}
+        with override_settings(**Command.benchmark_settings(params, options)):
+            for stack in DRIVERS:
+                stats = run_scenario(stack, users, params["turns"], params["model"])
+                with self.subTest(stack=stack):
+                    self.assertEqual(stats["turns"], params["users"] * params["turns"])
+                    self.assertNotIn("http_500", stats["error_types"])
+                    self.assertLessEqual(set(stats["error_types"]), EXPECTED_ERRORS.get(name, set()))
+                    self.assertGreater(stats["db_queries"], 0)
+                    self.assertGreaterEqual(stats["peak_threads"], stats["start_threads"])
+                    json.dumps(stats)
+                results[stack] = stats
+        return results
+
+    def test_steady(self):
+        for stats in self.run_case("steady").values():
+            self.assertEqual(stats["errors"], 0)
+            self.assertIsNotNone(stats["ttft_p50_ms"])
+            self.assertGreater(stats["tokens_per_second"], 0)
+
+    def test_burst(self):
+        for stats in self.run_case("burst").values():
+            self.assertEqual(stats["errors"], 0)
+
+    def test_long_answers(self):
+        for stats in self.run_case("long-answers").values():
+            self.assertEqual(stats["errors"], 0)
+            self.assertGreater(stats["tokens"], stats["turns"] * 400)
+
+    def test_slow_ttft(self):
+        for stats in self.run_case("slow-ttft").values():
+            self.assertEqual(stats["errors"], 0)
+
+    def test_flaky_429(self):
+        self.run_case("flaky-429")
+
+    def test_midstream(self):
+        for stats in self.run_case("midstream").values():
+            # Coupure après les premiers tokens : tout tour échoue, avec une réponse partielle
+            self.assertEqual(stats["error_types"], {"network": stats["turns"]})
+            self.assertGreater(stats["tokens"], 0)
+
+
+class BenchmarkReportTests(SimpleTestCase):
+    def report(self, **error_types):
+        stats = {"error_types": error_types, "ttft_p95_ms": 100.0, "tokens_per_second": 50.0}
+        return {"benchmarks": [{"name": "steady[wsgi]", "params": {"users": 2}, "stats": stats}]}
+
+    def test_server_errors_are_reported_per_case(self):
+        self.assertEqual(server_errors(self.report(network=2)), {})
+        self.assertEqual(server_errors(self.report(http_500=3, network=1)), {"steady[wsgi]": 3})
+
+    def test_compare_flags_degradations_only_for_same_params(self):
+        baseline = self.report()
+        current = self.report()
+        current["benchmarks"][0]["stats"] = {**current["benchmarks"][0]["stats"], "ttft_p95_ms": 150.0}
+        changes = {row["metric"]: row["change"] for row in compare_results(current, baseline)}
+        self.assertEqual(changes["ttft_p95_ms"], 0.5)
+        current["benchmarks"][0]["params"] = {"users": 4}
+        self.assertEqual(compare_results(current, baseline), [])
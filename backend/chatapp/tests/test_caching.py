@@ -0,0 +1,136 @@
+import asyncio
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.test import SimpleTestCase, override_settings
+
+from chatapp.caching import ResponseCache, normalize_text
+from chatapp.chat_handler import ChatHandler
+from chatapp.semantic import KILL_SWITCH_KEY, SemanticCache
+
+TEMPLATE = "Tu es l'assistant de l'agence. {history} {question}"
+
+
+class ResponseCacheKeyTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache()
+
+    def key(self, content="Quel est le prix d'une assurance moto ?", model_id="fake", template=TEMPLATE, **payload):
+        return self.cache.key_for({"content": content, **payload}, template, model_id)
+
+    def test_normalized_question_gives_the_same_key(self):
+        self.assertEqual(normalize_text("  Quel  est le PRIX ?! "), "quel est le prix")
+        self.assertEqual(self.key(), self.key("quel est le  prix d'une assurance MOTO"))
+
+    def test_everything_that_changes_the_answer_changes_the_key(self):
+        base = self.key()
+        variants = [
+            self.key("Quel est le prix d'une assurance auto ?"),
+            self.key(model_id="fake-slow"),
+            self.key(template=TEMPLATE + " Réponds en anglais."),
+            self.key(temperature=0.2),
+            self.key(maxTokens=100),
+            self.key(messages=[{"author": "user", "content": "Bonjour"}, {"author": "assistant", "content": "Bonjour !"}]),
+        ]
+        self.assertNotIn(base, variants)
+        self.assertEqual(len(set(variants)), len(variants))
+
+    def test_pending_empty_messages_are_ignored(self):
+        self.assertEqual(self.key(), self.key(messages=[{"author": "assistant", "content": ""}]))
+
+    def test_long_history_is_not_cached(self):
+        messages = [{"author": "user", "content": f"question {index}"} for index in range(5)]
+        self.assertIsNone(self.key(messages=messages))
+        self.assertIsNotNone(self.key(messages=messages[:4]))
+
+    @override_settings(LLM_RESPONSE_CACHE={**settings.LLM_RESPONSE_CACHE, "enabled": False})
+    def test_disabled(self):
+        self.assertIsNone(self.key())
+
+
+class RememberAnswerTests(SimpleTestCase):
+    """Une réponse n'est mise en cache que sous le modèle qui l'a produite"""
+    def setUp(self):
+        self.caches = []
+        for target in ("response_cache", "semantic_cache"):
+            patcher = mock.patch(f"chatapp.chat_handler.{target}")
+            self.caches.append(patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def remember(self, served_model):
+        payload = {"modelId": "fake", "content": "Bonjour", "servedModelId": served_model}
+        ChatHandler().remember_answer(payload, "key", ["Bonjour !"])
+
+    def test_answer_served_by_the_requested_model_is_stored(self):
+        self.remember("fake")
+        self.assertTrue(all(stub.store.called for stub in self.caches))
+
+    def test_fallback_or_hedge_answer_is_not_stored(self):
+        self.remember("fake-fast")
+        self.assertFalse(any(stub.store.called for stub in self.caches))
+
+
+@override_settings(LLM_SEMANTIC_CACHE={**settings.LLM_SEMANTIC_CACHE, "enabled": True})
+class SemanticCacheTests(SimpleTestCase):
+    question = "Combien coûte une assurance moto ?"
+
+    def setUp(self):
+        cache.delete(KILL_SWITCH_KEY)
+        self.cache = SemanticCache()
+        self.cache.store({"content": self.question}, TEMPLATE, "fake", ["Environ 25 000 FCFA par an."])
+
+    def lookup(self, content, model_id="fake", **payload):
+        return self.cache.lookup({"content": content, **payload}, TEMPLATE, model_id)
+
+    def score(self, content):
+        embedder = self.cache.embedder
+        return float(embedder.embed(self.question) @ embedder.embed(content))
+
+    def test_paraphrase_hits(self):
+        self.assertEqual(self.lookup("combien coûte une assurance deux roues"), "Environ 25 000 FCFA par an.")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_threshold_is_strict(self):
+        paraphrase = "Combien coûte une assurance pour ma moto ?"
+        score = self.score(paraphrase)
+        with override_settings(LLM_SEMANTIC_CACHE={**settings.LLM_SEMANTIC_CACHE, "threshold": score}):
+            self.assertIsNone(self.lookup(paraphrase))
+        with override_settings(LLM_SEMANTIC_CACHE={**settings.LLM_SEMANTIC_CACHE, "threshold": score - 0.01}):
+            self.assertIsNotNone(self.lookup(paraphrase))
+
+    def test_negation_and_other_product_miss(self):
+        self.assertLessEqual(self.score("Combien ne coûte pas une assurance moto ?"), settings.LLM_SEMANTIC_CACHE["threshold"])
+        self.assertIsNone(self.lookup("Combien ne coûte pas une assurance moto ?"))
+        self.assertIsNone(self.lookup("Combien coûte une assurance habitation ?"))
+
+    def test_scoped_by_model_and_first_turn_only(self):
+        self.assertIsNone(self.lookup(self.question, model_id="fake-slow"))
+        history = [{"author": "user", "content": "Bonjour"}, {"author": "assistant", "content": "Bonjour !"}]
+        self.assertIsNone(self.lookup(self.question, messages=history))
+
+    def test_kill_switch(self):
+        self.cache.set_enabled(False)
+        self.addCleanup(cache.delete, KILL_SWITCH_KEY)
+        self.assertIsNone(self.lookup(self.question))
+
+    @override_settings(LLM_SEMANTIC_CACHE={**settings.LLM_SEMANTIC_CACHE, "enabled": False})
+    def test_disabled_by_settings(self):
+        self.assertFalse(SemanticCache().enabled())
+
+    def test_kill_switch_is_not_read_synchronously_on_the_event_loop(self):
+        # Cache Django en base (DatabaseCache) : un accès synchrone sur la boucle échoue
+        django_cache = mock.Mock()
+        django_cache.get.side_effect = SynchronousOnlyOperation
+        django_cache.aget = mock.AsyncMock(return_value=False)
+
+        async def lookup_on_the_loop():
+            await self.cache.arefresh_switch()
+            return self.lookup(self.question)
+
+        self.cache._switch_checked_at = 0.0
+        with mock.patch("chatapp.semantic.cache", django_cache):
+            self.assertIsNone(asyncio.run(lookup_on_the_loop()))
+        django_cache.aget.assert_awaited_once()
+        django_cache.get.assert_not_called()
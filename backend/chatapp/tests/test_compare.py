@@ -0,0 +1,86 @@
+import json
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from chatapp.chat_handler import ChatHandler
+from chatapp.compare import ModelComparator
+from chatapp.executor import generation_executor
+from chatapp.resilience import CircuitBreaker, circuit_breakers
+
+
+class Ticket:
+    """Ticket d'admission accordé d'office"""
+    granted = True
+
+    def __init__(self):
+        self.released = 0
+
+    def wait(self, timeout):
+        return self.granted
+
+    async def wait_async(self, timeout):
+        return self.granted
+
+    def release(self):
+        self.released += 1
+
+
+class QueuedTicket(Ticket):
+    """Ticket resté en file jusqu'à l'échéance"""
+    granted = False
+
+
+@override_settings(
+    LLM_FAKE_PROVIDER={"enabled": True, "profiles": {
+        "fake": {"ttft": 0.05, "token_delay": 0.0, "tokens": 10},
+        "fake-fast": {"ttft": 0.0, "token_delay": 0.0, "tokens": 10},
+    }},
+    LLM_FALLBACK_MODELS={"fake": "fake-fast"},
+    LLM_HEDGING={"enabled": True, "models": {"fake": {"deadline": 0.0, "backup": "fake-fast"}},
+                 "budget_ratio": 1.0, "budget_min_per_second": 100.0, "budget_window": 60.0},
+)
+class PinnedCompareTests(TestCase):
+    """Une colonne de la comparaison ne contient que la réponse de son modèle"""
+    models = ["fake", "fake-fast"]
+
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.addCleanup(circuit_breakers.reset, "fake:")
+        self.payload = {"content": "Bonjour", "messages": []}
+
+    def results(self):
+        stream = ModelComparator().stream(ChatHandler, self.payload, self.models, [Ticket(), Ticket()], 1.0)
+        events = [json.loads(line) for line in stream]
+        return {event["model"]: event for event in events if event["type"] == "result"}
+
+    def test_slow_first_token_is_not_hedged(self):
+        results = self.results()
+        self.assertEqual(results["fake"]["status"], "completed")
+        self.assertEqual(results["fake"]["served_model"], "fake")
+        self.assertEqual(results["fake-fast"]["served_model"], "fake-fast")
+
+    def test_open_breaker_does_not_fall_back(self):
+        circuit_breakers.get("fake:fake")._state = CircuitBreaker.OPEN
+        circuit_breakers.get("fake:fake")._opened_at = time.monotonic()
+        results = self.results()
+        self.assertEqual(results["fake"]["status"], "error")
+        self.assertIsNone(results["fake"]["served_model"])
+        self.assertEqual(results["fake-fast"]["status"], "completed")
+
+    def test_pumps_run_in_generation_executor_once_admitted(self):
+        tickets = [QueuedTicket(), Ticket()]
+        with mock.patch.object(generation_executor, "submit", wraps=generation_executor.submit) as submit:
+            stream = ModelComparator().stream(ChatHandler, self.payload, self.models, tickets, 0.0)
+            events = [json.loads(line) for line in stream]
+        self.assertEqual([call.args[1] for call in submit.call_args_list], ["fake-fast"])
+        results = {event["model"]: event for event in events if event["type"] == "result"}
+        self.assertEqual(results["fake"]["status"], "error")
+        self.assertEqual(results["fake-fast"]["status"], "completed")
+        self.assertTrue(all(ticket.released for ticket in tickets))
+
+    def test_stream_never_iterated_releases_every_ticket(self):
+        tickets = [Ticket(), Ticket()]
+        ModelComparator().stream(ChatHandler, self.payload, self.models, tickets, 1.0).close()
+        self.assertEqual([ticket.released for ticket in tickets], [1, 1])
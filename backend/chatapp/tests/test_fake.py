@@ -0,0 +1,21 @@
+import json
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from chatapp.chat_handler import ChatHandler
+from chatapp.fake import FakeLLM
+
+
+class FakeProviderTests(SimpleTestCase):
+    def test_disabled_unless_explicitly_enabled(self):
+        self.assertFalse(settings.LLM_FAKE_PROVIDER["enabled"])
+        with override_settings(DEBUG=True):
+            chunks = list(ChatHandler()._generate_response(
+                {"modelId": "fake", "content": "Bonjour", "messages": [], "autoRoute": False}))
+        self.assertEqual(json.loads(chunks[-1])["type"], "model_init_error")
+
+    def test_answer_depends_only_on_prompt_and_seed(self):
+        llm = FakeLLM(ttft=0.0, token_delay=0.0, tokens=15)
+        self.assertEqual(llm.invoke("Bonjour"), llm.invoke("Bonjour"))
+        self.assertNotEqual(llm.invoke("Bonjour"), FakeLLM(ttft=0.0, token_delay=0.0, tokens=15, seed=7).invoke("Bonjour"))
@@ -0,0 +1,157 @@
+import threading
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from chatapp.benchmark import GENERATE_PATH, flush_writers
+from chatapp.errors import ERROR_CHUNK_PREFIX
+from chatapp.fake import FakeLLM
+from chatapp.flights import Flight, FlightRegistry, flight_registry
+from chatapp.models import Message, User
+from chatapp.resilience import circuit_breakers
+
+
+def without(name):
+    return {**getattr(settings, name, {}), "enabled": False}
+
+
+@override_settings(
+    LLM_FAKE_PROVIDER={"enabled": True, "profiles": {"fake": {"ttft": 0.0, "token_delay": 0.0, "tokens": 12}}},
+    LLM_RESPONSE_CACHE=without("LLM_RESPONSE_CACHE"),
+    LLM_SEMANTIC_CACHE=without("LLM_SEMANTIC_CACHE"),
+    LLM_RATE_LIMIT=without("LLM_RATE_LIMIT"),
+)
+class StoredReplayTests(TransactionTestCase):
+    """Doublon d'un tour terminé dont la génération n'est plus dans le registre du process"""
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.user = User.objects.create_user(email="replay@example.com", name="Replay")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.body = {
+            "content": "Quelles garanties pour une assurance habitation ?",
+            "chatId": str(uuid.uuid4()),
+            "createMessageId": str(uuid.uuid4()),
+            "messages": [{"id": str(uuid.uuid4()), "author": "assistant", "content": ""}],
+            "modelId": "fake",
+            "autoRoute": False,
+        }
+
+    def post(self, body=None):
+        response = self.client.post(GENERATE_PATH, body or self.body, format="json")
+        self.assertEqual(response.status_code, 200)
+        text = b"".join(response.streaming_content).decode("utf-8")
+        flush_writers()
+        return text
+
+    def restart(self):
+        # Registre vidé : expiration de replay_ttl, redémarrage ou autre worker
+        with flight_registry._lock:
+            flight_registry._flights.clear()
+            flight_registry._by_id.clear()
+
+    def test_completed_turn_is_replayed_from_the_database(self):
+        answer = self.post()
+        assistant = Message.objects.get(id=self.body["messages"][-1]["id"])
+        self.assertEqual(assistant.content, answer)
+        self.assertTrue(assistant.complete)
+
+        self.restart()
+        with mock.patch.object(FakeLLM, "_stream") as stream:
+            self.assertEqual(self.post(), answer)
+        stream.assert_not_called()
+        self.assertEqual(Message.objects.filter(author="assistant").count(), 1)
+
+    def test_create_message_id_alone_finds_the_answer(self):
+        body = {**self.body, "messages": []}
+        answer = self.post(body)
+        self.restart()
+        with mock.patch.object(FakeLLM, "_stream") as stream:
+            self.assertEqual(self.post(body), answer)
+        stream.assert_not_called()
+
+    def test_incomplete_answer_is_regenerated(self):
+        answer = self.post()
+        Message.objects.filter(id=self.body["messages"][-1]["id"]).update(content=answer[:10], complete=False)
+        self.restart()
+        regenerated = self.post()
+        self.assertNotEqual(regenerated, answer[:10])
+        assistant = Message.objects.get(id=self.body["messages"][-1]["id"])
+        self.assertEqual(assistant.content, regenerated)
+        self.assertTrue(assistant.complete)
+
+    def test_different_content_is_not_replayed(self):
+        answer = self.post()
+        self.restart()
+        changed = self.post({**self.body, "content": "Et pour une assurance voyage ?"})
+        self.assertNotEqual(changed, answer)
+
+
+class FlightRegistryTests(SimpleTestCase):
+    """Dédoublonnage d'une génération : abonnement, rejeu et abandon"""
+    def setUp(self):
+        self.registry = FlightRegistry()
+        self.release = threading.Event()
+        self.closed = threading.Event()
+
+    def source(self, chunks=("Bonjour", ", voici", " la réponse.")):
+        try:
+            for chunk in chunks:
+                yield chunk
+                self.release.wait(5)
+        finally:
+            self.closed.set()
+
+    def test_concurrent_duplicate_joins_the_running_generation(self):
+        flight, created = self.registry.acquire("tour", owner="u1")
+        flight.bind(self.source())
+        duplicate, duplicate_created = self.registry.acquire("tour", owner="u1")
+        self.assertTrue(created)
+        self.assertFalse(duplicate_created)
+        self.assertIs(duplicate, flight)
+        self.release.set()
+        self.assertEqual("".join(flight.iter_chunks()), "Bonjour, voici la réponse.")
+        self.assertEqual("".join(duplicate.iter_chunks()), "Bonjour, voici la réponse.")
+        self.assertEqual(self.registry.snapshot()["joined"], 1)
+
+    def test_duplicate_after_completion_is_replayed(self):
+        self.release.set()
+        flight, _ = self.registry.acquire("tour")
+        flight.bind(self.source())
+        answer = "".join(flight.iter_chunks())
+        flight.unsubscribe()
+
+        replay, created = self.registry.acquire("tour")
+        self.assertFalse(created)
+        self.assertEqual((replay.state, "".join(replay.iter_chunks())), (Flight.COMPLETED, answer))
+        self.assertEqual(self.registry.snapshot()["replayed"], 1)
+
+    def test_last_subscriber_leaving_cancels_upstream(self):
+        flight, _ = self.registry.acquire("tour")
+        flight.bind(self.source())
+        self.assertEqual(next(flight.iter_chunks()), "Bonjour")
+        flight.unsubscribe()
+        self.release.set()
+        self.assertTrue(self.closed.wait(5))
+        self.assertEqual(list(flight.iter_chunks(len(flight.chunks))), [])
+        self.assertEqual(flight.state, Flight.CANCELLED)
+
+        # Génération abandonnée : oubliée, le client peut relancer
+        retry, created = self.registry.acquire("tour")
+        self.assertTrue(created)
+        self.assertIsNot(retry, flight)
+
+    def test_failed_generation_is_not_replayed(self):
+        flight, _ = self.registry.acquire("tour")
+        flight.fail(f"{ERROR_CHUNK_PREFIX}provider indisponible")
+        self.assertEqual(flight.state, Flight.FAILED)
+        self.assertTrue(self.registry.acquire("tour")[1])
+
+    def test_resume_requires_the_same_owner(self):
+        flight, _ = self.registry.acquire("tour", owner="u1")
+        self.assertIsNone(self.registry.attach(flight.id, "u2"))
+        self.assertIs(self.registry.attach(flight.id, "u1"), flight)
+        self.assertEqual(flight.subscribers, 2)
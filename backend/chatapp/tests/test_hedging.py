@@ -0,0 +1,81 @@
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from chatapp.chat_handler import ChatHandler
+from chatapp.executor import ReadExecutor
+from chatapp.hedging import HedgePolicy
+from chatapp.resilience import circuit_breakers
+
+HEDGING = {"enabled": True, "models": {"fake-slow": {"deadline": 0.05, "backup": "fake-fast"}},
+           "budget_ratio": 1.0, "budget_min_per_second": 100.0, "budget_window": 60.0}
+
+
+@override_settings(
+    LLM_FAKE_PROVIDER={"enabled": True, "profiles": {
+        "fake-slow": {"ttft": 5.0, "token_delay": 0.0, "tokens": 10},
+        "fake-fast": {"ttft": 0.0, "token_delay": 0.0, "tokens": 10},
+    }},
+    LLM_HEDGING=HEDGING,
+)
+class SyncHedgingTests(TestCase):
+    """Couverture du premier token sur le chemin synchrone"""
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.addCleanup(circuit_breakers.reset, "fake:")
+        self.policy = HedgePolicy()
+        self.executor = ReadExecutor()
+        for target, value in (("hedge_policy", self.policy), ("first_token_executor", self.executor)):
+            patcher = mock.patch(f"chatapp.chat_handler.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.payload = {"modelId": "fake-slow", "content": "Bonjour", "messages": [], "autoRoute": False}
+
+    def generate(self):
+        started = time.perf_counter()
+        chunks = list(ChatHandler()._generate_response(self.payload))
+        return chunks, time.perf_counter() - started
+
+    def test_backup_wins_and_the_loser_is_closed_at_once(self):
+        chunks, elapsed = self.generate()
+        self.assertTrue(chunks)
+        self.assertEqual(self.payload["servedModelId"], "fake-fast")
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(self.policy.snapshot()["models"]["fake-slow"]["backup_wins"], 1)
+        # La lecture du perdant est interrompue : son thread est rendu sans attendre les 5 s du TTFT
+        deadline = time.monotonic() + 1.0
+        while self.executor._slots._value < 16 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.executor._slots._value, 16)
+
+    @override_settings(LLM_CONCURRENCY={"hedge_workers": 1})
+    def test_no_free_reader_means_no_hedge(self):
+        with override_settings(LLM_FAKE_PROVIDER={"enabled": True, "profiles": {
+            "fake-slow": {"ttft": 0.2, "token_delay": 0.0, "tokens": 10},
+            "fake-fast": {"ttft": 0.0, "token_delay": 0.0, "tokens": 10},
+        }}):
+            chunks, _ = self.generate()
+        self.assertTrue(chunks)
+        self.assertEqual(self.payload["servedModelId"], "fake-slow")
+        self.assertEqual(self.policy.snapshot()["models"]["fake-slow"]["backup_unavailable"], 1)
+        self.assertEqual(self.executor.rejected, 1)
+
+    def test_backup_goes_through_pacing(self):
+        with mock.patch("chatapp.chat_handler.rate_limit_pacer") as pacer:
+            pacer.delay_for.return_value = 0.0
+            self.generate()
+        self.assertEqual(self.payload["servedModelId"], "fake-fast")
+        self.assertEqual([call.args[1] for call in pacer.commit.call_args_list], ["fake-slow", "fake-fast"])
+
+    def test_backup_short_on_quota_is_not_hedged(self):
+        with override_settings(LLM_FAKE_PROVIDER={"enabled": True, "profiles": {
+            "fake-slow": {"ttft": 0.2, "token_delay": 0.0, "tokens": 10},
+            "fake-fast": {"ttft": 0.0, "token_delay": 0.0, "tokens": 10},
+        }}), mock.patch("chatapp.chat_handler.rate_limit_pacer") as pacer:
+            pacer.delay_for.side_effect = lambda provider, model, tokens: 3.0 if model == "fake-fast" else 0.0
+            chunks, _ = self.generate()
+        self.assertTrue(chunks)
+        self.assertEqual(self.payload["servedModelId"], "fake-slow")
+        self.assertEqual(self.policy.snapshot()["models"]["fake-slow"]["backup_unavailable"], 1)
+        self.assertEqual([call.args[1] for call in pacer.commit.call_args_list], ["fake-slow"])
@@ -0,0 +1,90 @@
+import subprocess
+import sys
+import textwrap
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from chatapp.flights import Flight
+from chatapp.models import Conversation, Message, TokenUsage, User
+from chatapp.persistence import AssistantMessagePersister, WriteBehindWriter
+from chatapp.throttling import LLM_TOKENS_BUCKET, TokenBucket
+from chatapp.usage import UsageRecorder
+
+# Process distinct arrêté sans flush explicite : seul atexit peut écrire les dépôts en attente
+SHUTDOWN_SCRIPT = textwrap.dedent("""
+    import os, sys
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatbot.settings")
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.db import connection
+    connection.settings_dict["NAME"] = sys.argv[1]
+    settings.LLM_MESSAGE_PERSISTENCE = {"flush_interval": 3600}
+    settings.LLM_USAGE = {"flush_interval": 3600}
+    from chatapp.persistence import message_writer
+    from chatapp.usage import usage_recorder
+    message_writer.submit(sys.argv[2], "Réponse écrite à l'arrêt.", complete=True)
+    usage_recorder.record(int(sys.argv[3]), sys.argv[4], "fake", 12, 30)
+""")
+
+
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="writer@example.com", name="Writer")
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.message = Message.objects.create(conversation=self.conversation, author="assistant",
+                                              content="", complete=False)
+        self.writer = WriteBehindWriter()
+
+    def stored(self):
+        self.message.refresh_from_db()
+        return self.message.content, self.message.complete
+
+    def test_checkpoints_are_batched_and_the_latest_wins(self):
+        for content in ("Bon", "Bonjour", "Bonjour, voici"):
+            self.writer.submit(str(self.message.id), content)
+        self.writer.flush()
+        self.assertEqual(self.stored(), ("Bonjour, voici", False))
+        self.assertEqual((self.writer.batches, self.writer.rows), (1, 1))
+
+    @override_settings(LLM_MESSAGE_PERSISTENCE={"checkpoint_tokens": 1000, "checkpoint_seconds": 3600})
+    def test_completed_stream_is_marked_complete(self):
+        persister = AssistantMessagePersister(self.message.id, self.writer)
+        for chunk in ("Bonjour", ", voici", " la réponse."):
+            persister.append(chunk)
+        self.assertEqual(self.writer.snapshot()["pending"], 0)
+        persister.close(Flight.COMPLETED)
+        self.writer.flush()
+        self.assertEqual(self.stored(), ("Bonjour, voici la réponse.", True))
+
+    def test_cancelled_stream_keeps_the_partial_answer(self):
+        persister = AssistantMessagePersister(self.message.id, self.writer)
+        persister.append("Réponse part")
+        persister.close(Flight.CANCELLED)
+        self.writer.flush()
+        self.assertEqual(self.stored(), ("Réponse part", False))
+
+    def test_pending_content_is_flushed_on_shutdown(self):
+        result = subprocess.run(
+            [sys.executable, "-c", SHUTDOWN_SCRIPT, str(connection.settings_dict["NAME"]), str(self.message.id),
+             str(self.user.pk), str(self.conversation.pk)],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.stored(), ("Réponse écrite à l'arrêt.", True))
+        usage = TokenUsage.objects.get(conversation=self.conversation)
+        self.assertEqual((usage.model_id, usage.tokens_used), ("fake", 42))
+
+    def test_llm_token_bucket_is_charged_by_the_usage_writer(self):
+        bucket = TokenBucket.from_settings(LLM_TOKENS_BUCKET)
+        ident = f"user:{self.user.pk}"
+        cache.delete(bucket._key(ident))
+        recorder = UsageRecorder()
+        recorder.record(self.user.pk, self.conversation.pk, "fake", 1000, 500)
+        # Rien n'est débité sur le chemin du flux (boucle d'événements comprise)
+        self.assertEqual(bucket.peek(ident)["remaining"], bucket.capacity)
+        recorder.flush()
+        self.assertEqual(bucket.peek(ident)["remaining"], bucket.capacity - 1500)
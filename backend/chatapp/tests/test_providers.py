@@ -0,0 +1,44 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from chatapp.providers import ProviderClientRegistry
+
+
+class AsyncClientLifetimeTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = ProviderClientRegistry()
+
+    def test_each_loop_gets_its_own_client_closed_with_the_loop(self):
+        async def client_for_this_loop():
+            first = self.registry.async_http_client("openai", "gpt-test", "sk-1")
+            again = self.registry.async_http_client("openai", "gpt-test", "sk-1")
+            self.assertIs(first, again)
+            self.assertIn(asyncio.get_running_loop(), self.registry._loops)
+            return first
+
+        first = asyncio.run(client_for_this_loop())
+        self.assertTrue(first.is_closed)
+        self.assertEqual(len(self.registry._loops), 0)
+
+        second = asyncio.run(client_for_this_loop())
+        self.assertIsNot(first, second)
+        self.assertTrue(second.is_closed)
+
+    def test_loop_closed_without_cancelling_tasks_is_dropped(self):
+        loop = asyncio.new_event_loop()
+
+        async def open_client():
+            return self.registry.async_http_client("openai", "gpt-test", "sk-1")
+
+        loop.run_until_complete(open_client())
+        loop.close()
+        asyncio.run(open_client())
+        self.assertNotIn(loop, self.registry._loops)
+
+    def test_stats_count_async_pools(self):
+        async def open_client():
+            self.registry.async_http_client("openai", "gpt-test", "sk-1")
+            return self.registry.stats()
+
+        self.assertIn("openai:gpt-test:", next(iter(asyncio.run(open_client()))))
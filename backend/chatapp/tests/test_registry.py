@@ -0,0 +1,43 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chatapp.registry import ModelRegistry
+
+REGISTRY = {"default_provider": "openai", "prefixes": {"llama": "groq"},
+            "models": {"fake": {"provider": "fake"}}, "reload_interval": 60.0}
+
+
+@override_settings(LLM_MODEL_REGISTRY=REGISTRY)
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        patcher = mock.patch.object(ModelRegistry, "_rows", return_value=[])
+        self.rows = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown_model_is_resolved_without_being_stored(self):
+        self.assertEqual(self.registry.resolve("llama-3-70b").provider, "groq")
+        self.assertEqual(self.registry.resolve("n'importe quoi").provider, "openai")
+        self.assertEqual(set(self.registry._table()), {"fake"})
+
+    def test_event_loop_never_queries_the_database(self):
+        async def resolve_on_the_loop():
+            before = self.registry.resolve("fake").provider
+            calls = self.rows.call_count
+            await self.registry.arefresh()
+            return before, calls
+        provider, calls = asyncio.run(resolve_on_the_loop())
+        # Avant le premier chargement : modèles livrés, sans requête ; puis rechargement hors de la boucle
+        self.assertEqual((provider, calls), ("fake", 0))
+        self.assertEqual(self.rows.call_count, 1)
+
+        self.registry.invalidate()
+
+        async def resolve_stale():
+            return self.registry.resolve("fake").provider
+        self.assertEqual(asyncio.run(resolve_stale()), "fake")
+        self.assertEqual(self.rows.call_count, 1)
+        self.registry.resolve("fake")
+        self.assertEqual(self.rows.call_count, 2)
@@ -0,0 +1,160 @@
+import json
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from chatapp.chat_handler import ChatHandler
+from chatapp.resilience import CircuitBreaker, circuit_breakers
+
+
+class FakeClock:
+    """Horloge monotone pilotée par le test"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def fake_provider(**profile):
+    """Fournisseur simulé activé, profil 'fake' rapide (ajusté par `profile`)"""
+    conf = getattr(settings, "LLM_FAKE_PROVIDER", {})
+    profiles = {**conf.get("profiles", {}), "fake": {"ttft": 0.0, "token_delay": 0.0, "tokens": 30, **profile}}
+    return override_settings(LLM_FAKE_PROVIDER={**conf, "enabled": True, "profiles": profiles})
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("chatapp.resilience.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test:model", failure_threshold=3, reset_timeout=30.0)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 31)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_admits_a_single_probe(self):
+        self.open_breaker()
+        self.clock.now += 30.0
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_probe_success_closes(self):
+        self.open_breaker()
+        self.clock.now += 30.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_probe_failure_reopens(self):
+        self.open_breaker()
+        self.clock.now += 30.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_released_probe_is_readmitted(self):
+        self.open_breaker()
+        self.clock.now += 30.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_probe_is_replaced_after_reset_timeout(self):
+        self.open_breaker()
+        self.clock.now += 30.0
+        self.assertTrue(self.breaker.allow())
+        # Sonde jamais revenue (ni succès, ni échec, ni libération)
+        self.clock.now += 29.0
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1.0
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+
+@fake_provider()
+class ProbeDisconnectTests(TestCase):
+    """Client déconnecté pendant l'appel de test d'un disjoncteur demi-ouvert"""
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.addCleanup(circuit_breakers.reset, "fake:")
+        self.handler = ChatHandler()
+        self.breaker = self.handler.breaker_for("fake")
+        self.breaker._state = CircuitBreaker.HALF_OPEN
+
+    def payload(self):
+        return {"modelId": "fake", "content": "Bonjour", "messages": [], "autoRoute": False}
+
+    def test_sync_disconnect_releases_the_probe(self):
+        stream = self.handler._generate_response(self.payload())
+        self.assertFalse(next(stream).startswith('{"error"'))
+        self.assertFalse(self.breaker.allow())
+        stream.close()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+    async def test_async_disconnect_releases_the_probe(self):
+        stream = self.handler._agenerate_response(self.payload())
+        self.assertFalse((await stream.__anext__()).startswith('{"error"'))
+        await stream.aclose()
+        self.assertTrue(self.breaker.allow())
+
+    def test_completed_probe_closes_the_breaker(self):
+        chunks = list(self.handler._generate_response(self.payload()))
+        self.assertTrue(chunks)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+@fake_provider()
+class SyncWaitBudgetTests(TestCase):
+    """Le chemin synchrone ne bloque pas le thread worker au-delà de LLM_PACING['sync_max_sleep']"""
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.addCleanup(circuit_breakers.reset, "fake:")
+        self.payload = {"modelId": "fake", "content": "Bonjour", "messages": [], "autoRoute": False}
+
+    def generate(self):
+        started = time.monotonic()
+        chunks = list(ChatHandler()._generate_response(self.payload))
+        return chunks, time.monotonic() - started
+
+    @override_settings(LLM_PACING={"max_wait": 10.0, "sync_max_sleep": 0.5})
+    def test_long_pacing_delay_is_surfaced_as_retry_after(self):
+        with mock.patch("chatapp.chat_handler.rate_limit_pacer.delay_for", return_value=5.0):
+            chunks, elapsed = self.generate()
+        error = json.loads(chunks[-1])
+        self.assertEqual((error["type"], error["retryAfter"]), ("rate_limit", 6))
+        self.assertLess(elapsed, 0.5)
+
+    @override_settings(LLM_PACING={"sync_max_sleep": 0.0},
+                       LLM_RETRY={"max_retries": 3, "base_delay": 3.0, "max_delay": 3.0})
+    def test_retry_beyond_the_budget_is_left_to_the_client(self):
+        with fake_provider(error="rate_limit"), mock.patch("chatapp.resilience.random.uniform", return_value=3.0), \
+                mock.patch("chatapp.chat_handler.retry_budget.try_acquire", return_value=True):
+            chunks, elapsed = self.generate()
+        error = json.loads(chunks[-1])
+        self.assertEqual((error["type"], error["retryAfter"]), ("rate_limit", 4))
+        self.assertLess(elapsed, 1.0)
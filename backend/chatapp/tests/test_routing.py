@@ -0,0 +1,31 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chatapp.chat_handler import DEFAULT_MODEL_ID, ChatHandler
+
+ROUTED = {"chosen": "llama"}
+
+
+@override_settings(LLM_ROUTING={"enabled": True, "routes": {"court": ["llama", "gpt-4o-mini"]}})
+@mock.patch("chatapp.chat_handler.model_router.decide", return_value=ROUTED)
+class RouteTests(SimpleTestCase):
+    def test_model_picked_by_the_client_is_kept(self, decide):
+        payload = {"modelId": "gpt-4o", "content": "merci"}
+        self.assertEqual(ChatHandler().route(payload), "gpt-4o")
+        self.assertEqual(payload["modelId"], "gpt-4o")
+        decide.assert_not_called()
+
+    def test_unpinned_turn_is_routed(self, decide):
+        payload = {"content": "merci"}
+        self.assertEqual(ChatHandler().route(payload), "llama")
+        self.assertEqual((payload["modelId"], payload["requestedModelId"]), ("llama", DEFAULT_MODEL_ID))
+
+    def test_auto_route_opts_a_picked_model_in(self, decide):
+        payload = {"modelId": "gpt-4o", "content": "merci", "autoRoute": True}
+        self.assertEqual(ChatHandler().route(payload), "llama")
+
+    @override_settings(LLM_ROUTING={"enabled": False})
+    def test_disabled_routing_keeps_the_default_model(self, decide):
+        self.assertEqual(ChatHandler().route({"content": "merci"}), DEFAULT_MODEL_ID)
+        decide.assert_not_called()
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from chatapp.benchmark import GENERATE_PATH, flush_writers
+from chatapp.chat_handler import ChatHandler, LLMRun
+from chatapp.models import User
+from chatapp.replay import JournalReader, ReplayJournal, journal_writer
+from chatapp.resilience import circuit_breakers
+from chatapp.streaming import TokenCoalescer, parse_event_id, sse_frame
+from chatapp.tests.test_resilience import fake_provider
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+class TokenCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("chatapp.streaming.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_token_is_sent_alone(self):
+        coalescer = TokenCoalescer(max_bytes=256, max_delay=0.05)
+        self.assertEqual(coalescer.add("Bonjour"), "Bonjour")
+        self.assertIsNone(coalescer.add(" et"))
+
+    def test_flushes_at_max_bytes(self):
+        coalescer = TokenCoalescer(max_bytes=8, max_delay=10.0, flush_first=False)
+        self.assertIsNone(coalescer.add("abc"))
+        self.assertIsNone(coalescer.add("def"))
+        self.assertEqual(coalescer.add("gh"), "abcdefgh")
+        self.assertEqual(coalescer.flush(), "")
+
+    def test_bytes_are_counted_in_utf8(self):
+        coalescer = TokenCoalescer(max_bytes=4, max_delay=10.0, flush_first=False)
+        self.assertIsNone(coalescer.add("é"))
+        self.assertEqual(coalescer.add("è"), "éè")
+
+    def test_flushes_when_the_oldest_token_reaches_max_delay(self):
+        coalescer = TokenCoalescer(max_bytes=256, max_delay=0.05, flush_first=False)
+        self.assertIsNone(coalescer.add("a"))
+        self.clock.now += 0.03
+        self.assertIsNone(coalescer.add("b"))
+        self.assertAlmostEqual(coalescer.timeout(), 0.02)
+        self.clock.now += 0.025
+        self.assertEqual(coalescer.add("c"), "abc")
+        self.assertIsNone(coalescer.timeout())
+
+    def test_passthrough_sends_every_token(self):
+        for coalescer in (TokenCoalescer(max_bytes=1), TokenCoalescer(max_delay=0)):
+            self.assertTrue(coalescer.passthrough)
+            self.assertEqual([coalescer.add(token) for token in ("a", "b")], ["a", "b"])
+
+    @override_settings(LLM_STREAM_COALESCING={"enabled": False})
+    def test_disabled_in_settings(self):
+        self.assertTrue(TokenCoalescer.from_settings().passthrough)
+
+
+@fake_provider()
+@override_settings(LLM_STREAM_COALESCING={"enabled": True, "max_bytes": 256, "max_delay_ms": 50, "flush_first": True})
+class CoalescingDeadlineTests(TransactionTestCase):
+    """Une pause du provider au milieu de la réponse ne retient pas le texte déjà reçu"""
+    payload = {"content": "Bonjour", "modelId": "fake", "autoRoute": False}
+    pause = 0.5
+
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+
+    def stream(self):
+        yield "Bonjour"
+        yield " et"
+        time.sleep(self.pause)
+        yield " merci."
+
+    async def astream(self):
+        yield "Bonjour"
+        yield " et"
+        await asyncio.sleep(self.pause)
+        yield " merci."
+
+    def assert_flushed_during_pause(self, received):
+        self.assertEqual([chunk for _, chunk in received], ["Bonjour", " et", " merci."])
+        self.assertLess(received[1][0], self.pause / 2)
+
+    def test_sync_buffer_is_flushed_at_the_deadline(self):
+        handler = ChatHandler()
+        with mock.patch.object(ChatHandler, "_start_run",
+                               lambda _, model_id, prompt, *args: LLMRun(model_id, prompt, self.stream())):
+            started = time.monotonic()
+            received = [(time.monotonic() - started, chunk) for chunk in handler._generate_response(dict(self.payload))]
+        self.assert_flushed_during_pause(received)
+
+    def test_async_buffer_is_flushed_at_the_deadline(self):
+        async def collect():
+            started = time.monotonic()
+            return [(time.monotonic() - started, chunk)
+                    async for chunk in ChatHandler()._agenerate_response(dict(self.payload))]
+        with mock.patch.object(ChatHandler, "_astart_run",
+                               lambda _, model_id, prompt, *args: LLMRun(model_id, prompt, self.astream())):
+            received = asyncio.run(collect())
+        self.assert_flushed_during_pause(received)
+
+    def test_async_close_cancels_the_pending_read(self):
+        async def scenario():
+            run = LLMRun("fake", "", self.astream())
+            self.assertEqual(await run.anext_token(), "Bonjour")
+            self.assertEqual(await run.anext_token(), " et")
+            with self.assertRaises(asyncio.TimeoutError):
+                await run.anext_token(timeout=0.01)
+            await run.aclose()
+        asyncio.run(scenario())
+
+
+class ReplayJournalTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/generation.jsonl"
+
+    def test_disk_io_stays_off_the_event_loop(self):
+        disk_threads = set()
+        write, read_new = ReplayJournal.write, JournalReader._read_new
+
+        def tracked_write(journal, entry):
+            disk_threads.add(threading.get_ident())
+            write(journal, entry)
+
+        def tracked_read(reader, handle, buffer):
+            disk_threads.add(threading.get_ident())
+            return read_new(reader, handle, buffer)
+
+        async def publish_then_resume():
+            journal = ReplayJournal(self.path, "1")
+            disk_threads.clear()
+            for chunk in ("Bon", "jour"):
+                journal.append(chunk)
+            journal.close("completed")
+            await asyncio.to_thread(journal_writer.flush)
+            reader = JournalReader(self.path)
+            return [chunk async for chunk in reader.aiter_chunks(1)], reader.state, threading.get_ident()
+
+        with mock.patch.object(ReplayJournal, "write", tracked_write), \
+                mock.patch.object(JournalReader, "_read_new", tracked_read):
+            chunks, state, loop_thread = asyncio.run(publish_then_resume())
+        self.assertEqual(chunks, ["jour"])
+        self.assertEqual(state, "completed")
+        self.assertTrue(disk_threads)
+        self.assertNotIn(loop_thread, disk_threads)
+
+
+class SSEFramingTests(SimpleTestCase):
+    def test_multiline_data_and_ids(self):
+        self.assertEqual(sse_frame("a\nb", event="token", event_id="g:3"),
+                         "id: g:3\nevent: token\ndata: a\ndata: b\n\n")
+
+    def test_event_id_points_to_the_next_chunk(self):
+        self.assertEqual(parse_event_id("abc:4"), ("abc", 5))
+        self.assertIsNone(parse_event_id("abc"))
+        self.assertIsNone(parse_event_id(":4"))
+
+
+def parse_events(text: str):
+    events = []
+    for block in text.strip().split("\n\n"):
+        event = {"data": []}
+        for line in block.split("\n"):
+            field, _, value = line.partition(": ")
+            if field == "data":
+                event["data"].append(value)
+            else:
+                event[field] = value
+        event["data"] = "\n".join(event["data"])
+        events.append(event)
+    return events
+
+
+@override_settings(
+    LLM_FAKE_PROVIDER={"enabled": True, "profiles": {"fake": {"ttft": 0.0, "token_delay": 0.0, "tokens": 40}}},
+    LLM_STREAM_COALESCING={"enabled": False},
+    LLM_RESPONSE_CACHE={**settings.LLM_RESPONSE_CACHE, "enabled": False},
+    LLM_RATE_LIMIT={**settings.LLM_RATE_LIMIT, "enabled": False},
+)
+class SSEResumeTests(TransactionTestCase):
+    """Reprise d'un flux SSE avec Last-Event-ID"""
+    def setUp(self):
+        circuit_breakers.reset("fake:")
+        self.user = User.objects.create_user(email="sse@example.com", name="SSE")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        flush_writers()
+
+    def generate(self):
+        body = {"content": "Quelles garanties pour un voyage ?", "chatId": str(uuid.uuid4()),
+                "modelId": "fake", "autoRoute": False}
+        response = self.client.post(GENERATE_PATH, body, format="json", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return parse_events(b"".join(response.streaming_content).decode("utf-8"))
+
+    def resume(self, last_event_id, **kwargs):
+        return self.client.get(GENERATE_PATH, HTTP_LAST_EVENT_ID=last_event_id, **kwargs)
+
+    def test_resume_continues_after_the_last_event(self):
+        events = self.generate()
+        self.assertEqual((events[0]["event"], events[-1]["event"]), ("start", "done"))
+        tokens = [event for event in events if event.get("event") == "token"]
+        self.assertGreater(len(tokens), 5)
+
+        response = self.resume(tokens[2]["id"])
+        self.assertEqual(response.status_code, 200)
+        resumed = parse_events(b"".join(response.streaming_content).decode("utf-8"))
+        self.assertEqual([event["data"] for event in resumed if event.get("event") == "token"],
+                         [event["data"] for event in tokens[3:]])
+        self.assertEqual(resumed[-1]["data"], json.dumps({"state": "completed"}))
+
+    def test_another_user_cannot_resume(self):
+        tokens = [event for event in self.generate() if event.get("event") == "token"]
+        other = User.objects.create_user(email="other@example.com", name="Other")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.resume(tokens[0]["id"]).status_code, 404)
+
+    def test_invalid_or_missing_event_id(self):
+        self.assertEqual(self.resume("pas-un-id").status_code, 400)
+        self.assertEqual(self.client.get(GENERATE_PATH).status_code, 400)
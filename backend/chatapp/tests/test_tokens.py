@@ -0,0 +1,36 @@
+import os
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chatapp.tokens import TokenCounter
+
+
+class WordEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@override_settings(LLM_TOKENIZER={"default_encoding": "cl100k_base", "encodings": {}, "preload": []})
+class TokenCounterTests(SimpleTestCase):
+    def setUp(self):
+        self.counter = TokenCounter()
+        patcher = mock.patch("chatapp.tokens.tiktoken.get_encoding", return_value=WordEncoding())
+        self.get_encoding = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counting_never_loads_an_encoding(self):
+        # Préchargement déjà lancé par ce process : le comptage n'attend ni ne télécharge rien
+        self.counter._preload_pid = os.getpid()
+        self.assertEqual(self.counter.count("un deux trois quatre", "gpt-3.5-turbo"), 6)
+        self.get_encoding.assert_not_called()
+
+    def test_preloaded_encoding_is_used(self):
+        self.assertEqual(self.counter.preload(), {})
+        self.assertEqual(self.counter.count("un deux trois quatre", "gpt-3.5-turbo"), 4)
+        self.get_encoding.assert_called_once_with("cl100k_base")
+
+    def test_unavailable_encoding_falls_back_to_the_estimate(self):
+        self.get_encoding.side_effect = OSError("réseau indisponible")
+        self.assertEqual(list(self.counter.preload()), ["cl100k_base"])
+        self.assertEqual(self.counter.count("un deux trois quatre", "gpt-3.5-turbo"), 6)
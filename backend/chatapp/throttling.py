@@ -0,0 +1,169 @@
+import math
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+
+def rate_limit_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_RATE_LIMIT", {})
+
+
+class TokenBucket:
+    """
+    Seau à jetons stocké dans le cache Django (GCRA) : la clé contient l'instant théorique
+    (en ms) où le seau sera de nouveau plein. Consommer `cost` jetons revient à l'avancer de
+    `cost` intervalles, en un seul `cache.incr` atomique ; la demande est refusée si cet
+    instant dépasse maintenant de plus que la capacité. Deux opérations supplémentaires
+    seulement hors du chemin nominal : annulation d'un refus, et recalage de l'instant
+    après une période d'inactivité (une course à ce moment-là accorde au pire un jeton de plus).
+    """
+    def __init__(self, name: str, capacity: float, per_minute: float):
+        self.name = name
+        self.capacity = capacity
+        self.interval_ms = 60000.0 / per_minute
+        self.burst_ms = capacity * self.interval_ms
+        # Une clé expirée équivaut à un seau plein : son TTL couvre largement un remplissage complet
+        self.ttl = max(int(self.burst_ms / 1000) * 10, 3600)
+
+    @classmethod
+    def from_settings(cls, name: str) -> Optional["TokenBucket"]:
+        conf = rate_limit_settings()
+        bucket = conf.get("buckets", {}).get(name)
+        if not conf.get("enabled", True) or not bucket:
+            return None
+        return cls(name, bucket["capacity"], bucket["per_minute"])
+
+    def _key(self, ident) -> str:
+        return f"chat:bucket:{self.name}:{ident}"
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
+
+    def state(self, tat: int, now: int) -> Dict[str, Any]:
+        """Valeurs des en-têtes : capacité, jetons restants, secondes avant remplissage"""
+        backlog = max(tat - now, 0)
+        return {
+            "limit": int(self.capacity),
+            "remaining": max(int((self.burst_ms - backlog) // self.interval_ms), 0),
+            "reset": math.ceil(backlog / 1000),
+        }
+
+    def _advance(self, ident, step: int, now: int) -> int:
+        """Avance l'instant théorique de `step` ms et retourne sa nouvelle valeur"""
+        key = self._key(ident)
+        try:
+            tat = cache.incr(key, step)
+        except ValueError:
+            # Première demande (ou clé expirée) : seau plein
+            if cache.add(key, now + step, timeout=self.ttl):
+                return now + step
+            tat = cache.incr(key, step)
+        if tat - step < now:
+            # Seau rempli depuis la dernière demande : l'instant théorique repart de maintenant
+            tat = now + step
+            cache.set(key, tat, timeout=self.ttl)
+        return tat
+
+    def consume(self, ident, cost: float = 1) -> Dict[str, Any]:
+        """Prélève `cost` jetons ; retourne l'état du seau et `wait` (secondes, 0 si accepté)"""
+        now = self._now_ms()
+        step = int(cost * self.interval_ms)
+        tat = self._advance(ident, step, now)
+        if tat - now > self.burst_ms:
+            cache.decr(self._key(ident), step)
+            return {**self.state(tat - step, now), "wait": (tat - now - self.burst_ms) / 1000}
+        return {**self.state(tat, now), "wait": 0}
+
+    def peek(self, ident) -> Dict[str, Any]:
+        """Lecture seule (une opération de cache) : `wait` > 0 si le seau est à découvert"""
+        now = self._now_ms()
+        tat = cache.get(self._key(ident)) or now
+        return {**self.state(tat, now), "wait": max(tat - now - self.burst_ms, 0) / 1000}
+
+    def charge(self, ident, cost: float):
+        """Débite après coup une consommation connue (tokens LLM) ; le seau peut passer à découvert"""
+        if cost > 0:
+            self._advance(ident, int(cost * self.interval_ms), self._now_ms())
+
+
+LLM_TOKENS_BUCKET = "llm_tokens"
+
+
+def charge_llm_tokens(user_id, tokens: int):
+    """Débite les tokens LLM réellement consommés par l'utilisateur, tous endpoints confondus"""
+    bucket = TokenBucket.from_settings(LLM_TOKENS_BUCKET)
+    if bucket is not None and user_id is not None:
+        bucket.charge(f"user:{user_id}", tokens)
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Throttle DRF adossé à un TokenBucket de LLM_RATE_LIMIT['buckets'].
+    L'état du seau est conservé sur la requête pour les en-têtes RateLimit-*.
+    """
+    kind = "requests"
+
+    def bucket_name(self, view) -> Optional[str]:
+        return getattr(view, "throttle_scope", None)
+
+    def get_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"ip:{super().get_ident(request)}"
+
+    def check(self, bucket: TokenBucket, ident) -> Dict[str, Any]:
+        return bucket.consume(ident)
+
+    def allow_request(self, request, view):
+        name = self.bucket_name(view)
+        bucket = TokenBucket.from_settings(name) if name else None
+        if bucket is None:
+            return True
+        self._state = self.check(bucket, self.get_ident(request))
+        limits = getattr(request, "_rate_limits", {})
+        limits[self.kind] = self._state
+        request._rate_limits = limits
+        return self._state["wait"] == 0
+
+    def wait(self):
+        return self._state["wait"]
+
+
+class RequestRateThrottle(BucketThrottle):
+    """Nombre de requêtes : un jeton par appel, seau propre à la vue (`throttle_scope`)"""
+    kind = "requests"
+
+
+class LLMTokenThrottle(BucketThrottle):
+    """
+    Tokens LLM : la consommation n'est connue qu'en fin de flux (charge_llm_tokens).
+    L'entrée ne fait qu'une lecture et refuse tant que le seau est à découvert.
+    """
+    kind = "tokens"
+
+    def bucket_name(self, view) -> Optional[str]:
+        return LLM_TOKENS_BUCKET
+
+    def check(self, bucket: TokenBucket, ident) -> Dict[str, Any]:
+        return bucket.peek(ident)
+
+
+class RateLimitHeadersMixin:
+    """Ajoute RateLimit-Limit / -Remaining / -Reset (seau le plus contraint) à toutes les réponses"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        limits = getattr(request, "_rate_limits", None)
+        if limits:
+            tightest = min(limits.values(), key=lambda state: state["remaining"] / max(state["limit"], 1))
+            response["RateLimit-Limit"] = str(tightest["limit"])
+            response["RateLimit-Remaining"] = str(tightest["remaining"])
+            response["RateLimit-Reset"] = str(tightest["reset"])
+            response["RateLimit-Policy"] = ", ".join(
+                f"{state['limit']};name={kind}" for kind, state in limits.items()
+            )
+        return response
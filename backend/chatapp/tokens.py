@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - dépendance transitive de langchain-openai
+    tiktoken = None
+
+
+def tokenizer_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_TOKENIZER", {})
+
+
+class TokenCounter:
+    """
+    Comptage de tokens par modèle avec tiktoken. Les modèles non OpenAI (Llama, Claude)
+    utilisent l'encodage `default_encoding`, une bonne approximation de leur tokenizer.
+    Les encodages sont chargés hors du chemin des requêtes (`preload`, au démarrage ou par
+    `manage.py preload_tokenizers`) : tiktoken télécharge le fichier BPE s'il n'est pas dans
+    `cache_dir`. Tant qu'un encodage n'est pas chargé (ou s'il est indisponible), repli sur
+    l'estimation de 4 caractères par token, signalé une seule fois.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encodings: Dict[str, Any] = {}
+        self._failed = set()
+        self._preload_pid: Optional[int] = None
+
+    def encoding_name(self, model_id: str) -> str:
+        conf = tokenizer_settings()
+        encodings = conf.get("encodings", {})
+        if model_id in encodings:
+            return encodings[model_id]
+        if tiktoken is not None:
+            try:
+                return tiktoken.encoding_name_for_model(model_id)
+            except KeyError:
+                pass
+        return conf.get("default_encoding", "cl100k_base")
+
+    @staticmethod
+    def preload_names() -> List[str]:
+        conf = tokenizer_settings()
+        names = [conf.get("default_encoding", "cl100k_base"), *conf.get("preload", []),
+                 *conf.get("encodings", {}).values()]
+        return list(dict.fromkeys(names))
+
+    def preload(self) -> Dict[str, str]:
+        """Charge les encodages configurés (téléchargement éventuel) ; retourne les erreurs par encodage"""
+        if tiktoken is None:
+            return {name: "tiktoken absent" for name in self.preload_names()}
+        cache_dir = tokenizer_settings().get("cache_dir")
+        if cache_dir:
+            os.environ["TIKTOKEN_CACHE_DIR"] = str(cache_dir)
+        errors = {}
+        for name in self.preload_names():
+            if name in self._encodings:
+                continue
+            try:
+                encoding = tiktoken.get_encoding(name)
+            except Exception as e:
+                errors[name] = str(e)
+                with self._lock:
+                    self._failed.add(name)
+                logging.warning(f"Encodage {name} indisponible, estimation à 4 caractères par token : {e}")
+                continue
+            with self._lock:
+                self._encodings[name] = encoding
+                self._failed.discard(name)
+        return errors
+
+    def start_preload(self):
+        """Préchargement en arrière-plan, une fois par process (un worker forké relance le sien)"""
+        with self._lock:
+            if self._preload_pid == os.getpid():
+                return
+            self._preload_pid = os.getpid()
+        threading.Thread(target=self.preload, name="tokenizer-preload", daemon=True).start()
+
+    def _encoding(self, model_id: str) -> Optional[Any]:
+        if tiktoken is None:
+            return None
+        name = self.encoding_name(model_id)
+        encoding = self._encodings.get(name)
+        if encoding is not None or name in self._failed:
+            return encoding
+        # Jamais de get_encoding ici : il peut télécharger le fichier BPE
+        self.start_preload()
+        if name not in self.preload_names():
+            with self._lock:
+                self._failed.add(name)
+            logging.warning(f"Encodage {name} ({model_id}) non préchargé (LLM_TOKENIZER['preload']), "
+                            f"estimation à 4 caractères par token")
+        return None
+
+    def count(self, text: str, model_id: str) -> int:
+        if not text:
+            return 0
+        encoding = self._encoding(model_id)
+        if encoding is None:
+            return len(text) // 4 + 1
+        return len(encoding.encode(text, disallowed_special=()))
+
+
+# Instance partagée par tout le process
+token_counter = TokenCounter()
@@ -3,7 +3,7 @@
 # chatapp/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserRegistrationView, UserLoginView, UserProfileView, UserChangePasswordView, SendPasswordResetEmailView, UserPasswordResetView, ConversationViewSet, MessageViewSet, AttachmentViewSet, PromptPresetViewSet, LLMConfigurationViewSet, TokenUsageViewSet, SavedPromptViewSet, ChatGenerateView, ExtractCardInfoViewSet
+from .views import UserRegistrationView, UserLoginView, UserProfileView, UserChangePasswordView, SendPasswordResetEmailView, UserPasswordResetView, ConversationViewSet, MessageViewSet, AttachmentViewSet, PromptPresetViewSet, LLMConfigurationViewSet, TokenUsageViewSet, SavedPromptViewSet, ChatGenerateView, ChatStatsView, SemanticCacheView, ModelRoutingView, UsageQuotaView, ExtractCardInfoViewSet
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -23,5 +23,9 @@ urlpatterns = [
     path('auth/send-reset-password-email/', SendPasswordResetEmailView.as_view(), name='send-reset-password-email'),
     path('auth/reset-password/<uid>/<token>/', UserPasswordResetView.as_view(), name='reset-password'),
     path('chat/message/generate/', ChatGenerateView.as_view(), name='chat-generate'),
+    path('chat/stats/', ChatStatsView.as_view(), name='chat-stats'),
+    path('chat/semantic-cache/', SemanticCacheView.as_view(), name='chat-semantic-cache'),
+    path('chat/routing/', ModelRoutingView.as_view(), name='chat-routing'),
+    path('chat/quota/', UsageQuotaView.as_view(), name='chat-quota'),
     path('', include(router.urls)),
 ]
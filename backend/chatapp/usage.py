@@ -0,0 +1,258 @@
+import atexit
+import datetime
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .errors import ChatHandlerError
+from .models import Conversation, ConversationUsage, DailyUsage, TokenUsage
+from .throttling import charge_llm_tokens
+
+ROLLUP_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "tokens_used")
+
+
+def usage_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_USAGE", {})
+
+
+def quota_settings() -> Dict[str, Any]:
+    return getattr(settings, "LLM_QUOTA", {})
+
+
+def _increment(model, lookup: Dict[str, Any], values: Dict[str, int]):
+    """Ajoute `values` à la ligne de cumul désignée par `lookup`, créée au besoin"""
+    increments = {field: F(field) + value for field, value in values.items()}
+    if model.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        # Savepoint : un autre process peut créer la ligne au même instant
+        with transaction.atomic():
+            model.objects.create(**lookup, **values)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**increments)
+
+
+def chunk_usage(chunk) -> Optional[Dict[str, int]]:
+    """
+    Consommation annoncée par le provider dans un fragment du flux : usage_metadata
+    du dernier AIMessageChunk (OpenAI avec stream_usage). None pour les autres fragments
+    et pour les providers qui n'en fournissent pas en streaming.
+    """
+    usage = getattr(chunk, "usage_metadata", None)
+    if not usage:
+        return None
+    return {"prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0)}
+
+
+class UsageRecorder:
+    """
+    Enregistrement différé de la consommation de tokens, partagé par tout le process.
+    Les flux déposent leur décompte en fin de tour ; un thread unique crée les lignes
+    TokenUsage par lots et incrémente, dans la même transaction, Conversation.total_tokens
+    et les cumuls DailyUsage / ConversationUsage (une écriture par clé du lot), au plus
+    toutes les `flush_interval` secondes : le décompte n'ajoute aucune écriture sur le
+    chemin du flux. Les compteurs de quota en cache et les seaux de tokens LLM (throttling)
+    sont ensuite mis à jour par ce même thread : aucun accès au cache Django, éventuellement
+    en base, depuis la boucle d'événements.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # Un flush (arrêt, fin de tour) attend le lot en cours d'écriture par le thread
+        self._flush_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._thread = None
+        self.recorded = 0
+        self.reported = 0
+        self.estimated = 0
+        self.batches = 0
+        self.rows = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def record(self, user_id, conversation_id, model_id: str, prompt_tokens: int,
+               completion_tokens: int, estimated: bool = False):
+        if user_id is None:
+            return
+        with self._lock:
+            self._pending.append({
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                "model_id": model_id,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "day": timezone.localdate(),
+            })
+            self.recorded += 1
+            if estimated:
+                self.estimated += 1
+            else:
+                self.reported += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= usage_settings().get("max_batch", 200):
+                self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(usage_settings().get("flush_interval", 2.0))
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        rows = [TokenUsage(
+            user_id=entry["user_id"],
+            conversation_id=entry["conversation_id"],
+            model_id=entry["model_id"],
+            prompt_tokens=entry["prompt_tokens"],
+            completion_tokens=entry["completion_tokens"],
+            tokens_used=entry["prompt_tokens"] + entry["completion_tokens"],
+        ) for entry in batch]
+        daily = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+        conversations = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+        for entry, row in zip(batch, rows):
+            values = {"requests": 1, "prompt_tokens": row.prompt_tokens,
+                      "completion_tokens": row.completion_tokens, "tokens_used": row.tokens_used}
+            targets = [daily[(row.user_id, entry["day"], row.model_id or "")]]
+            if row.conversation_id:
+                targets.append(conversations[row.conversation_id])
+            for totals in targets:
+                for field, value in values.items():
+                    totals[field] += value
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                TokenUsage.objects.bulk_create(rows)
+                for conversation_id, totals in conversations.items():
+                    Conversation.objects.filter(pk=conversation_id).update(
+                        total_tokens=F("total_tokens") + totals["tokens_used"])
+                    _increment(ConversationUsage, {"conversation_id": conversation_id}, totals)
+                for (user_id, day, model_id), totals in daily.items():
+                    _increment(DailyUsage, {"user_id": user_id, "day": day, "model_id": model_id}, totals)
+        except IntegrityError as e:
+            # Utilisateur ou conversation supprimés entre-temps : le lot ne passera jamais
+            self.dropped += len(rows)
+            logging.error(f"Consommation de tokens abandonnée ({len(rows)} tours) : {e}")
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Enregistrement de la consommation de tokens impossible ({len(rows)} tours) : {e}")
+            with self._lock:
+                self._pending[:0] = batch
+        else:
+            self.batches += 1
+            self.rows += len(rows)
+            charges = defaultdict(int)
+            for (user_id, day, _), totals in daily.items():
+                usage_quota.add(user_id, day, totals["tokens_used"])
+                charges[user_id] += totals["tokens_used"]
+            for user_id, tokens in charges.items():
+                charge_llm_tokens(user_id, tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "provider_reported": self.reported,
+                "estimated": self.estimated,
+                "batches": self.batches,
+                "rows": self.rows,
+                "dropped": self.dropped,
+                "errors": self.errors,
+            }
+
+
+class UsageQuota:
+    """
+    Quota quotidien de tokens par utilisateur (tous modèles), lu depuis DailyUsage :
+    quelques lignes (une par modèle utilisé dans la journée) sur l'index unique.
+    Le total du jour est gardé dans le cache Django et incrémenté à chaque lot écrit ;
+    la vérification en tête de génération ne fait donc pas d'agrégat.
+    """
+    @staticmethod
+    def limit() -> Optional[int]:
+        return quota_settings().get("daily_tokens")
+
+    @staticmethod
+    def _key(user_id, day: datetime.date) -> str:
+        return f"chat:quota:{user_id}:{day.isoformat()}"
+
+    @staticmethod
+    def _seconds_until_reset() -> int:
+        now = timezone.localtime()
+        tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                             tzinfo=now.tzinfo)
+        return max(int((tomorrow - now).total_seconds()), 1)
+
+    def _timeout(self) -> int:
+        return min(quota_settings().get("cache_ttl", 300), self._seconds_until_reset())
+
+    def used(self, user_id, day: Optional[datetime.date] = None) -> int:
+        """Tokens consommés dans la journée : cache, sinon cumuls du jour"""
+        day = day or timezone.localdate()
+        key = self._key(user_id, day)
+        used = cache.get(key)
+        if used is None:
+            used = DailyUsage.objects.filter(user_id=user_id, day=day).aggregate(total=Sum("tokens_used"))["total"] or 0
+            cache.add(key, used, timeout=self._timeout())
+        return used
+
+    def add(self, user_id, day: datetime.date, tokens: int):
+        # Compteur absent ou expiré : il sera relu depuis les cumuls
+        try:
+            cache.incr(self._key(user_id, day), tokens)
+        except ValueError:
+            pass
+
+    def check(self, user_id):
+        """Lève ChatHandlerError (429) si le quota du jour est atteint"""
+        limit = self.limit()
+        if not quota_settings().get("enabled", True) or not limit:
+            return
+        if self.used(user_id) >= limit:
+            raise ChatHandlerError(
+                message="Quota quotidien de tokens atteint. Veuillez réessayer demain.",
+                error_type="quota_exceeded",
+                status_code=429,
+                retry_after=self._seconds_until_reset(),
+            )
+
+    def status(self, user_id) -> Dict[str, Any]:
+        day = timezone.localdate()
+        limit = self.limit()
+        used = self.used(user_id, day)
+        by_model = {
+            row["model_id"] or "inconnu": row["tokens_used"]
+            for row in DailyUsage.objects.filter(user_id=user_id, day=day).values("model_id", "tokens_used")
+        }
+        return {
+            "day": day.isoformat(),
+            "limit": limit,
+            "used": used,
+            "remaining": max(limit - used, 0) if limit else None,
+            "resets_in": self._seconds_until_reset(),
+            "by_model": by_model,
+        }
+
+
+# Instances partagées par tout le process ; les décomptes en attente sont écrits à l'arrêt
+usage_quota = UsageQuota()
+usage_recorder = UsageRecorder()
+atexit.register(usage_recorder.flush)
@@ -4,6 +4,8 @@ from io import BytesIO
 from django.core.mail import EmailMessage
 from django.conf import settings
 
+from chatapp.tokens import token_counter
+
 # Pour l'export PDF et Word, il vous faudra installer les librairies reportlab et python-docx :
 # pip install reportlab python-docx
 from reportlab.lib.pagesizes import letter
@@ -150,10 +152,13 @@ class Util:
 
     @staticmethod
     def calculate_token_usage(conversation):
-        total_tokens = 0
-        for message in conversation.messages.all():
-            total_tokens += len(message.content.split())
-        return total_tokens
+        """
+        Tokens de l'historique de la conversation comptés avec le tokenizer de son modèle.
+        La consommation réelle (prompts et réponses) est tenue dans Conversation.total_tokens.
+        """
+        model_id = conversation.model_id or ""
+        return sum(token_counter.count(message.content, model_id)
+                   for message in conversation.messages.all())
 
     @staticmethod
     def stream_response_generator(generator):
@@ -1,8 +1,12 @@
+import json
+import logging
+import traceback
 from uuid import uuid4
 
 from django.contrib.auth import authenticate
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
 from django.db import IntegrityError, transaction
 from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
@@ -10,7 +14,8 @@ from django.utils import timezone
 
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -24,7 +29,7 @@ from .models import (
     SavedPrompt,
     TokenUsage,
 )
-from .renderers import UserRenderer
+from .renderers import EventStreamRenderer, UserRenderer
 from .serializers import (
     AttachmentSerializer,
     ConversationSerializer,
@@ -41,7 +46,27 @@ from .serializers import (
     SendPasswordResetEmailSerializer,
 )
 from .utils import Util
+from .caching import response_cache
 from .chat_handler import ChatHandler
+from .compare import compare_settings, model_comparator
+from .errors import ChatHandlerError
+from .executor import AdmissionRejected, admission_controller
+from .flights import flight_key, flight_registry
+from .funnel import funnel_tracker
+from .hedging import hedge_policy
+from .metrics import generation_metrics
+from .pacing import rate_limit_pacer
+from .persistence import AssistantMessagePersister, message_writer
+from .providers import provider_clients
+from .replay import replay_settings, replay_store
+from .resilience import circuit_breakers, retry_budget
+from .routing import model_router
+from .semantic import semantic_cache
+from .streaming import SSEFormatter, managed_stream, parse_event_id
+from .registry import model_registry
+from .summaries import conversation_summarizer
+from .throttling import LLMTokenThrottle, RateLimitHeadersMixin, RequestRateThrottle
+from .usage import usage_quota, usage_recorder
 
 
 def get_tokens_for_user(user):
@@ -152,430 +177,269 @@ class LLMConfigurationViewSet(viewsets.ReadOnlyModelViewSet):
 # ----------------------
 # Chat Generation
 # ----------------------
-class ChatGenerateView(APIView):
+class ChatGenerateView(RateLimitHeadersMixin, APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+    throttle_classes = [RequestRateThrottle, LLMTokenThrottle]
+    throttle_scope = 'chat'
+
+    def get(self, request, *args, **kwargs):
+        """Reprise d'un flux SSE (EventSource natif) : Last-Event-ID en en-tête ou en paramètre."""
+        last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('lastEventId')
+        if not last_event_id:
+            return self.error_response("Last-Event-ID is required", "validation",
+                                       status.HTTP_400_BAD_REQUEST)
+        return self.resume(request, last_event_id)
 
     def post(self, request, *args, **kwargs):
+        # Client SSE qui se reconnecte : reprise du flux, sans nouvelle génération
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            return self.resume(request, last_event_id)
+
         data = request.data
         content = data.get('content')
         if not content:
             return self.error_response("Message content is required", "validation",
                                        status.HTTP_400_BAD_REQUEST)
 
-        chat_id = data.get('chatId')
-        conversation = None
-        if chat_id:
-            try:
-                conversation = Conversation.objects.filter(
-                    id=chat_id, user=request.user
-                ).first()
-            except ValidationError:
-                conversation = None
-
-        with transaction.atomic():
-            if not conversation:
-                chat_id = chat_id or str(uuid4())
-                conversation = Conversation.objects.create(
-                    id=chat_id,
-                    user=request.user,
-                    title=data.get('chatTitle', 'New Conversation'),
-                    model_id=data.get('modelId', 'llama'),
-                    use_constraints=data.get('useConstraints', False),
-                )
-                Message.objects.create(
-                    conversation=conversation,
-                    author='system',
-                    content='System initialized.',
-                    order=0,
-                    created_at=timezone.now()
-                )
-
-            # Determine order
-            last = conversation.messages.order_by('-order').first()
-            order = last.order + 1 if last else 1
-
-            # Handle edits or new user message
-            edit_id = data.get('editMessageId')
-            create_id = data.get('createMessageId')
-            if edit_id:
-                user_msg = Message.objects.filter(
-                    id=edit_id, conversation=conversation, author='user'
-                ).first()
-                if user_msg:
-                    user_msg.content = content
-                    user_msg.save()
-                    Message.objects.filter(
-                        conversation=conversation, order__gt=user_msg.order
-                    ).delete()
-                    order = user_msg.order + 1
-                else:
-                    Message.objects.create(
-                        id=create_id or str(uuid4()),
-                        conversation=conversation,
-                        author='user',
-                        content=content,
-                        order=order,
-                        created_at=timezone.now()
-                    )
-                    order += 1
-            elif create_id:
-                try:
-                    Message.objects.create(
-                        id=create_id,
-                        conversation=conversation,
-                        author='user',
-                        content=content,
-                        order=order,
-                        created_at=timezone.now()
-                    )
-                    order += 1
-                except IntegrityError:
-                    pass
+        # Quota quotidien de tokens : compteur en cache, aucun agrégat sur les tours
+        try:
+            usage_quota.check(request.user.pk)
+        except ChatHandlerError as e:
+            return self.handler_error_response(e)
 
-            # Prepare assistant message
-            msg_id = None
-            msgs = data.get('messages', [])
-            if msgs:
-                msg_id = msgs[-1].get('id')
+        handler = ChatHandler()
+        user_key = str(request.user.pk)
+        use_async = self.use_async_stream(request)
+        sse = self.wants_sse(request)
+
+        # Mode comparaison : le même tour envoyé simultanément à plusieurs modèles
+        if data.get('compareModels') is not None:
+            return self.compare(request, data, use_async, sse)
+
+        # Idempotence : un doublon (double clic, retry réseau) rejoint la génération en
+        # cours ou rejoue la réponse terminée, sans écriture en base ni nouvel appel LLM
+        key = flight_key(user_key, data) if flight_registry.enabled() else None
+        flight, created = flight_registry.acquire(key, owner=user_key)
+        if not created:
+            return self.flight_response(flight, use_async, sse)
+        # Doublon inconnu du registre (expiré, redémarrage, autre worker) : réponse déjà en base
+        stored = self.stored_answer(request, data) if key is not None else None
+        if stored is not None:
+            flight_registry.replay_stored(flight, stored)
+            return self.flight_response(flight, use_async, sse)
+        if sse:
+            self.make_resumable(flight, user_key)
+
+        # Routage du tour (LLM_ROUTING) : modèle effectif, connu avant l'admission par provider
+        model_id = handler.route(data)
+
+        # Contrôle d'admission avant toute écriture : refus immédiat 429/503 avec Retry-After
+        try:
+            ticket = admission_controller.request(user_key, handler.provider_for(model_id))
+        except AdmissionRejected as e:
+            flight.fail(e.to_json())
+            return self.handler_error_response(e)
+        # WSGI : l'attente en file occupe le thread worker ; ASGI : elle se fait dans le flux
+        if not use_async and not ticket.wait(self.max_wait()):
+            rejection = admission_controller.rejection()
+            flight.fail(rejection.to_json())
+            return self.handler_error_response(rejection)
 
-            if msg_id:
-                assistant_msg, created = Message.objects.get_or_create(
-                    id=msg_id,
-                    defaults={'conversation': conversation,
-                              'author': 'assistant',
-                              'content': '',
-                              'order': order,
-                              'created_at': timezone.now()}
-                )
-                if not created:
-                    assistant_msg.order = order
-                    assistant_msg.save()
-            else:
-                assistant_msg = Message.objects.create(
-                    conversation=conversation,
-                    author='assistant',
-                    content='',
-                    order=order,
-                    created_at=timezone.now()
-                )
+        try:
+            conversation, assistant_msg = self.prepare_conversation(request, data)
+            # État du parcours de souscription, recalculé entièrement après une édition
+            data['funnel'] = funnel_tracker.track(conversation, content,
+                                                  rebuild=bool(data.get('editMessageId')))
+        except BaseException as e:
+            ticket.release()
+            flight.fail(self.stream_error(e))
+            raise
 
         # Streaming response
         data['chatId'] = conversation.id
+        data['userId'] = request.user.pk
         data['messages'] = list(
             conversation.messages.values('id', 'author', 'content', 'order')
         )
+        if conversation.summary:
+            data['summary'] = {'text': conversation.summary,
+                               'throughOrder': conversation.summary_through_order}
+
+        def schedule_summary(finished):
+            # Résumé glissant mis à jour en arrière-plan une fois la réponse complète
+            if (finished.state == finished.COMPLETED
+                    and conversation_summarizer.is_due(data['messages'], conversation.summary_through_order)):
+                conversation_summarizer.schedule(conversation.id)
         try:
-            handler = ChatHandler()
-            stream = handler.generate_response(data)
-
-            def error_gen():
-                try:
-                    yield from stream
-                except Exception as e:
-                    yield json.dumps({
-                        'error': True,
-                        'message': str(e),
-                        'type': 'generation',
-                        'status': 500,
-                        'details': traceback.format_exc()
-                    })
-
-            return StreamingHttpResponse(
-                error_gen(),
-                content_type='text/plain; charset=utf-8'
-            )
+            if use_async:
+                stream = self.async_error_gen(handler.agenerate_response(data), ticket)
+            else:
+                stream = self.error_gen(handler.generate_response(data))
+
+            # La génération est pompée indépendamment de la réponse HTTP ; le slot
+            # d'admission est libéré à sa fin (terminée, en erreur ou abandonnée)
+            # et la réponse est enregistrée au fil de l'eau dans le message assistant
+            flight.add_sink(AssistantMessagePersister(assistant_msg.id, message_writer))
+            flight.bind(stream, on_finish=[lambda _: ticket.release(), schedule_summary])
+            return self.flight_response(flight, use_async, sse)
         except Exception as e:
+            ticket.release()
+            flight.fail(self.stream_error(e))
             return self.error_response(
                 f"Generation init error: {e}", 'generation',
                 status.HTTP_500_INTERNAL_SERVER_ERROR,
                 traceback.format_exc()
             )
 
-    def error_response(self, message, error_type, status_code, details=None):
-        resp = {
-            'error': True,
-            'message': message,
-            'type': error_type,
-            'status': status_code,
-        }
-        if details and (self.request.user.is_staff or settings.DEBUG):
-            resp['details'] = details
-        return JsonResponse(resp, status=status_code)
-
-
-# ----------------------
-# Conversation & Messages
-# ----------------------
-class ConversationViewSet(viewsets.ModelViewSet):
-    serializer_class = ConversationSerializer
-
-    def get_queryset(self):
-        user = self.request.user
-        return Conversation.objects.filter(user=user) if user.is_authenticated else Conversation.objects.none()
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
-    @action(detail=True, methods=['get'])
-    def export_pdf(self, request, pk=None):
-        convo = self.get_object()
-        pdf = Util.export_conversation_to_pdf(convo)
-        resp = HttpResponse(pdf, content_type='application/pdf')
-        resp['Content-Disposition'] = f'attachment; filename="conversation_{convo.id}.pdf"'
-        return resp
-
-    @action(detail=True, methods=['get'])
-    def export_word(self, request, pk=None):
-        convo = self.get_object()
-        doc = Util.export_conversation_to_word(convo)
-        resp = HttpResponse(
-            doc,
-            content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
-        resp['Content-Disposition'] = f'attachment; filename="conversation_{convo.id}.docx"'
-        return resp
-
-
-class MessageViewSet(viewsets.ModelViewSet):
-    serializer_class = MessageSerializer
-
-    def get_queryset(self):
-        user = self.request.user
-        if not user.is_authenticated:
-            return Message.objects.none()
-        conv_id = self.request.query_params.get('conversation')
-        base_qs = Message.objects.filter(conversation__user=user)
-        return base_qs.filter(conversation__id=conv_id) if conv_id else base_qs
-
-    def partial_update(self, request, *args, **kwargs):
-        with transaction.atomic():
-            return super().partial_update(request, *args, **kwargs)
-
-    def destroy(self, request, *args, **kwargs):
-        with transaction.atomic():
-            msg = self.get_object()
-            conv = msg.conversation
-            deleted, _ = Message.objects.filter(
-                conversation=conv, order__gte=msg.order
-            ).delete()
-            return Response({'deleted': deleted}, status=status.HTTP_204_NO_CONTENT)
-
-    @action(detail=True, methods=['post'])
-    def regenerate(self, request, pk=None):
-        msg = self.get_object()
-        if msg.author != 'user':
-            return Response(
-                {"detail": "Only user messages can regenerate."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        new = Message.objects.create(
-            conversation=msg.conversation,
-            author='assistant',
-            content=f"Regenerated for: {msg.content}",
-            order=msg.order + 1
-        )
-        return Response(MessageSerializer(new).data, status=status.HTTP_201_CREATED)
-
-
-class AttachmentViewSet(viewsets.ModelViewSet):
-    serializer_class = AttachmentSerializer
-
-    def get_queryset(self):
-        user = self.request.user
-        return Attachment.objects.filter(message__conversation__user=user) if user.is_authenticated else Attachment.objects.none()
-
-
-class TokenUsageViewSet(viewsets.ReadOnlyModelViewSet):
-    serializer_class = TokenUsageSerializer
-
-    def get_queryset(self):
-        user = self.request.user
-        return TokenUsage.objects.filter(user=user) if user.is_authenticated else TokenUsage.objects.none()
-
-
-class SavedPromptViewSet(viewsets.ModelViewSet):
-    serializer_class = SavedPromptSerializer
-
-    def get_queryset(self):
-        user = self.request.user
-        return SavedPrompt.objects.filter(user=user) if user.is_authenticated else SavedPrompt.objects.none()
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
-
-
-
-
-
-
-########################"abs
-# OCR "
-
-from uuid import uuid4
-
-from django.contrib.auth import authenticate
-from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.db import IntegrityError, transaction
-from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
-from django.shortcuts import get_object_or_404
-from django.utils import timezone
-
-from rest_framework import status, viewsets
-from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.response import Response
-from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
-
-from .models import (
-    Attachment,
-    Conversation,
-    LLMConfiguration,
-    Message,
-    PromptPreset,
-    SavedPrompt,
-    TokenUsage,
-)
-from .renderers import UserRenderer
-from .serializers import (
-    AttachmentSerializer,
-    ConversationSerializer,
-    LLMConfigurationSerializer,
-    MessageSerializer,
-    PromptPresetSerializer,
-    SavedPromptSerializer,
-    TokenUsageSerializer,
-    UserChangePasswordSerializer,
-    UserLoginSerializer,
-    UserPasswordResetSerializer,
-    UserProfileSerializer,
-    UserRegistrationSerializer,
-    SendPasswordResetEmailSerializer,
-)
-from .utils import Util
-from .chat_handler import ChatHandler
-
-
-def get_tokens_for_user(user):
-    refresh = RefreshToken.for_user(user)
-    return {
-        'refresh': str(refresh),
-        'access': str(refresh.access_token),
-    }
-
-
-# ----------------------
-# User Authentication
-# ----------------------
-class UserRegistrationView(APIView):
-    renderer_classes = [UserRenderer]
-
-    def post(self, request, format=None):
-        serializer = UserRegistrationSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = serializer.save()
-        token = get_tokens_for_user(user)
-        return Response({'token': token, 'msg': 'Registration Success'},
-                        status=status.HTTP_201_CREATED)
-
-
-class UserLoginView(APIView):
-    renderer_classes = [UserRenderer]
-
-    def post(self, request, format=None):
-        serializer = UserLoginSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        email = serializer.validated_data['email']
-        password = serializer.validated_data['password']
-        user = authenticate(email=email, password=password)
-
-        if not user:
-            return Response(
-                {'errors': {'non_field_errors': ['Invalid email or password']}},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        token = get_tokens_for_user(user)
-        user_data = {"id": user.id, "email": user.email, "name": user.name}
-        return Response({'token': token, 'msg': 'Login Success', 'user': user_data},
-                        status=status.HTTP_200_OK)
-
-
-class UserProfileView(APIView):
-    renderer_classes = [UserRenderer]
-    permission_classes = [IsAuthenticated]
-
-    def get(self, request, format=None):
-        serializer = UserProfileSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-
-class UserChangePasswordView(APIView):
-    renderer_classes = [UserRenderer]
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, format=None):
-        serializer = UserChangePasswordSerializer(
-            data=request.data,
-            context={'user': request.user}
-        )
-        serializer.is_valid(raise_exception=True)
-        return Response({'msg': 'Password Changed Successfully'},
-                        status=status.HTTP_200_OK)
-
-
-class SendPasswordResetEmailView(APIView):
-    renderer_classes = [UserRenderer]
-
-    def post(self, request, format=None):
-        serializer = SendPasswordResetEmailSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        return Response({'msg': 'Password reset link sent. Check your email.'},
-                        status=status.HTTP_200_OK)
-
-
-class UserPasswordResetView(APIView):
-    renderer_classes = [UserRenderer]
-
-    def post(self, request, uid, token, format=None):
-        serializer = UserPasswordResetSerializer(
-            data=request.data,
-            context={'uid': uid, 'token': token}
-        )
-        serializer.is_valid(raise_exception=True)
-        return Response({'msg': 'Password Reset Successfully'},
-                        status=status.HTTP_200_OK)
-
-
-# ----------------------
-# Prompt & LLM Config
-# ----------------------
-class PromptPresetViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = PromptPreset.objects.all()
-    serializer_class = PromptPresetSerializer
-
-
-class LLMConfigurationViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = LLMConfiguration.objects.all()
-    serializer_class = LLMConfigurationSerializer
-
-
-# ----------------------
-# Chat Generation
-# ----------------------
-class ChatGenerateView(APIView):
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, *args, **kwargs):
-        data = request.data
-        content = data.get('content')
-        if not content:
-            return self.error_response("Message content is required", "validation",
+    def compare(self, request, data, use_async, sse):
+        """
+        Fan-out de `content` vers les modèles de `compareModels` (LLM_COMPARE), flux multiplexés
+        par modèle. L'historique de `chatId` est lu s'il est fourni ; rien n'est écrit dans la
+        conversation, seule la consommation de tokens est décomptée.
+        """
+        try:
+            models = model_comparator.validate(data.get('compareModels'))
+        except ChatHandlerError as e:
+            return self.handler_error_response(e)
+        if compare_settings().get('admin_only', True) and not request.user.is_staff:
+            return self.error_response("Compare mode is restricted to administrators", "forbidden",
+                                       status.HTTP_403_FORBIDDEN)
+
+        # Un slot d'admission par modèle ; chaque canal compte comme un utilisateur distinct
+        # pour que la limite par utilisateur ne sérialise pas la comparaison
+        user_key = str(request.user.pk)
+        tickets = []
+        try:
+            for model_id in models:
+                tickets.append(admission_controller.request(f"{user_key}:compare:{model_id}",
+                                                            ChatHandler().provider_for(model_id)))
+        except AdmissionRejected as e:
+            for ticket in tickets:
+                ticket.release()
+            return self.handler_error_response(e)
+
+        payload = {**data, 'userId': request.user.pk, 'chatId': None, 'messages': []}
+        conversation = None
+        if data.get('chatId'):
+            try:
+                conversation = Conversation.objects.filter(id=data['chatId'], user=request.user).first()
+            except ValidationError:
+                conversation = None
+        if conversation:
+            payload['messages'] = list(conversation.messages.values('id', 'author', 'content', 'order'))
+            if conversation.summary:
+                payload['summary'] = {'text': conversation.summary,
+                                      'throughOrder': conversation.summary_through_order}
+        payload['funnel'] = funnel_tracker.apply(conversation.funnel_state if conversation else None,
+                                                 data['content'])
+
+        if use_async:
+            stream = model_comparator.astream(ChatHandler, payload, models, tickets, self.max_wait(), sse)
+        else:
+            stream = model_comparator.stream(ChatHandler, payload, models, tickets, self.max_wait(), sse)
+        response = self.stream_response(stream, sse)
+        if not sse:
+            response['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        return response
+
+    def resume(self, request, last_event_id):
+        """Reprend le flux SSE au fragment qui suit Last-Event-ID ('<generationId>:<index>')."""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return self.error_response("Invalid Last-Event-ID", "validation",
                                        status.HTTP_400_BAD_REQUEST)
-
+        generation_id, start = parsed
+        user_key = str(request.user.pk)
+        use_async = self.use_async_stream(request)
+
+        # Génération servie par ce worker : on s'y réabonne, elle continue en amont
+        flight = flight_registry.attach(generation_id, user_key)
+        if flight is not None:
+            return self.flight_response(flight, use_async, sse=True, start=start)
+
+        # Sinon, journal écrit par un autre worker de la machine
+        reader = None
+        if replay_settings().get('backend', 'memory') == 'disk':
+            reader = replay_store.reader(generation_id, user_key)
+        if reader is None:
+            return self.error_response("Stream not found or expired", "not_found",
+                                       status.HTTP_404_NOT_FOUND)
+        formatter = self.sse_formatter(generation_id, start, lambda: reader.state)
+        if use_async:
+            events = formatter.aiter(reader.aiter_chunks(start))
+        else:
+            events = formatter.iter(reader.iter_chunks(start))
+        return self.stream_response(events, sse=True)
+
+    @staticmethod
+    def make_resumable(flight, user_key):
+        conf = replay_settings()
+        journal = None
+        if conf.get('backend', 'memory') == 'disk':
+            try:
+                journal = replay_store.writer(flight.id, user_key)
+            except OSError as e:
+                # Reprise limitée à ce worker, la génération n'est pas bloquée
+                logging.warning(f"Journal de reprise indisponible : {e}")
+        flight.make_resumable(conf.get('resume_grace', 30.0), journal)
+
+    @staticmethod
+    def sse_formatter(generation_id, start, final_state):
+        return SSEFormatter(generation_id, start, final_state,
+                            retry_ms=replay_settings().get('retry_ms', 2000))
+
+    def flight_response(self, flight, use_async, sse=False, start=0):
+        """Abonne le client à la génération ; sa déconnexion le désabonne"""
+        chunks = flight.aiter_chunks(start) if use_async else flight.iter_chunks(start)
+        if sse:
+            formatter = self.sse_formatter(flight.id, start, lambda: flight.state)
+            chunks = formatter.aiter(chunks) if use_async else formatter.iter(chunks)
+        return self.stream_response(managed_stream(chunks, on_close=[flight.unsubscribe]), sse)
+
+    @staticmethod
+    def stream_response(stream, sse=False):
+        if not sse:
+            return StreamingHttpResponse(stream, content_type='text/plain; charset=utf-8')
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def stored_answer(request, data):
+        """
+        Réponse complète déjà enregistrée pour ce tour : message assistant de l'utilisateur
+        désigné par le dernier id de `messages` (ou qui suit le message `createMessageId`),
+        dont la question précédente a le même contenu. None sinon, ou pour une édition.
+        """
+        if data.get('editMessageId'):
+            return None
+        messages = data.get('messages') or []
+        assistant_id = messages[-1].get('id') if messages and isinstance(messages[-1], dict) else None
+        create_id = data.get('createMessageId')
+        own = Message.objects.filter(conversation__user=request.user)
+        try:
+            if assistant_id:
+                answer = own.filter(id=assistant_id, author='assistant').first()
+            else:
+                question = own.filter(id=create_id, author='user').first()
+                answer = (own.filter(conversation_id=question.conversation_id, author='assistant',
+                                     order=question.order + 1).first() if question else None)
+        except (ValidationError, ValueError):
+            return None
+        if answer is None or not answer.complete or not answer.content:
+            return None
+        question = own.filter(conversation_id=answer.conversation_id, author='user',
+                              order__lt=answer.order).order_by('-order').first()
+        if question is None or question.content != data.get('content'):
+            return None
+        return answer.content
+
+    def prepare_conversation(self, request, data):
+        """Crée ou met à jour la conversation, le message utilisateur et le message assistant."""
+        content = data.get('content')
         chat_id = data.get('chatId')
         conversation = None
         if chat_id:
@@ -593,7 +457,7 @@ class ChatGenerateView(APIView):
                     id=chat_id,
                     user=request.user,
                     title=data.get('chatTitle', 'New Conversation'),
-                    model_id=data.get('modelId', 'llama'),
+                    model_id=data.get('requestedModelId', data.get('modelId', 'llama')),
                     use_constraints=data.get('useConstraints', False),
                 )
                 Message.objects.create(
@@ -621,6 +485,7 @@ class ChatGenerateView(APIView):
                     Message.objects.filter(
                         conversation=conversation, order__gt=user_msg.order
                     ).delete()
+                    conversation.invalidate_summary(user_msg.order)
                     order = user_msg.order + 1
                 else:
                     Message.objects.create(
@@ -633,15 +498,17 @@ class ChatGenerateView(APIView):
                     )
                     order += 1
             elif create_id:
+                # Savepoint : un createMessageId rejoué ne doit pas invalider la transaction
                 try:
-                    Message.objects.create(
-                        id=create_id,
-                        conversation=conversation,
-                        author='user',
-                        content=content,
-                        order=order,
-                        created_at=timezone.now()
-                    )
+                    with transaction.atomic():
+                        Message.objects.create(
+                            id=create_id,
+                            conversation=conversation,
+                            author='user',
+                            content=content,
+                            order=order,
+                            created_at=timezone.now()
+                        )
                     order += 1
                 except IntegrityError:
                     pass
@@ -659,10 +526,12 @@ class ChatGenerateView(APIView):
                               'author': 'assistant',
                               'content': '',
                               'order': order,
+                              'complete': False,
                               'created_at': timezone.now()}
                 )
                 if not created:
                     assistant_msg.order = order
+                    assistant_msg.complete = False
                     assistant_msg.save()
             else:
                 assistant_msg = Message.objects.create(
@@ -670,42 +539,58 @@ class ChatGenerateView(APIView):
                     author='assistant',
                     content='',
                     order=order,
+                    complete=False,
                     created_at=timezone.now()
                 )
+        return conversation, assistant_msg
+
+    @staticmethod
+    def max_wait():
+        return getattr(settings, 'LLM_CONCURRENCY', {}).get('max_wait', 10.0)
+
+    @staticmethod
+    def wants_sse(request):
+        """Mode SSE (évènements identifiés et reprenables) si le client accepte text/event-stream."""
+        return 'text/event-stream' in request.headers.get('Accept', '')
+
+    @staticmethod
+    def use_async_stream(request):
+        """Sous ASGI, le flux est servi nativement par la boucle d'événements."""
+        return (getattr(settings, 'CHAT_ASYNC_STREAMING', True)
+                and isinstance(request._request, ASGIRequest))
+
+    @staticmethod
+    def stream_error(exc):
+        return json.dumps({
+            'error': True,
+            'message': str(exc),
+            'type': 'generation',
+            'status': 500,
+            'details': traceback.format_exc()
+        })
 
-        # Streaming response
-        data['chatId'] = conversation.id
-        data['messages'] = list(
-            conversation.messages.values('id', 'author', 'content', 'order')
-        )
+    def error_gen(self, stream):
+        # Si tous les clients se sont déconnectés, la pompe ferme ce générateur et
+        # `yield from` propage la fermeture jusqu'à ChatHandler, qui interrompt l'appel au provider.
         try:
-            handler = ChatHandler()
-            stream = handler.generate_response(data)
+            yield from stream
+        except Exception as e:
+            yield self.stream_error(e)
 
-            def error_gen():
-                try:
-                    yield from stream
-                except Exception as e:
-                    yield json.dumps({
-                        'error': True,
-                        'message': str(e),
-                        'type': 'generation',
-                        'status': 500,
-                        'details': traceback.format_exc()
-                    })
-
-            return StreamingHttpResponse(
-                error_gen(),
-                content_type='text/plain; charset=utf-8'
-            )
+    async def async_error_gen(self, stream, ticket=None):
+        try:
+            if ticket is not None and not await ticket.wait_async(self.max_wait()):
+                yield admission_controller.rejection().to_json()
+                return
+            async for token in stream:
+                yield token
         except Exception as e:
-            return self.error_response(
-                f"Generation init error: {e}", 'generation',
-                status.HTTP_500_INTERNAL_SERVER_ERROR,
-                traceback.format_exc()
-            )
+            yield self.stream_error(e)
+        finally:
+            # Propage l'abandon de la génération (plus aucun client) jusqu'à l'appel au provider
+            await stream.aclose()
 
-    def error_response(self, message, error_type, status_code, details=None):
+    def error_response(self, message, error_type, status_code, details=None, retry_after=None):
         resp = {
             'error': True,
             'message': message,
@@ -714,7 +599,85 @@ class ChatGenerateView(APIView):
         }
         if details and (self.request.user.is_staff or settings.DEBUG):
             resp['details'] = details
-        return JsonResponse(resp, status=status_code)
+        if retry_after is not None:
+            resp['retryAfter'] = retry_after
+        response = JsonResponse(resp, status=status_code)
+        if retry_after is not None:
+            response['Retry-After'] = str(retry_after)
+        return response
+
+    def handler_error_response(self, error):
+        return self.error_response(error.message, error.error_type, error.status_code,
+                                   error.details, retry_after=error.retry_after)
+
+
+class ChatStatsView(APIView):
+    """Statistiques de fonctionnement de la génération (réservé aux administrateurs)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'models': generation_metrics.snapshot(),
+            'admission': admission_controller.snapshot(),
+            'persistence': message_writer.snapshot(),
+            'usage': usage_recorder.snapshot(),
+            'response_cache': response_cache.snapshot(),
+            'semantic_cache': semantic_cache.snapshot(),
+            'conversation_summaries': conversation_summarizer.snapshot(),
+            'model_registry': model_registry.snapshot(),
+            'routing': model_router.snapshot(),
+            'compare': model_comparator.snapshot(),
+            'single_flight': flight_registry.snapshot(),
+            'pools': provider_clients.stats(),
+            'circuit_breakers': circuit_breakers.snapshot(),
+            'retry_budget': retry_budget.snapshot(),
+            'hedging': hedge_policy.snapshot(),
+            'rate_limits': rate_limit_pacer.snapshot(),
+        }, status=status.HTTP_200_OK)
+
+
+class SemanticCacheView(APIView):
+    """
+    Inspection et pilotage du cache sémantique (réservé aux administrateurs).
+    GET : état, métriques et entrées ; `?q=...` liste les entrées les plus proches.
+    POST {"enabled": bool} : interrupteur. DELETE : vide l'index.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        data = semantic_cache.snapshot(with_entries=True)
+        question = request.query_params.get('q')
+        if question:
+            data['nearest'] = semantic_cache.nearest(question)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        enabled = request.data.get('enabled')
+        if not isinstance(enabled, bool):
+            return Response({'error': '"enabled" (booléen) est requis.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        semantic_cache.set_enabled(enabled)
+        return Response(semantic_cache.snapshot(), status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        semantic_cache.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ModelRoutingView(APIView):
+    """Règles de routage des modèles et dernières décisions (réservé aux administrateurs)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(model_router.snapshot(with_decisions=True), status=status.HTTP_200_OK)
+
+
+class UsageQuotaView(APIView):
+    """Quota quotidien de tokens de l'utilisateur, lu depuis les cumuls (DailyUsage)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(usage_quota.status(request.user.pk), status=status.HTTP_200_OK)
 
 
 # ----------------------
@@ -1198,7 +1161,7 @@ Texte OCR à traiter :
 {text}"""
 
 
-class ExtractCardInfoViewSet(viewsets.ViewSet):
+class ExtractCardInfoViewSet(RateLimitHeadersMixin, viewsets.ViewSet):
     """
     ViewSet for extracting document info via OCR and LLM.
     Supported types:
@@ -1208,6 +1171,8 @@ class ExtractCardInfoViewSet(viewsets.ViewSet):
     """
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = ExtractCardInfoSerializer
+    throttle_classes = [RequestRateThrottle, LLMTokenThrottle]
+    throttle_scope = 'cards'
 
     def _save_temp_file(self, data):
         """Save uploaded or fetched file to a temp file."""
@@ -1238,7 +1203,7 @@ class ExtractCardInfoViewSet(viewsets.ViewSet):
         tmp.flush()
         return tmp
 
-    def _extract_and_parse(self, tmp_file, prompt_template):
+    def _extract_and_parse(self, tmp_file, prompt_template, user_id=None):
         """Run OCR and LLM parsing pipeline with chosen prompt."""
         try:
             text = Util.extract_text_from_file(tmp_file.name)
@@ -1254,7 +1219,8 @@ class ExtractCardInfoViewSet(viewsets.ViewSet):
             'content': prompt,
             'modelId': 'llama',
             'temperature': 1,
-            'maxTokens': 1024
+            'maxTokens': 1024,
+            'userId': user_id,
         })
         output = ''.join(token for token in stream)
         return parser.parse(output)
@@ -1280,5 +1246,6 @@ class ExtractCardInfoViewSet(viewsets.ViewSet):
         except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        parsed = self._extract_and_parse(tmp_file, template)
+        user_id = request.user.pk if request.user.is_authenticated else None
+        parsed = self._extract_and_parse(tmp_file, template, user_id)
         return Response(parsed, status=status.HTTP_200_OK)
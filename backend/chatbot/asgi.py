@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Run with: uvicorn chatbot.asgi:application --host 0.0.0.0 --port 8000
+Chat generation streams are then served natively by the event loop
+(see ChatGenerateView and ChatHandler.agenerate_response).
 """
 
 import os
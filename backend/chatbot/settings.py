@@ -86,6 +86,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+        # Les écrivains différés (messages, consommation) écrivent en parallèle des requêtes :
+        # une transaction IMMEDIATE prend le verrou d'écriture dès BEGIN et attend jusqu'à
+        # `timeout` secondes, au lieu d'échouer en « database is locked » sur la promotion
+        # d'un verrou de lecture
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Base de test sur fichier : la base en mémoire partagée verrouille des tables entières
+        # (« database table is locked ») dès que les tests de charge écrivent depuis plusieurs threads
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'data', 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -209,4 +222,305 @@ CORS_ALLOW_METHODS = [
 
 PASSWORD_RESET_TIMEOUT = 120000
 
-ALLOWED_HOSTS = ['*'] 
\ No newline at end of file
+ALLOWED_HOSTS = ['*'] 
+
+
+# ----------------------
+# Chat streaming
+# ----------------------
+# Sous ASGI (uvicorn chatbot.asgi:application), la génération est servie par un flux
+# asynchrone natif. Mettre à False pour forcer le chemin synchrone (thread par flux).
+CHAT_ASYNC_STREAMING = os.environ.get('CHAT_ASYNC_STREAMING', 'true').lower() == 'true'
+
+# Pools HTTP keep-alive partagés par les clients providers (chatapp.providers)
+LLM_HTTP_POOL = {
+    'max_connections': int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', 20)),
+    'keepalive_expiry': 120.0,
+    'timeout': 60.0,
+    'connect_timeout': 10.0,
+}
+
+# Retries LLM : backoff exponentiel avec jitter, plafonné, et budget partagé par le process
+LLM_RETRY = {
+    'max_retries': 3,
+    'base_delay': 0.5,
+    'max_delay': 4.0,
+    'budget_ratio': 0.2,            # retries <= 20 % des requêtes de la fenêtre
+    'budget_min_per_second': 1.0,
+    'budget_window': 10.0,
+}
+
+# Disjoncteur par provider/modèle (chatapp.resilience)
+LLM_CIRCUIT_BREAKER = {
+    'failure_threshold': 5,
+    'reset_timeout': 30.0,
+}
+
+# Registre des modèles (chatapp.registry) : modèles livrés avec le code, complétés ou remplacés
+# par les lignes LLMConfiguration (name = modelId ; config_params = {"provider", "model",
+# "params", "limits": {"max_tokens", "context_budget"}, "aliases", "enabled"}).
+# Un modelId inconnu est routé selon son préfixe, sinon vers `default_provider`.
+LLM_MODEL_REGISTRY = {
+    'reload_interval': 60.0,    # relecture de LLMConfiguration par les autres workers
+    'default_provider': 'openai',
+    'prefixes': {'claude': 'anthropic', 'fake': 'fake'},
+    'models': {
+        'llama': {'provider': 'groq', 'model': 'llama-3.3-70b-versatile'},
+        'llama-3.1-70b': {'provider': 'groq', 'model': 'llama-3.3-70b-versatile'},
+        'llama-3.1-70b-versatile': {'provider': 'groq', 'model': 'llama-3.3-70b-versatile'},
+    },
+}
+
+# Fournisseur local simulé (chatapp.fake) pour les tests de charge et de latence sans appel
+# externe : modelId 'fake' ou 'fake-<profil>'. Délais en secondes, longueur en tokens ;
+# `error` : rate_limit, timeout, auth ou midstream (après `error_after` tokens), avec la probabilité `error_rate`
+LLM_FAKE_PROVIDER = {
+    # Activation explicite uniquement (jamais déduite de DEBUG) : benchmark_chat l'active pour son banc
+    'enabled': os.environ.get('LLM_FAKE_PROVIDER', 'false').lower() == 'true',
+    'defaults': {
+        'ttft': 0.3,
+        'token_delay': 0.02,
+        'jitter': 0.0,              # variation relative du délai entre tokens
+        'tokens': 120,
+        'error': None,
+        'error_rate': 1.0,
+        'error_after': 20,
+        'seed': 42,
+    },
+    'profiles': {
+        'fake': {},
+        'fake-fast': {'ttft': 0.05, 'token_delay': 0.005},
+        'fake-slow': {'ttft': 2.5, 'token_delay': 0.05, 'jitter': 0.5},
+        'fake-429': {'error': 'rate_limit'},
+        'fake-flaky': {'error': 'rate_limit', 'error_rate': 0.3},
+        'fake-timeout': {'error': 'timeout', 'ttft': 5.0},
+        'fake-auth': {'error': 'auth'},
+        'fake-midstream': {'error': 'midstream', 'error_after': 20},
+    },
+}
+
+# Routage adaptatif par tour (chatapp.routing) : les tours courts ou triviaux partent sur le
+# candidat le plus rapide d'après le TTFT et le débit mesurés ; les autres gardent le modèle demandé
+LLM_ROUTING = {
+    # Désactivé par défaut ; même activé, un modèle choisi par le client n'est remplacé qu'avec autoRoute: true
+    'enabled': os.environ.get('LLM_ROUTING', 'false').lower() == 'true',
+    'routes': {
+        'court': ['llama', 'gpt-4o-mini'],
+    },
+    'expected_tokens': {'court': 40, 'standard': 150, 'complexe': 400},
+    'short_max_words': 6,
+    'short_max_chars': 40,
+    'complex_min_words': 60,
+    # Expressions sans accents ni ponctuation
+    'trivial_phrases': ['merci', 'merci beaucoup', 'oui', 'non', 'ok', 'd accord', 'bonjour', 'bonsoir',
+                        'salut', 'au revoir', 'parfait', 'tres bien', 'c est note'],
+    'complex_keywords': ['sinistre', 'litige', 'resiliation', 'resilier', 'franchise', 'indemnisation',
+                         'comparer', 'difference', 'exclusion', 'expertise'],
+    'min_samples': 5,           # mesures nécessaires avant de départager les candidats
+    'max_decisions': 200,       # décisions conservées pour /chat/routing/
+}
+
+# Mode comparaison du endpoint de génération (compareModels) : un tour, N modèles en parallèle
+LLM_COMPARE = {
+    'enabled': True,
+    'max_models': 4,
+    'admin_only': True,
+}
+
+# Requêtes de couverture sur le premier token (chatapp.hedging) : sans token du modèle après
+# `deadline` secondes, la requête part aussi vers `backup` ; le premier qui répond est servi
+LLM_HEDGING = {
+    'enabled': os.environ.get('LLM_HEDGING', 'false').lower() == 'true',
+    'default_deadline': 2.0,
+    'models': {
+        'llama': {'deadline': 1.5, 'backup': 'gpt-4o-mini'},
+    },
+    'budget_ratio': 0.1,            # couvertures <= 10 % des requêtes éligibles de la fenêtre
+    'budget_min_per_second': 0.1,
+    'budget_window': 60.0,
+}
+
+# Modèle de repli utilisé quand le disjoncteur du modèle demandé est ouvert
+LLM_FALLBACK_MODELS = {
+    'llama': 'gpt-4o-mini',
+}
+
+# Cadence proactive à partir des en-têtes x-ratelimit-* (chatapp.pacing)
+LLM_PACING = {
+    'low_watermark': 0.1,   # sous 10 % du quota, les requêtes restantes sont étalées jusqu'au reset
+    'reroute_after': 1.0,   # au-delà de ce délai, bascule sur le modèle de repli s'il part plus tôt
+    'max_wait': 10.0,       # au-delà, refus immédiat en 429 avec Retry-After
+    'sync_max_sleep': 2.0,  # WSGI : attente cumulée du thread worker par tour (pacing, retries), puis Retry-After
+}
+
+# Contrôle d'admission et backpressure des générations
+LLM_CONCURRENCY = {
+    'max_concurrent': int(os.environ.get('LLM_MAX_CONCURRENT', 64)),  # générations actives dans le process
+    'per_provider': {},                # ex. {'groq': 16} ; sinon default_per_provider
+    'default_per_provider': 32,
+    'per_user': 2,                     # générations actives + en attente par utilisateur (429 au-delà)
+    'max_waiting': 100,                # file d'attente bornée (503 au-delà)
+    'max_wait': 10.0,                  # secondes d'attente maximale en file
+    'retry_after': 5,                  # valeur de l'en-tête Retry-After
+    'executor_slack': 8,               # threads en plus pour les appels en cours d'interruption
+    'hedge_workers': 16,               # lectures simultanées du premier token en couverture (WSGI)
+    'read_workers': 64,                # lectures à attente bornée des flux regroupés (WSGI)
+}
+
+# Idempotence des générations (chatapp.flights) : un doublon portant les mêmes
+# createMessageId / id du message assistant rejoint ou rejoue la génération existante ;
+# au-delà du registre du process, la réponse complète enregistrée en base est rejouée
+LLM_SINGLE_FLIGHT = {
+    'enabled': True,
+    'replay_ttl': 300,      # secondes pendant lesquelles une réponse terminée est rejouée depuis la mémoire
+    'max_entries': 1000,
+}
+
+# Flux SSE reprenables (Accept: text/event-stream) : chaque fragment porte un id
+# '<generationId>:<index>' ; un client reconnecté avec Last-Event-ID reprend la suite.
+LLM_STREAM_REPLAY = {
+    'backend': os.environ.get('LLM_STREAM_REPLAY_BACKEND', 'disk'),  # 'memory' (worker courant) ou 'disk'
+    'directory': os.path.join(BASE_DIR, 'data', 'streams'),          # partagé par les workers de la machine
+    'ttl': 600,             # secondes de conservation des journaux
+    'resume_grace': 30.0,   # secondes pendant lesquelles la génération continue sans client connecté
+    'poll_interval': 0.1,   # suivi d'un journal écrit par un autre worker
+    'stale_after': 30.0,    # journal sans progression : producteur perdu
+    'retry_ms': 2000,       # délai de reconnexion suggéré aux clients
+}
+
+# Regroupement des tokens avant écriture sur la réponse (chatapp.streaming.TokenCoalescer) :
+# moins d'écritures et d'appels système par réponse, au prix d'une latence bornée.
+# Mesure : python manage.py bench_coalescing
+LLM_STREAM_COALESCING = {
+    'enabled': os.environ.get('LLM_STREAM_COALESCING', 'true').lower() == 'true',
+    'max_bytes': int(os.environ.get('LLM_STREAM_COALESCE_BYTES', 256)),    # envoi dès ce nombre d'octets
+    'max_delay_ms': int(os.environ.get('LLM_STREAM_COALESCE_DELAY_MS', 50)),  # ou dès que le plus ancien token attend autant
+    'flush_first': True,    # premier token envoyé seul (temps avant premier octet inchangé)
+}
+
+# Enregistrement différé des réponses dans Message.content (chatapp.persistence)
+LLM_MESSAGE_PERSISTENCE = {
+    'checkpoint_tokens': 50,     # point de sauvegarde tous les ~50 tokens...
+    'checkpoint_seconds': 2.0,   # ...ou toutes les 2 secondes
+    'flush_interval': 0.5,       # écriture groupée des points de sauvegarde de tous les flux
+}
+
+# Cache exact des réponses (chatapp.caching) : questions identiques (après normalisation)
+# avec le même historique, template, modèle et paramètres d'échantillonnage
+LLM_RESPONSE_CACHE = {
+    'enabled': os.environ.get('LLM_RESPONSE_CACHE', 'true').lower() == 'true',
+    'ttl': 3600,                     # secondes
+    'max_entries': 500,              # éviction LRU au-delà
+    'max_history_messages': 4,       # seuls les débuts de conversation sont mis en cache
+    'max_answer_chars': 20000,
+    'replay_tokens_per_second': 200, # rythme de rejeu d'une réponse en cache (0 : immédiat)
+    'replay_chunk_chars': 24,
+}
+
+# Cache sémantique des premières questions (chatapp.semantic) : plongement local par
+# n-grammes hachés, index NumPy en mémoire, aucun service externe.
+# Interrupteur et inspection : /api/chat/semantic-cache/ (administrateurs)
+LLM_SEMANTIC_CACHE = {
+    # Désactivé par défaut : le cache est partagé entre utilisateurs, à activer après validation
+    'enabled': os.environ.get('LLM_SEMANTIC_CACHE', 'false').lower() == 'true',
+    'threshold': 0.92,           # cosinus à dépasser strictement pour réutiliser une réponse
+    'dedupe_threshold': 0.97,    # au-delà, une nouvelle réponse remplace l'entrée existante
+    'ttl': 86400,
+    'max_entries': 1000,
+    'max_question_chars': 200,   # les questions longues (souvent personnelles) ne sont pas indexées
+    'dim': 2048,
+    # Formulations équivalentes du domaine, ramenées à une forme commune avant plongement
+    'synonyms': {
+        'combien coute': 'prix', 'cout': 'prix', 'tarif': 'prix', 'tarifs': 'prix', 'cotisation': 'prix',
+        '2 roues': 'moto', 'deux roues': 'moto', 'scooter': 'moto', 'motos': 'moto',
+        'voiture': 'auto', 'automobile': 'auto', 'vehicule': 'auto',
+        'papiers': 'documents', 'pieces': 'documents', 'justificatifs': 'documents',
+        'resiliation': 'resilier',
+    },
+}
+
+# Comptage des tokens (tiktoken) : encodage par modèle, les autres utilisent default_encoding
+LLM_TOKENIZER = {
+    'default_encoding': 'cl100k_base',
+    'encodings': {},
+    # Fichiers BPE : téléchargés par `manage.py preload_tokenizers` (build, déploiement) dans
+    # cache_dir, chargés en arrière-plan au démarrage ; jamais de téléchargement pendant une requête
+    'cache_dir': os.environ.get('TIKTOKEN_CACHE_DIR', os.path.join(BASE_DIR, 'data', 'tiktoken')),
+    'preload': ['cl100k_base', 'o200k_base'],
+    'preload_on_startup': True,
+}
+
+# Fenêtrage de l'historique : budget de tokens du prompt (template + historique + message) par modèle
+LLM_CONTEXT = {
+    'default_budget': 4000,
+    'budgets': {
+        'gpt-3.5-turbo': 3000,
+        'gpt-4o-mini': 8000,
+        'llama': 6000,
+    },
+    'recent_messages': 6,        # derniers messages repris tels quels
+    'compressed_chars': 280,     # messages plus anciens tronqués à cette longueur
+    'state_recent_messages': 4,  # messages conservés quand l'état du dossier est injecté
+}
+
+# Résumé glissant des conversations, mis à jour en arrière-plan par un modèle peu coûteux
+LLM_CONVERSATION_SUMMARY = {
+    'enabled': os.environ.get('LLM_CONVERSATION_SUMMARY', 'true').lower() == 'true',
+    'model': 'gpt-4o-mini',
+    'every_turns': 4,           # échanges sortis de la fenêtre récente avant mise à jour
+    'temperature': 0.2,
+    'max_tokens': 400,
+    'max_chars': 3000,
+    'workers': 1,
+}
+
+# Parcours de souscription : état structuré par conversation (produit, pièces, devis)
+LLM_FUNNEL = {
+    'direct_answers': True,     # pièces manquantes et devis calculé servis sans appel LLM
+    'documents': {
+        'automobile': ['carte_grise', 'cip', 'permis'],
+        'moto': ['carte_grise', 'cip', 'permis'],
+        'habitation': ['cip'],
+        'voyage': ['cip'],
+        'sante': ['cip'],
+    },
+    'zones': ['Cotonou', 'Porto-Novo', 'Parakou', 'Abomey-Calavi'],
+    # Grille de primes annuelles (FCFA) ; un produit absent n'a pas de devis automatique.
+    # Ex. : 'moto': {'base': 25000, 'per_cv': 1500, 'professional_factor': 1.3}
+    'tariffs': {},
+}
+
+# Décompte des tokens par tour (TokenUsage, Conversation.total_tokens), écrit par lots
+LLM_USAGE = {
+    'flush_interval': 2.0,
+    'max_batch': 200,           # au-delà, écriture sans attendre l'intervalle
+}
+
+# Quota quotidien de tokens par utilisateur (tous modèles), vérifié avant chaque génération
+LLM_QUOTA = {
+    'enabled': os.environ.get('LLM_QUOTA', 'true').lower() == 'true',
+    'daily_tokens': int(os.environ.get('LLM_DAILY_TOKENS', '200000')),
+    'cache_ttl': 300,           # relecture des cumuls au plus tard après ce délai
+}
+
+# Cache partagé (seaux de limitation, quotas, interrupteurs). LocMem par défaut ; pour
+# plusieurs workers sans service externe : DJANGO_CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+# et DJANGO_CACHE_LOCATION=chat_cache (puis `python manage.py createcachetable`)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'chatapp'),
+    }
+}
+
+# Limitation de débit par utilisateur (seaux à jetons dans le cache) : requêtes par vue
+# (throttle_scope) et tokens LLM consommés, tous endpoints confondus
+LLM_RATE_LIMIT = {
+    'enabled': os.environ.get('LLM_RATE_LIMIT', 'true').lower() == 'true',
+    'buckets': {
+        'chat': {'capacity': 20, 'per_minute': 10},
+        'cards': {'capacity': 5, 'per_minute': 2},
+        'llm_tokens': {'capacity': 60000, 'per_minute': 6000},
+    },
+}